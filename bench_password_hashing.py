@@ -0,0 +1,59 @@
+"""
+Benchmark the password hashing pool: how many logins (bcrypt verifications) per second
+the server can absorb at a given cost factor, overall and per core.
+
+Usage:
+  python bench_password_hashing.py [--rounds 12] [--workers N] [--logins 200]
+
+Reads settings.passwordHashing from config/products.json for defaults when present.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import wait
+
+from password_hashing import PasswordHasher
+
+
+def load_defaults() -> dict:
+    try:
+        with open('config/products.json', 'r', encoding='utf-8') as f:
+            return (json.load(f).get('settings', {}) or {}).get('passwordHashing', {}) or {}
+    except Exception:
+        return {}
+
+
+def main():
+    defaults = load_defaults()
+    parser = argparse.ArgumentParser(description='Password hashing throughput benchmark')
+    parser.add_argument('--rounds', type=int, default=int(defaults.get('rounds', 12)))
+    parser.add_argument('--workers', type=int, default=int(defaults.get('workers', os.cpu_count() or 1)))
+    parser.add_argument('--logins', type=int, default=200)
+    args = parser.parse_args()
+
+    hasher = PasswordHasher(rounds=args.rounds, workers=args.workers, max_queue=args.logins + 1, timeout=600)
+    hasher.start()
+    hashed = hasher.hash('benchmark-password')
+
+    started = time.perf_counter()
+    futures = [hasher.verify_async('benchmark-password', hashed) for _ in range(args.logins)]
+    wait(futures)
+    elapsed = time.perf_counter() - started
+    ok = all(f.result() for f in futures)
+    stats = hasher.stats()
+    hasher.shutdown()
+    if not ok:
+        print('[X] Verification returned False')
+        return
+
+    per_second = args.logins / elapsed
+    print(f'rounds={args.rounds} workers={args.workers} logins={args.logins}')
+    print(f'  elapsed:          {elapsed:.2f}s')
+    print(f'  avg per login:    {stats["avgMs"]}ms (queue wait included)')
+    print(f'  logins/sec:       {per_second:.1f}')
+    print(f'  logins/sec/core:  {per_second / args.workers:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,10 @@ import requests
 import json
 import base64
 import os
-from typing import List, Optional, Dict
+import random
+import secrets
+import time
+from typing import Callable, List, Optional, Dict, Tuple
 import logging
 from dotenv import load_dotenv
 import urllib.parse
@@ -28,6 +31,8 @@ class GitHubStockManager:
             "Accept": "application/vnd.github.v3+json",
             "User-Agent": "Stock-Manager"
         }
+        # Called as on_stock_written(file_path, key_count) after add/remove_key_from_stock writes
+        self.on_stock_written: Optional[Callable[[str, int], None]] = None
     
     def get_file_content(self, file_path: str) -> List[str]:
         """Get current stock from GitHub file."""
@@ -47,19 +52,8 @@ class GitHubStockManager:
             response.raise_for_status()
             file_data = response.json()
             
-            content = base64.b64decode(file_data['content']).decode('utf-8').strip()
-            
-            if not content:
-                return []
-            
-            try:
-                stock_data = json.loads(content)
-                if isinstance(stock_data, list):
-                    return stock_data
-                else:
-                    return []
-            except json.JSONDecodeError:
-                return [line.strip() for line in content.split('\n') if line.strip()]
+            content = base64.b64decode(file_data['content']).decode('utf-8')
+            return self._parse_keys(content)
                 
         except Exception as e:
             try:
@@ -68,6 +62,28 @@ class GitHubStockManager:
                 logger.error(f"Failed to fetch stock from GitHub {file_path}. Error: {e}")
             return []
     
+    def read_stock_keys(self, file_path: str) -> Optional[List[str]]:
+        """Like get_file_content, but returns None when GitHub could not be read, so a failed
+        read is not mistaken for an empty stock file (a missing file is still [])."""
+        try:
+            text, _sha = self.get_raw_file(file_path)
+        except Exception as e:
+            logger.error(f"Failed to fetch stock from GitHub {file_path}: {e}")
+            return None
+        return self._parse_keys(text or '')
+
+    @staticmethod
+    def _parse_keys(content: str) -> List[str]:
+        """Stock file body -> keys (a JSON list, or one key per line)."""
+        content = content.strip()
+        if not content:
+            return []
+        try:
+            stock_data = json.loads(content)
+            return stock_data if isinstance(stock_data, list) else []
+        except json.JSONDecodeError:
+            return [line.strip() for line in content.split('\n') if line.strip()]
+    
     def update_file_content(self, file_path: str, keys: List[str], commit_message: str = None) -> bool:
         """Update GitHub file with new stock."""
         try:
@@ -140,7 +156,10 @@ class GitHubStockManager:
             updated_stock = list(set(current_stock + new_keys))
             
             commit_message = f"Add {len(new_keys)} new keys (total: {len(updated_stock)})"
-            return self.update_file_content(file_path, updated_stock, commit_message)
+            ok = self.update_file_content(file_path, updated_stock, commit_message)
+            if ok:
+                self._stock_written(file_path, len(updated_stock))
+            return ok
             
         except Exception as e:
             logger.error(f"Failed to add keys to stock: {e}")
@@ -158,12 +177,149 @@ class GitHubStockManager:
             updated_stock = [key for key in current_stock if key != key_to_remove]
             
             commit_message = f"Sold key: {key_to_remove} (remaining: {len(updated_stock)})"
-            return self.update_file_content(file_path, updated_stock, commit_message)
+            ok = self.update_file_content(file_path, updated_stock, commit_message)
+            if ok:
+                self._stock_written(file_path, len(updated_stock))
+            return ok
             
         except Exception as e:
             logger.error(f"Failed to remove key from stock: {e}")
             return False
+
+    def _stock_written(self, file_path: str, key_count: int):
+        if self.on_stock_written:
+            try:
+                self.on_stock_written(file_path, key_count)
+            except Exception as e:
+                logger.error(f"Stock write callback failed for {file_path}: {e}")
     
+    def _contents_url(self, file_path: str) -> str:
+        return f"{self.base_url}/contents/{urllib.parse.quote(file_path, safe='/')}"
+
+    def get_raw_file(self, file_path: str) -> Tuple[Optional[str], Optional[str]]:
+        """Return (text, sha) for a file, or (None, None) if it does not exist.
+        Other HTTP errors raise so callers can tell "missing" from "unreachable"."""
+        response = requests.get(self._contents_url(file_path), headers=self.headers, timeout=10)
+        if response.status_code == 404:
+            return None, None
+        response.raise_for_status()
+        file_data = response.json()
+        return base64.b64decode(file_data.get('content', '')).decode('utf-8'), file_data.get('sha')
+
+    @staticmethod
+    def _is_ref_race(response: requests.Response) -> bool:
+        """A 409/422 caused by another commit moving the branch at the same moment (not by this
+        file's content), e.g. "refs/heads/main is at X but expected Y"; safe to retry as is."""
+        try:
+            message = (response.json().get('message') or '').lower()
+        except ValueError:
+            message = (response.text or '').lower()
+        return 'but expected' in message or 'reference' in message or 'fast forward' in message
+
+    def put_raw_file(self, file_path: str, content: str, commit_message: str, sha: Optional[str] = None,
+                     ref_retries: int = 4) -> Optional[str]:
+        """Create (sha=None) or replace (sha of the version read) a file. Returns the new sha,
+        or None if the write failed or lost a race with another writer of this file (409/422).
+        Branch-ref races with unrelated commits are retried with backoff."""
+        payload = {
+            "message": commit_message,
+            "content": base64.b64encode(content.encode('utf-8')).decode('utf-8')
+        }
+        if sha:
+            payload["sha"] = sha
+        try:
+            for attempt in range(ref_retries + 1):
+                response = requests.put(self._contents_url(file_path), headers=self.headers, json=payload, timeout=10)
+                if response.status_code in (409, 422) and attempt < ref_retries and self._is_ref_race(response):
+                    time.sleep(random.uniform(0, 0.25 * (2 ** attempt)))
+                    continue
+                if response.status_code in (409, 422):
+                    logger.warning(f"Write conflict on {file_path} (HTTP {response.status_code})")
+                    return None
+                response.raise_for_status()
+                return response.json().get('content', {}).get('sha')
+        except Exception as e:
+            logger.error(f"Failed to write GitHub file {file_path}: {e}")
+            return None
+
+    def list_directory(self, dir_path: str, entry_type: str = 'file') -> List[Dict]:
+        """List a directory's files (or, with entry_type='dir', subdirectories) as
+        [{'name', 'path', 'sha'}]; [] if it does not exist.
+        The contents API returns at most 1000 entries per directory."""
+        response = requests.get(self._contents_url(dir_path), headers=self.headers, timeout=10)
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        entries = response.json()
+        if not isinstance(entries, list):
+            return []
+        return [{'name': e.get('name'), 'path': e.get('path'), 'sha': e.get('sha')} for e in entries if e.get('type') == entry_type]
+
+    def list_tree(self, prefix: str) -> List[Dict]:
+        """List every file below prefix in one call (recursive git tree of the default branch)
+        as [{'path', 'sha'}]. GitHub truncates very large trees; that is logged."""
+        response = requests.get(f"{self.base_url}/git/trees/HEAD?recursive=1", headers=self.headers, timeout=20)
+        if response.status_code in (404, 409):
+            return []
+        response.raise_for_status()
+        data = response.json()
+        if data.get('truncated'):
+            logger.warning(f"Git tree listing truncated; some files under {prefix} may be missing")
+        prefix = prefix.rstrip('/') + '/'
+        return [{'path': e['path'], 'sha': e.get('sha')} for e in data.get('tree', [])
+                if e.get('type') == 'blob' and e.get('path', '').startswith(prefix)]
+
+    def delete_file(self, file_path: str, sha: str, commit_message: str) -> bool:
+        try:
+            response = requests.delete(self._contents_url(file_path), headers=self.headers,
+                                       json={"message": commit_message, "sha": sha}, timeout=10)
+            if response.status_code == 404:
+                return True
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to delete GitHub file {file_path}: {e}")
+            return False
+
+    def _default_branch(self) -> str:
+        if not getattr(self, '_branch', None):
+            response = requests.get(self.base_url, headers=self.headers, timeout=10)
+            response.raise_for_status()
+            self._branch = response.json().get('default_branch') or 'main'
+        return self._branch
+
+    def delete_files(self, file_paths: List[str], commit_message: str, max_attempts: int = 4) -> bool:
+        """Delete several files in a single commit through the git data API (one tree and one
+        commit, instead of one DELETE commit per file). Retried if the branch moved meanwhile."""
+        if not file_paths:
+            return True
+        try:
+            branch = self._default_branch()
+            for attempt in range(max_attempts):
+                ref = requests.get(f"{self.base_url}/git/ref/heads/{branch}", headers=self.headers, timeout=10)
+                ref.raise_for_status()
+                head = ref.json()['object']['sha']
+                commit = requests.get(f"{self.base_url}/git/commits/{head}", headers=self.headers, timeout=10)
+                commit.raise_for_status()
+                tree = requests.post(f"{self.base_url}/git/trees", headers=self.headers, timeout=20, json={
+                    'base_tree': commit.json()['tree']['sha'],
+                    'tree': [{'path': path, 'mode': '100644', 'type': 'blob', 'sha': None} for path in file_paths],
+                })
+                tree.raise_for_status()
+                new_commit = requests.post(f"{self.base_url}/git/commits", headers=self.headers, timeout=10, json={
+                    'message': commit_message, 'tree': tree.json()['sha'], 'parents': [head]})
+                new_commit.raise_for_status()
+                update = requests.patch(f"{self.base_url}/git/refs/heads/{branch}", headers=self.headers, timeout=10,
+                                        json={'sha': new_commit.json()['sha'], 'force': False})
+                if update.status_code == 422 and attempt < max_attempts - 1:
+                    time.sleep(random.uniform(0, 0.25 * (2 ** attempt)))
+                    continue
+                update.raise_for_status()
+                return True
+        except Exception as e:
+            logger.error(f"Failed to delete {len(file_paths)} GitHub files: {e}")
+        return False
+
     def get_stock_count(self, file_path: str) -> int:
         """Get current stock count."""
         stock = self.get_file_content(file_path)
@@ -218,6 +374,77 @@ class GitHubStockManager:
         """Check if a key already exists."""
         return key in existing_keys
 
+class GitHubSegmentedLog:
+    """Append-only record log on top of the contents API.
+
+    Every append creates one small file under segment_dir (a single PUT, independent of how
+    many records exist). compact() folds the segments into snapshot_path with a caller
+    supplied merge function, writes it with the sha it read, then deletes the folded segment
+    files in one commit. Readers rebuild state from snapshot + remaining segments; the merge must be
+    idempotent because a crash between the snapshot write and the deletes replays segments.
+    """
+
+    def __init__(self, manager: GitHubStockManager, snapshot_path: str, segment_dir: str):
+        self.manager = manager
+        self.snapshot_path = snapshot_path
+        self.segment_dir = segment_dir.rstrip('/')
+
+    def append(self, record: Dict, attempts: int = 3) -> bool:
+        """Write record as a new, uniquely named segment. A failed create cannot be a content
+        conflict, so it is retried (under a fresh name) with backoff."""
+        body = json.dumps(record, separators=(',', ':'))
+        for attempt in range(attempts):
+            name = f"{int(time.time() * 1000):013d}-{secrets.token_hex(4)}.json"
+            if self.manager.put_raw_file(f"{self.segment_dir}/{name}", body, f"Append {name}") is not None:
+                return True
+            if attempt < attempts - 1:
+                time.sleep(random.uniform(0, 0.25 * (2 ** attempt)))
+        return False
+
+    def read_snapshot(self) -> Tuple[List[str], Optional[str]]:
+        """Return (entries, sha) of the snapshot file; a JSON list or newline separated lines."""
+        text, sha = self.manager.get_raw_file(self.snapshot_path)
+        if not text or not text.strip():
+            return [], sha
+        if text.lstrip().startswith('['):
+            try:
+                data = json.loads(text)
+                if isinstance(data, list):
+                    return [str(item).strip() for item in data if str(item).strip()], sha
+            except json.JSONDecodeError:
+                pass
+        return [line.strip() for line in text.split('\n') if line.strip()], sha
+
+    def read_segments(self) -> List[Tuple[Dict, Dict]]:
+        """Return [(file_entry, record)] for every segment, oldest first."""
+        out = []
+        for entry in sorted(self.manager.list_directory(self.segment_dir), key=lambda e: e['name']):
+            try:
+                text, _sha = self.manager.get_raw_file(entry['path'])
+                if text:
+                    out.append((entry, json.loads(text)))
+            except Exception as e:
+                logger.warning(f"Skipping unreadable log segment {entry.get('path')}: {e}")
+        return out
+
+    def compact(self, merge: Callable[[List[str], List[Dict]], List[str]]) -> int:
+        """Fold all current segments into the snapshot. Returns the number of segments folded
+        (0 if there was nothing to do or the snapshot write lost a race)."""
+        segments = self.read_segments()
+        if not segments:
+            return 0
+        lines, sha = self.read_snapshot()
+        new_lines = merge(lines, [record for _entry, record in segments])
+        content = '\n'.join(new_lines) + ('\n' if new_lines else '')
+        message = f"Compact {len(segments)} log records into {self.snapshot_path} ({len(new_lines)} total)"
+        if self.manager.put_raw_file(self.snapshot_path, content, message, sha=sha) is None:
+            return 0
+        if not self.manager.delete_files([entry['path'] for entry, _record in segments],
+                                         f"Remove {len(segments)} compacted log segments"):
+            logger.warning(f"Compacted segments under {self.segment_dir} not deleted; they will be folded again")
+        logger.info(message)
+        return len(segments)
+
 def test_github_connection():
     """Test GitHub connection and permissions."""
     print("🔍 Testing GitHub Connection...")
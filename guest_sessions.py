@@ -0,0 +1,145 @@
+"""
+Guest Purchase Sessions
+Anonymous /start-purchase visitors get a short-lived in-memory session instead of a
+durable account record. Sessions expire after ttlSeconds without activity; an optional
+local JSON snapshot carries live sessions across restarts.
+"""
+
+import json
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class GuestSessionStore:
+    PREFIX = 'guest_'
+
+    def __init__(self, ttl: float = 7200.0, maxsize: int = 50000, snapshot_path: Optional[str] = None,
+                 snapshot_interval: float = 30.0):
+        """ttl: idle seconds before a guest session is dropped; snapshot_path: local file the
+        live sessions are written to every snapshot_interval seconds (disabled when None)."""
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl, sliding=True, name='guest_sessions')
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._snapshotter = None
+        self.promoted = 0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.guestSessions overrides (ttlSeconds, snapshotFile, snapshotIntervalSeconds)."""
+        if not cfg:
+            return
+        self.ttl = float(cfg.get('ttlSeconds', self.ttl))
+        self._sessions.ttl = self.ttl
+        self.snapshot_interval = float(cfg.get('snapshotIntervalSeconds', self.snapshot_interval))
+        snapshot_path = cfg.get('snapshotFile') or None
+        changed = snapshot_path != self.snapshot_path
+        self.snapshot_path = snapshot_path
+        if snapshot_path and changed:
+            self.load_snapshot()
+
+    @classmethod
+    def is_guest_id(cls, user_id) -> bool:
+        return isinstance(user_id, str) and user_id.startswith(cls.PREFIX)
+
+    def __contains__(self, guest_id) -> bool:
+        return guest_id in self._sessions
+
+    def _touch(self, session: dict):
+        session['last_seen'] = time.time()
+        self._dirty = True
+
+    def get_or_create(self, guest_id: str) -> dict:
+        """Return the user view for guest_id, opening a new session if none is live."""
+        with self._lock:
+            session = self._sessions.get(guest_id)
+            if session is None:
+                session = {'user_id': guest_id, 'username': guest_id, 'guest': True,
+                           'created_at': _now_iso()}
+                self._sessions.set(guest_id, session)
+            self._touch(session)
+            self._ensure_snapshotter()
+            return self._view(session)
+
+    def get_user_by_id(self, guest_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.get(guest_id)
+            return self._view(session) if session else None
+
+    @staticmethod
+    def _view(session: dict) -> dict:
+        return {k: v for k, v in session.items() if k != 'last_seen'}
+
+    def mark_promoted(self, guest_id):
+        """Note that guest_id now also has a durable account record."""
+        with self._lock:
+            session = self._sessions.get(guest_id)
+            if session is not None and not session.get('promoted'):
+                session['promoted'] = True
+                self.promoted += 1
+                self._touch(session)
+
+    def load_snapshot(self):
+        """Restore sessions from snapshot_path, keeping only those still inside their ttl."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                sessions = json.load(f)
+        except Exception as e:
+            logger.error(f"Guest session snapshot unreadable: {e}")
+            return
+        now = time.time()
+        restored = 0
+        with self._lock:
+            for guest_id, session in sessions.items():
+                remaining = self.ttl - (now - float(session.get('last_seen', 0)))
+                if remaining > 0 and guest_id not in self._sessions:
+                    self._sessions.set(guest_id, session, ttl=remaining)
+                    restored += 1
+        logger.info(f"Restored {restored} guest sessions from {self.snapshot_path}")
+
+    def save_snapshot(self):
+        """Write live sessions to snapshot_path (tmp file + rename) if anything changed."""
+        if not self.snapshot_path or not self._dirty:
+            return
+        with self._lock:
+            self._dirty = False
+            body = json.dumps(dict(self._sessions.items()), separators=(',', ':'))
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(body)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Guest session snapshot write failed: {e}")
+
+    def _ensure_snapshotter(self):
+        if self.snapshot_path and self._snapshotter is None:
+            self._snapshotter = threading.Thread(target=self._snapshot_loop, name='guest-snapshot', daemon=True)
+            self._snapshotter.start()
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.save_snapshot()
+
+    def stats(self) -> dict:
+        counters = self._sessions.stats()
+        counters['promoted'] = self.promoted
+        counters['snapshot'] = self.snapshot_path
+        return counters
@@ -7,6 +7,7 @@
   const usernameInput = document.getElementById('admin-username');
   const passwordInput = document.getElementById('admin-password');
   const accountsTableBody = document.querySelector('#accounts-table tbody');
+  const accountSearchInput = document.getElementById('account-search');
 
   const accountDrawer = document.getElementById('account-drawer');
   const drawerBackdrop = document.getElementById('drawer-backdrop');
@@ -27,6 +28,12 @@
   const purchaseNext = document.getElementById('purchase-next');
   const purchaseClose = document.getElementById('purchase-close');
 
+  const analyticsChart = document.getElementById('analytics-chart');
+  const analyticsTableBody = document.querySelector('#analytics-table tbody');
+  const analyticsGranularity = document.getElementById('analytics-granularity');
+  const analyticsBackfillBtn = document.getElementById('analytics-backfill');
+  const analyticsStatus = document.getElementById('analytics-status');
+
   let currentPurchases = [];
   let currentPage = 1;
   const pageSize = 12;
@@ -53,6 +60,7 @@
         loginView.classList.add('hidden');
         panelView.classList.remove('hidden');
         loadAccounts();
+        loadAnalytics();
       } else {
         showToast(data.error||'Login failed','error');
       }
@@ -71,7 +79,8 @@
   async function loadAccounts(){
     accountsTableBody.innerHTML='<tr><td colspan="6" style="padding:1rem;opacity:.6;">Loading...</td></tr>';
     try{
-      const res = await fetch('/admin/accounts');
+      const q = accountSearchInput ? accountSearchInput.value.trim() : '';
+      const res = await fetch('/admin/accounts'+(q ? '?q='+encodeURIComponent(q) : ''));
       const data = await res.json();
       if(!data.success){ accountsTableBody.innerHTML='<tr><td colspan="6" style="padding:1rem;opacity:.6;">'+(data.error||'Failed')+'</td></tr>'; return; }
       if(!data.accounts.length){ accountsTableBody.innerHTML='<tr><td colspan="6" style="padding:1rem;opacity:.6;">No accounts found</td></tr>'; return; }
@@ -89,6 +98,59 @@
     }
   }
 
+  async function loadAnalytics(){
+    if(!analyticsTableBody) return;
+    analyticsTableBody.innerHTML='<tr><td colspan="4" style="padding:1rem;opacity:.6;">Loading...</td></tr>';
+    try{
+      const res = await fetch('/admin/analytics?granularity='+encodeURIComponent(analyticsGranularity.value));
+      const data = await res.json();
+      if(!data.success){ analyticsTableBody.innerHTML='<tr><td colspan="4" style="padding:1rem;opacity:.6;">'+(data.error||'Failed')+'</td></tr>'; return; }
+      const status=data.status||{};
+      analyticsStatus.textContent = status.backfillRunning ? 'Rebuilding...' : (status.lastBackfill ? 'Rebuilt '+formatDate(status.lastBackfill.finished*1000) : '');
+      const perBucket={};
+      const rows=Object.keys(data.products).map(pid=>{
+        let best=null;
+        for(const b of data.products[pid]){
+          perBucket[b.bucket]=(perBucket[b.bucket]||0)+b.revenue;
+          if(!best||b.revenue>best.revenue) best=b;
+        }
+        return {pid, name:(data.names||{})[pid]||pid, total:data.totals[pid], best};
+      }).sort((a,b)=>b.total.revenue-a.total.revenue);
+      renderAnalyticsChart(perBucket);
+      if(!rows.length){ analyticsTableBody.innerHTML='<tr><td colspan="4" style="padding:1rem;opacity:.6;">No sales in this window</td></tr>'; return; }
+      analyticsTableBody.innerHTML='';
+      for(const r of rows){
+        const tr=document.createElement('tr');
+        tr.innerHTML=`<td>${r.name}</td><td><span class="badge">${r.total.count}</span></td><td>R$${Number(r.total.revenue).toFixed(2)}</td><td>${r.best?r.best.bucket+' · R$'+Number(r.best.revenue).toFixed(2)+' · '+r.best.buyers+' buyers':'-'}</td>`;
+        analyticsTableBody.appendChild(tr);
+      }
+    }catch(e){
+      analyticsTableBody.innerHTML='<tr><td colspan="4" style="padding:1rem;opacity:.6;">Error loading</td></tr>';
+    }
+  }
+
+  function renderAnalyticsChart(perBucket){
+    analyticsChart.innerHTML='';
+    const buckets=Object.keys(perBucket).sort();
+    const max=Math.max(1,...buckets.map(b=>perBucket[b]));
+    for(const b of buckets){
+      const bar=document.createElement('div');
+      bar.title=b+': R$'+Number(perBucket[b]).toFixed(2);
+      bar.style.cssText='flex:1;min-width:3px;background:linear-gradient(180deg,#8b5cf6,#6366f1);border-radius:3px 3px 0 0;height:'+Math.max(2,Math.round(perBucket[b]/max*90))+'px;';
+      analyticsChart.appendChild(bar);
+    }
+  }
+
+  async function backfillAnalytics(){
+    if(!confirm('Rebuild sales rollups from the full purchase log?')) return;
+    try{
+      const res = await fetch('/admin/analytics/backfill',{method:'POST'});
+      const data = await res.json();
+      showToast(data.message||data.error||'Backfill requested', data.success?'success':'error');
+      setTimeout(loadAnalytics, 3000);
+    }catch(e){ showToast('Backfill error','error'); }
+  }
+
   function copy(text){ navigator.clipboard.writeText(text).then(()=>showToast('Copied','success')).catch(()=>showToast('Copy failed','error')); }
 
   function renderPurchases(){
@@ -222,5 +284,8 @@
   loginBtn.addEventListener('click', adminLogin);
   passwordInput.addEventListener('keydown', e=>{ if(e.key==='Enter') adminLogin(); });
   logoutBtn.addEventListener('click', adminLogout);
-  refreshBtn.addEventListener('click', loadAccounts);
+  refreshBtn.addEventListener('click', ()=>{ loadAccounts(); loadAnalytics(); });
+  if(analyticsGranularity) analyticsGranularity.addEventListener('change', loadAnalytics);
+  if(analyticsBackfillBtn) analyticsBackfillBtn.addEventListener('click', backfillAnalytics);
+  if(accountSearchInput) accountSearchInput.addEventListener('keydown', e=>{ if(e.key==='Enter') loadAccounts(); });
 })();
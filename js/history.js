@@ -2,9 +2,14 @@
   let API_BASE = '';
   fetch('/config.json').then(r=>r.ok?r.json():null).then(cfg=>{ if(cfg && cfg.baseUrl){ API_BASE = cfg.baseUrl.replace(/\/$/,''); } }).catch(()=>{});
   const PAGE_SIZE = 12;
+  const FETCH_SIZE = 48;
   let state = {
     user: null,
     purchases: [],
+    nextCursor: null,
+    totalPurchases: 0,
+    totalSpent: 0,
+    loadingMore: false,
     filtered: [],
     page: 1,
     view: 'grid',
@@ -51,13 +56,42 @@
     return null;
   }
 
-  async function loadPurchases() {
+  async function loadPurchases(cursor) {
     try {
-      const res = await makeAuthRequest('/purchase-history');
-      if(!res.ok) return [];
-      const data = await res.json();
-      return data.purchases || [];
-    } catch(e){ console.error('load purchases', e); return []; }
+      let path = `/purchase-history?limit=${FETCH_SIZE}`;
+      if(cursor) path += `&before=${encodeURIComponent(cursor)}`;
+      const res = await makeAuthRequest(path);
+      if(!res.ok) return null;
+      return await res.json();
+    } catch(e){ console.error('load purchases', e); return null; }
+  }
+
+  function applyPage(data) {
+    if(!data) return;
+    state.purchases = state.purchases.concat(data.purchases || []);
+    state.nextCursor = data.nextCursor || null;
+    state.totalPurchases = data.total_purchases || state.purchases.length;
+    state.totalSpent = data.total_spent != null ? data.total_spent : state.purchases.reduce((s,p)=> s + (p.price||0),0);
+  }
+
+  async function loadMore() {
+    if(!state.nextCursor || state.loadingMore) return;
+    state.loadingMore = true;
+    renderLoadMore();
+    try {
+      applyPage(await loadPurchases(state.nextCursor));
+    } finally {
+      state.loadingMore = false;
+    }
+    renderPurchases();
+  }
+
+  function renderLoadMore() {
+    const btn = $('loadMore');
+    if(!btn) return;
+    btn.style.display = state.nextCursor ? 'inline-block' : 'none';
+    btn.disabled = state.loadingMore;
+    btn.textContent = state.loadingMore ? 'Loading…' : `Load more (${state.totalPurchases - state.purchases.length} older)`;
   }
 
   function applyFilters() {
@@ -101,12 +135,13 @@
       return;
     }
 
-    pagEl.style.display = totalPages > 1 ? 'flex' : 'none';
+    pagEl.style.display = (totalPages > 1 || state.nextCursor) ? 'flex' : 'none';
     $('pageInfo').textContent = `Page ${state.page} / ${totalPages}`;
     const prevBtn = $('prevPage');
     const nextBtn = $('nextPage');
     prevBtn.disabled = state.page <= 1;
     nextBtn.disabled = state.page >= totalPages;
+    renderLoadMore();
   }
 
   function buildCard(p) {
@@ -163,9 +198,8 @@
     if(!state.user) return;
     $('username').textContent = state.user.username;
     $('member-since').textContent = 'Member since ' + formatDate(state.user.created_at);
-    $('total-purchases').textContent = state.purchases.length;
-    const totalSpent = state.purchases.reduce((s,p)=> s + (p.price||0),0);
-    $('total-spent').textContent = totalSpent;
+    $('total-purchases').textContent = state.totalPurchases;
+    $('total-spent').textContent = state.totalSpent;
   }
 
   function attachEvents() {
@@ -174,6 +208,7 @@
     $('viewMode').addEventListener('change', e => { state.view = e.target.value; renderPurchases(); });
     $('prevPage').addEventListener('click', () => { if(state.page>1){ state.page--; renderPurchases(); }});
     $('nextPage').addEventListener('click', () => { state.page++; renderPurchases(); });
+    $('loadMore').addEventListener('click', loadMore);
 
     $('logout-btn').addEventListener('click', logout);
 
@@ -285,7 +320,7 @@
     show($('loading'));
 
     try {
-      state.purchases = await loadPurchases();
+      applyPage(await loadPurchases());
     } finally {
       hide($('loading'));
       show($('purchasesSection'));
@@ -14,6 +14,7 @@ class LicenseManager {
         this.purchaseAttempts = new Map();
         this.state = 'idle';
         this.pendingSession = null; 
+        this.purchaseStream = null;
 
         this.init();
     }
@@ -397,7 +398,8 @@ class LicenseManager {
         
         try { 
             await this.startPurchaseSession(username);
-            this.updateStatus('Ready for purchase verification. Buy the gamepass, then click the "I Have Purchased The Gamepass" button below.', 'blue', true);
+            this.startPurchaseVerification(username);
+            this.updateStatus('Ready for purchase verification. Buy the gamepass and your key will appear here automatically, or click the "I Have Purchased The Gamepass" button below.', 'blue', true);
             const purchaseContainer = document.querySelector('.purchase-container');
             if (purchaseContainer) {
                 this.showManualCheckButton(purchaseContainer);
@@ -501,8 +503,42 @@ class LicenseManager {
         parent.appendChild(div);
     }
 
-    stopPurchaseVerification() {}
-    startPurchaseVerification() {}
+    stopPurchaseVerification() {
+        if (this.purchaseStream) {
+            this.purchaseStream.close();
+            this.purchaseStream = null;
+        }
+    }
+
+    startPurchaseVerification(username) {
+        if (!window.EventSource || !this.product || !username) return;
+        this.stopPurchaseVerification();
+        const params = new URLSearchParams({ product_id: this.product.id, roblox_username: username });
+        const stream = new EventSource(`/purchase-stream?${params.toString()}`, { withCredentials: true });
+        this.purchaseStream = stream;
+        stream.onmessage = (event) => {
+            let msg;
+            try { msg = JSON.parse(event.data); } catch (e) { return; }
+            if (this.purchaseCompleted) {
+                this.stopPurchaseVerification();
+                return;
+            }
+            if (msg.status === 'detected') {
+                this.updateStatus('Purchase detected! Issuing your key...', 'blue');
+            } else if (msg.status === 'key_issued') {
+                this.stopPurchaseVerification();
+                this._handleCheckResponse(username, msg.result);
+            } else if (msg.status === 'expired') {
+                this.stopPurchaseVerification();
+                this.updateStatus('Purchase session expired. Enter your username again to start a new one.', 'orange');
+            }
+        };
+        stream.onerror = () => {
+            if (stream.readyState === EventSource.CLOSED && this.purchaseStream === stream) {
+                this.purchaseStream = null;
+            }
+        };
+    }
 
     async fetchGamepassCheck(username, forceRefresh = false) {
         const maxRetries = 3;
@@ -750,6 +786,7 @@ class LicenseManager {
         try {
             if (!this.pendingSession || this.pendingSession.username.toLowerCase() !== username.toLowerCase()) {
                 await this.startPurchaseSession(username).catch(()=>{});
+                this.startPurchaseVerification(username);
             }
             const response = await this.fetchGamepassCheck(username, true);
             if (response.transactionId && this.checkTransactionClaimed(response.transactionId)) {
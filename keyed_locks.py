@@ -0,0 +1,80 @@
+"""
+Keyed Lock Registry
+One mutex per key (username, account id, ...), created on first use and dropped as soon as
+nobody holds or waits on it. Unlike a lock kept in an LRU/TTL cache, a lock in use can
+never be evicted and replaced, so two callers for the same key always share one mutex.
+"""
+
+import threading
+from typing import Dict, Hashable, Optional
+
+
+class KeyedLock:
+    """Handle for one key's lock; supports `with`, acquire(timeout=...) and release()."""
+
+    __slots__ = ('_registry', 'key')
+
+    def __init__(self, registry: 'KeyedLocks', key: Hashable):
+        self._registry = registry
+        self.key = key
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        return self._registry._acquire(self.key, blocking, timeout)
+
+    def release(self):
+        self._registry._release(self.key)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class KeyedLocks:
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, list] = {}  # key -> [Lock, holders + waiters]
+        self.acquisitions = 0
+        self.contended = 0
+
+    def get(self, key: Hashable) -> KeyedLock:
+        return KeyedLock(self, key)
+
+    def _acquire(self, key, blocking: bool, timeout: float) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [threading.Lock(), 0]
+            entry[1] += 1
+            if entry[0].locked():
+                self.contended += 1
+        acquired = entry[0].acquire(blocking, timeout) if blocking else entry[0].acquire(False)
+        with self._lock:
+            if acquired:
+                self.acquisitions += 1
+            else:
+                self._unref(key, entry)
+        return acquired
+
+    def _release(self, key):
+        with self._lock:
+            entry = self._entries[key]
+            entry[0].release()
+            self._unref(key, entry)
+
+    def _unref(self, key, entry):
+        # caller holds self._lock
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'acquisitions': self.acquisitions, 'contended': self.contended}
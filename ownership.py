@@ -0,0 +1,154 @@
+"""
+Gamepass Ownership Service
+Answers "does user X own gamepass Y" by probing the inventory endpoint and the legacy
+hasasset endpoint concurrently (or hedging the second after the inventory p95) and taking
+the first definitive answer. Results are cached with separate positive/negative TTLs.
+"""
+
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterable, Optional, Tuple
+
+from single_flight import SingleFlight
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_URL = 'https://inventory.roblox.com/v1/users/{uid}/items/GamePass/{gamepass_id}?limit=10'
+LEGACY_URL = 'https://api.roblox.com/ownership/hasasset?userId={uid}&assetId={gamepass_id}'
+
+
+class OwnershipService:
+    def __init__(self, client, positive_ttl: float = 30.0, negative_ttl: float = 8.0, mode: str = 'parallel',
+                 hedge_delay: float = 0.5, max_workers: int = 8):
+        """mode: 'parallel' probes both endpoints at once; 'hedge' starts the legacy probe only
+        if the inventory probe has not answered within its recent p95 (hedge_delay until known)."""
+        self.client = client
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self._cache = TTLCache(maxsize=20000, ttl=positive_ttl, name='ownership')
+        self._flight = SingleFlight()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ownership')
+        self._lock = threading.Lock()
+        self._winners: Dict[str, int] = {}
+        self.hedges = 0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.roblox.ownership overrides."""
+        if not cfg:
+            return
+        self.mode = cfg.get('mode', self.mode)
+        self.hedge_delay = float(cfg.get('hedgeDelayMs', self.hedge_delay * 1000)) / 1000.0
+        self.positive_ttl = float(cfg.get('positiveTtlSeconds', self.positive_ttl))
+        self.negative_ttl = float(cfg.get('negativeTtlSeconds', self.negative_ttl))
+
+    def check(self, user_id, gamepass_id, cookie: Optional[str] = None,
+              force_refresh: bool = False) -> Tuple[Optional[bool], str]:
+        """Return (owned, detail). owned is None when neither endpoint gave a usable answer
+        (rate limited, errors); callers must not treat that as a confirmed "not owned"."""
+        key = (str(user_id), str(gamepass_id))
+        if not force_refresh:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+        return self._flight.do(key, self._probe, user_id, gamepass_id, cookie)
+
+    def check_many(self, pairs: Iterable[Tuple], cookie: Optional[str] = None,
+                   force_refresh: bool = False) -> Dict[Tuple, Tuple[Optional[bool], str]]:
+        """Check several (user_id, gamepass_id) pairs concurrently; returns {pair: (owned, detail)}."""
+        unique = list(dict.fromkeys(pairs))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(8, len(unique)), thread_name_prefix='ownership-batch') as batch_pool:
+            futures = {pair: batch_pool.submit(self.check, pair[0], pair[1], cookie, force_refresh) for pair in unique}
+            return {pair: future.result() for pair, future in futures.items()}
+
+    def _headers(self, cookie: Optional[str]) -> dict:
+        headers = {'Accept': 'application/json'}
+        if cookie and 'PUT_.ROBLOSECURITY' not in cookie:
+            headers['Cookie'] = f'.ROBLOSECURITY={cookie}'
+        return headers
+
+    def _probe_inventory(self, uid, gamepass_id, headers) -> Tuple[Optional[bool], str]:
+        try:
+            r = self.client.get(INVENTORY_URL.format(uid=uid, gamepass_id=gamepass_id), endpoint='inventory', headers=headers)
+            if r.status_code == 200:
+                j = r.json()
+                data = j.get('data', []) if isinstance(j, dict) else []
+                return any(str(item.get('id')) == str(gamepass_id) for item in data), 'inventory'
+            if r.status_code == 429:
+                return None, 'inventory_rate'
+            return None, f'inventory_{r.status_code}'
+        except Exception as e:
+            return None, f'inventory_{type(e).__name__}'
+
+    def _probe_legacy(self, uid, gamepass_id, headers) -> Tuple[Optional[bool], str]:
+        try:
+            r = self.client.get(LEGACY_URL.format(uid=uid, gamepass_id=gamepass_id), endpoint='ownership', headers=headers)
+            if r.status_code == 200:
+                return r.text.strip().lower() == 'true', 'legacy'
+            if r.status_code == 429:
+                return None, 'legacy_rate'
+            return None, f'legacy_{r.status_code}'
+        except Exception as e:
+            return None, f'legacy_{type(e).__name__}'
+
+    def _hedge_after(self) -> float:
+        p95 = self.client.latency_percentile('inventory', 95)
+        return p95 if p95 is not None else self.hedge_delay
+
+    def _probe(self, uid, gamepass_id, cookie) -> Tuple[Optional[bool], str]:
+        """Race the probes. A positive from either endpoint or a negative from inventory is
+        definitive; a legacy "false" only counts once inventory has failed to answer."""
+        headers = self._headers(cookie)
+        inventory = self._pool.submit(self._probe_inventory, uid, gamepass_id, headers)
+        pending = {inventory}
+        legacy = None
+        hedge_at = None
+        if self.mode == 'hedge':
+            hedge_at = time.monotonic() + self._hedge_after()
+        else:
+            legacy = self._pool.submit(self._probe_legacy, uid, gamepass_id, headers)
+            pending.add(legacy)
+        answers = []
+        result = None
+        while result is None and (pending or legacy is None):
+            timeout = None if legacy is not None else max(0.0, hedge_at - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                owned, detail = future.result()
+                answers.append((owned, detail))
+                if owned or (owned is False and future is inventory):
+                    result = (owned, detail)
+                    break
+            if result is None and legacy is None and (not pending or time.monotonic() >= hedge_at):
+                legacy = self._pool.submit(self._probe_legacy, uid, gamepass_id, headers)
+                pending.add(legacy)
+                with self._lock:
+                    self.hedges += 1
+        for future in pending:
+            future.cancel()
+        if result is None:
+            negatives = [a for a in answers if a[0] is False]
+            result = negatives[0] if negatives else (None, ','.join(d for _o, d in answers) or 'none')
+        with self._lock:
+            winner = result[1] if result[0] is not None else 'unknown'
+            self._winners[winner] = self._winners.get(winner, 0) + 1
+        if result[0] is not None:
+            self._cache.set((str(uid), str(gamepass_id)), result,
+                            ttl=self.positive_ttl if result[0] else self.negative_ttl)
+        return result
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {'mode': self.mode, 'winners': dict(self._winners), 'hedges': self.hedges}
+        counters['cache'] = self._cache.stats()
+        counters['singleFlight'] = self._flight.stats()
+        return counters
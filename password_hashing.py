@@ -0,0 +1,151 @@
+"""
+Password Hashing Pool
+Runs bcrypt hashing/verification in a bounded worker pool instead of on the Flask request
+thread. The cost factor is configurable, submissions beyond maxQueue (or not finished
+within timeoutSeconds) are shed with HashingOverloaded, and needs_rehash() lets login
+upgrade hashes made with an old cost.
+"""
+
+import os
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Optional
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+
+class HashingOverloaded(Exception):
+    """Raised when too many hash/verify jobs are already queued or running."""
+
+
+def _hash_worker(password: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify_worker(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _noop():
+    return None
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Cost factor encoded in a bcrypt hash ('$2b$12$...' -> 12), or None if unparsable."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: Optional[int] = None, max_queue: int = 64, timeout: float = 10.0):
+        """workers defaults to the CPU count. Workers are threads: bcrypt releases the GIL, so
+        they hash in parallel without forking a process that already runs background threads
+        (and without spawned workers re-importing the app). The pool is created on the first
+        hash/verify in each process, never at import."""
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight = 0
+        self.completed = 0
+        self.shed = 0
+        self.busy_seconds = 0.0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.passwordHashing overrides (rounds, workers, maxQueue, timeoutSeconds)."""
+        if not cfg:
+            return
+        self.rounds = max(4, min(31, int(cfg.get('rounds', self.rounds))))
+        self.max_queue = int(cfg.get('maxQueue', self.max_queue))
+        self.timeout = float(cfg.get('timeoutSeconds', self.timeout))
+        workers = int(cfg.get('workers', self.workers))
+        if workers != self.workers:
+            with self._lock:
+                old, self._pool, self.workers = self._pool, None, workers
+            if old is not None:
+                old.shutdown(wait=False)
+
+    def start(self):
+        """Create the pool and start its workers now instead of on the first request (optional warm-up)."""
+        pool = self._get_pool()
+        for future in [pool.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+            return self._pool
+
+    def _submit(self, fn, *args) -> Future:
+        pool = self._get_pool()
+        with self._lock:
+            if self._in_flight >= self.max_queue:
+                self.shed += 1
+                raise HashingOverloaded(f"{self._in_flight} password hash jobs in flight")
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            future = pool.submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+        def _done(_f):
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+                self.busy_seconds += time.monotonic() - started
+        future.add_done_callback(_done)
+        return future
+
+    def hash_async(self, password: str) -> Future:
+        return self._submit(_hash_worker, password.encode('utf-8'), self.rounds)
+
+    def _wait(self, future: Future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self.shed += 1
+            raise HashingOverloaded(f"password hash job not finished within {self.timeout}s")
+
+    def hash(self, password: str) -> str:
+        return self._wait(self.hash_async(password))
+
+    def verify_async(self, password: str, hashed: str) -> Future:
+        return self._submit(_verify_worker, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._wait(self.verify_async(password, hashed))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'inFlight': self._in_flight,
+                'maxQueue': self.max_queue,
+                'completed': self.completed,
+                'shed': self.shed,
+                'avgMs': round(self.busy_seconds / self.completed * 1000, 1) if self.completed else None,
+            }
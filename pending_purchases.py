@@ -0,0 +1,231 @@
+"""
+Pending Purchase Store
+In-memory registry of started-but-unfinished purchases, indexed by (product, Roblox buyer)
+and by gamepass id so transaction ingestion can find waiting buyers directly. Entries
+expire from a min-heap swept by a background thread, which also rewrites a local JSON
+snapshot (by default under data/, which the web server never serves) so open purchases
+survive a restart.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_PATH = os.path.join('data', 'pending_purchases.json')
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class PendingPurchaseStore:
+    def __init__(self, ttl: float = 3600.0, on_expire: Optional[Callable[[dict], None]] = None,
+                 snapshot_path: str = DEFAULT_SNAPSHOT_PATH, snapshot_interval: float = 5.0):
+        """ttl: seconds from started_at until an entry expires; on_expire(entry) runs on the
+        sweeper thread for each entry that times out (not for popped ones). Changes are written
+        to snapshot_path by the sweeper at most every snapshot_interval seconds."""
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._cond = threading.Condition()
+        self._save_lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str], dict] = {}
+        self._by_buyer: Dict[Tuple[str, str], Set[Tuple[str, str, str]]] = {}
+        self._by_gamepass: Dict[str, Set[Tuple[str, str, str]]] = {}
+        self._heap: List[Tuple[float, int, Tuple[str, str, str]]] = []
+        self._seq = itertools.count()
+        self._sweeper = None
+        self._dirty = False
+        self.expired = 0
+        self.completed = 0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.pendingPurchases overrides (snapshotFile, snapshotIntervalSeconds)."""
+        if not cfg:
+            return
+        self.snapshot_interval = float(cfg.get('snapshotIntervalSeconds', self.snapshot_interval))
+        snapshot_path = cfg.get('snapshotFile') or DEFAULT_SNAPSHOT_PATH
+        changed = snapshot_path != self.snapshot_path
+        self.snapshot_path = snapshot_path
+        if changed:
+            self.load_snapshot()
+
+    @staticmethod
+    def _key(user_id, product_id, roblox_username) -> Tuple[str, str, str]:
+        return str(user_id), str(product_id), (roblox_username or '').lower()
+
+    def _insert(self, entry: dict):
+        key = self._key(entry['user_id'], entry['product_id'], entry['roblox_username'])
+        self._entries[key] = entry
+        self._by_buyer.setdefault(key[1:], set()).add(key)
+        if entry.get('gamepass_id'):
+            self._by_gamepass.setdefault(str(entry['gamepass_id']), set()).add(key)
+        heapq.heappush(self._heap, (entry['expires_at'], next(self._seq), key))
+        self._dirty = True
+        self._cond.notify()
+
+    def _remove(self, key) -> Optional[dict]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        for index, index_key in ((self._by_buyer, key[1:]), (self._by_gamepass, str(entry.get('gamepass_id')))):
+            bucket = index.get(index_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del index[index_key]
+        self._dirty = True
+        return entry
+
+    def start(self, user_id, roblox_username, product_id, gamepass_id=None,
+              started_at: Optional[float] = None) -> Tuple[dict, bool]:
+        """Open a pending purchase, or return the live one for the same key. Returns (entry, created)."""
+        key = self._key(user_id, product_id, roblox_username)
+        now = time.time()
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] > now:
+                return dict(entry), False
+            if entry is not None:
+                self._remove(key)
+            started = started_at if started_at is not None else now
+            entry = {
+                'user_id': key[0],
+                'product_id': key[1],
+                'roblox_username': key[2],
+                'gamepass_id': str(gamepass_id) if gamepass_id else None,
+                'started_at': _iso(started),
+                'expires_at': started + self.ttl,
+            }
+            self._insert(entry)
+            self._ensure_threads()
+            return dict(entry), True
+
+    def get(self, user_id, roblox_username, product_id) -> Optional[dict]:
+        with self._cond:
+            entry = self._entries.get(self._key(user_id, product_id, roblox_username))
+            if entry is None or entry['expires_at'] <= time.time():
+                return None
+            return dict(entry)
+
+    def pop(self, user_id, roblox_username, product_id) -> Optional[dict]:
+        """Remove a pending purchase that finished (or was abandoned) before expiring."""
+        with self._cond:
+            entry = self._remove(self._key(user_id, product_id, roblox_username))
+            if entry is not None:
+                self.completed += 1
+            return entry
+
+    def for_buyer(self, product_id, roblox_username) -> List[dict]:
+        """Every user's pending purchase of product_id for this Roblox buyer."""
+        with self._cond:
+            keys = self._by_buyer.get((str(product_id), (roblox_username or '').lower()), ())
+            return [dict(self._entries[k]) for k in keys]
+
+    def pending_for_gamepass(self, gamepass_id) -> List[dict]:
+        """All pending purchases waiting on a sale of gamepass_id."""
+        with self._cond:
+            return [dict(self._entries[k]) for k in self._by_gamepass.get(str(gamepass_id), ())]
+
+    def expire_due(self, now: Optional[float] = None) -> List[dict]:
+        """Remove and return entries whose expiry has passed (stale heap slots are skipped)."""
+        now = time.time() if now is None else now
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, _seq, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is not None and entry['expires_at'] == expires_at:
+                    due.append(self._remove(key))
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [(e['expires_at'], next(self._seq), k) for k, e in self._entries.items()]
+                heapq.heapify(self._heap)
+            self.expired += len(due)
+        return due
+
+    def _ensure_threads(self):
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='pending-expiry', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        """Sleep until the earliest expiry (or snapshot time), expire, repeat."""
+        next_snapshot = time.time() + self.snapshot_interval
+        while True:
+            with self._cond:
+                wake_at = min(self._heap[0][0] if self._heap else time.time() + 3600, next_snapshot)
+                self._cond.wait(max(0.0, wake_at - time.time()))
+            for entry in self.expire_due():
+                if self.on_expire:
+                    try:
+                        self.on_expire(entry)
+                    except Exception as e:
+                        logger.error(f"Pending purchase expiry callback failed: {e}")
+            if time.time() >= next_snapshot:
+                self.save_snapshot()
+                next_snapshot = time.time() + self.snapshot_interval
+
+    def load_snapshot(self):
+        """Restore unexpired entries from snapshot_path (entries already in memory are kept)."""
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"Pending purchase snapshot unreadable: {e}")
+            return
+        now = time.time()
+        with self._cond:
+            for entry in entries:
+                key = self._key(entry.get('user_id'), entry.get('product_id'), entry.get('roblox_username'))
+                if entry.get('expires_at', 0) > now and key not in self._entries:
+                    self._insert(entry)
+            if self._entries:
+                self._ensure_threads()
+        logger.info(f"Restored {len(self._entries)} pending purchases from {self.snapshot_path}")
+
+    def save_snapshot(self):
+        """Write live entries to snapshot_path (tmp file + rename) if anything changed."""
+        with self._save_lock:
+            with self._cond:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                body = json.dumps(list(self._entries.values()), separators=(',', ':'))
+            tmp_path = f"{self.snapshot_path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"Pending purchase snapshot write failed: {e}")
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'pending': len(self._entries),
+                'buyers': len(self._by_buyer),
+                'gamepasses': len(self._by_gamepass),
+                'heap': len(self._heap),
+                'expired': self.expired,
+                'completed': self.completed,
+                'snapshot': self.snapshot_path,
+            }
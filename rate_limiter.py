@@ -0,0 +1,145 @@
+"""
+Token Bucket Rate Limiter
+Thread-safe token buckets shared by every caller of an upstream endpoint. Callers can
+take a token immediately or queue (FIFO) for up to a timeout; idle per-key buckets expire.
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """rate: tokens added per second; capacity: burst size (bucket starts full)."""
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self.last_used = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reconfigure(self, rate: float, capacity: float):
+        with self._cond:
+            self._refill()
+            self.rate = float(rate)
+            self.capacity = float(capacity)
+            self._tokens = min(self._tokens, self.capacity)
+            self._cond.notify_all()
+
+    def acquire(self, tokens: float = 1, timeout: float = 0.0) -> bool:
+        """Take tokens, queueing behind earlier callers for at most timeout seconds.
+        Returns False if the tokens could not be obtained in time."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    self._refill()
+                    at_head = self._queue[0] is ticket
+                    if at_head and self._tokens >= tokens:
+                        self._tokens -= tokens
+                        self.last_used = time.monotonic()
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    if at_head and self.rate > 0:
+                        remaining = min(remaining, (tokens - self._tokens) / self.rate)
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def is_idle(self) -> bool:
+        with self._cond:
+            self._refill()
+            return not self._queue and self._tokens >= self.capacity
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            self._refill()
+            return {'tokens': round(self._tokens, 2), 'capacity': self.capacity, 'rate': self.rate, 'queued': len(self._queue)}
+
+
+class RateLimiter:
+    """Registry of named token buckets. A name maps to {'rate': per-second, 'burst': capacity};
+    acquire(name, key=...) gives each key its own bucket with the name's limits."""
+
+    def __init__(self, limits: Optional[Dict[str, dict]] = None, idle_ttl: float = 600.0):
+        self.limits: Dict[str, dict] = dict(limits or {})
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+
+    def configure(self, limits: Optional[Dict[str, dict]]):
+        """Merge limit overrides and resize existing buckets in place."""
+        if not limits:
+            return
+        with self._lock:
+            for name, spec in limits.items():
+                merged = dict(self.limits.get(name, {}))
+                merged.update(spec or {})
+                self.limits[name] = merged
+            buckets = list(self._buckets.items())
+        for (name, _key), bucket in buckets:
+            spec = self.limits.get(name)
+            if spec:
+                bucket.reconfigure(spec.get('rate', 1.0), spec.get('burst', 1))
+
+    def _bucket(self, name: str, key: Optional[str]) -> Optional[TokenBucket]:
+        spec = self.limits.get(name)
+        if not spec:
+            return None
+        with self._lock:
+            self._sweep_locked()
+            bucket = self._buckets.get((name, key))
+            if bucket is None:
+                bucket = TokenBucket(spec.get('rate', 1.0), spec.get('burst', 1))
+                self._buckets[(name, key)] = bucket
+            return bucket
+
+    def _sweep_locked(self):
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        expired = [k for k, b in self._buckets.items()
+                   if k[1] is not None and now - b.last_used > self.idle_ttl and b.is_idle()]
+        for k in expired:
+            del self._buckets[k]
+        if expired:
+            logger.debug(f"Expired {len(expired)} idle rate limit buckets")
+
+    def acquire(self, name: str, key: Optional[str] = None, tokens: float = 1, timeout: float = 0.0) -> bool:
+        """Take a token from the (name, key) bucket, waiting up to timeout. Unknown names are unlimited."""
+        bucket = self._bucket(name, key)
+        if bucket is None:
+            return True
+        return bucket.acquire(tokens, timeout)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            buckets = list(self._buckets.items())
+        shared = {name: b.snapshot() for (name, key), b in buckets if key is None}
+        keyed: Dict[str, int] = {}
+        for (name, key), _b in buckets:
+            if key is not None:
+                keyed[name] = keyed.get(name, 0) + 1
+        return {'buckets': shared, 'keyedBucketCounts': keyed}
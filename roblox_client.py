@@ -0,0 +1,488 @@
+"""
+Roblox API Client
+Single entry point for Roblox web API calls with per-endpoint timeouts, jittered
+exponential backoff, Retry-After handling, a per-host circuit breaker and
+latency/error counters. Also hosts the batched username -> user id resolver.
+"""
+
+import random
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeouts per logical endpoint; override via settings.roblox.client.timeouts
+DEFAULT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    'users': (3.05, 5),
+    'economy': (3.05, 8),
+    'inventory': (3.05, 4),
+    'ownership': (3.05, 4),
+    'default': (3.05, 6),
+}
+
+# Shared token buckets per endpoint (requests/second, burst); override via settings.roblox.rateLimits.
+DEFAULT_RATE_LIMITS: Dict[str, dict] = {
+    'users': {'rate': 1.0, 'burst': 10},
+    'economy': {'rate': 0.5, 'burst': 5},
+    'inventory': {'rate': 1.0, 'burst': 10},
+    'ownership': {'rate': 1.0, 'burst': 5},
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RobloxUnavailable(requests.exceptions.RequestException):
+    """Raised when a call is short-circuited (open breaker or Retry-After cooldown)."""
+
+
+class RobloxRateLimited(RobloxUnavailable):
+    """Raised when no token for the endpoint became available within the queue timeout."""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; after `reset_timeout`
+    a single half-open probe is let through and its outcome closes or re-opens the breaker."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.time() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.time() - self._opened_at < self.reset_timeout or self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """The half-open probe ended without a verdict (not sent, 429, unexpected error)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Roblox circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.time()
+            self._probe_in_flight = False
+
+
+class _EndpointStats:
+    __slots__ = ('requests', 'errors', 'retries', 'rate_limited', 'short_circuited', 'latency_total', 'latency_max', 'samples')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.short_circuited = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.samples = deque(maxlen=200)
+
+
+class RobloxClient:
+    def __init__(self, max_retries: int = 2, backoff_base: float = 0.25, backoff_cap: float = 4.0,
+                 max_retry_after: float = 3.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 rate_limiter=None, queue_timeout: float = 2.0, deadline: float = 10.0):
+        """Initialize client; every knob can later be changed with configure()."""
+        self.session = requests.Session()
+        self.rate_limiter = rate_limiter
+        self.queue_timeout = queue_timeout
+        self.deadline = deadline
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._cooldowns: Dict[str, float] = {}
+        self._stats: Dict[str, _EndpointStats] = {}
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.roblox.client overrides (timeouts, retries, breaker thresholds)."""
+        if not cfg:
+            return
+        for name, value in (cfg.get('timeouts') or {}).items():
+            if isinstance(value, (list, tuple)) and len(value) == 2:
+                self.timeouts[name] = (float(value[0]), float(value[1]))
+            else:
+                self.timeouts[name] = (min(3.05, float(value)), float(value))
+        self.max_retries = int(cfg.get('maxRetries', self.max_retries))
+        self.backoff_base = float(cfg.get('backoffBaseSeconds', self.backoff_base))
+        self.backoff_cap = float(cfg.get('backoffCapSeconds', self.backoff_cap))
+        self.max_retry_after = float(cfg.get('maxRetryAfterSeconds', self.max_retry_after))
+        self.failure_threshold = int(cfg.get('breakerFailureThreshold', self.failure_threshold))
+        self.reset_timeout = float(cfg.get('breakerResetSeconds', self.reset_timeout))
+        self.queue_timeout = float(cfg.get('maxQueueWaitSeconds', self.queue_timeout))
+        self.deadline = float(cfg.get('deadlineSeconds', self.deadline))
+        with self._lock:
+            for breaker in self._breakers.values():
+                breaker.failure_threshold = self.failure_threshold
+                breaker.reset_timeout = self.reset_timeout
+
+    def _breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def _endpoint_stats(self, endpoint: str) -> _EndpointStats:
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats.setdefault(endpoint, _EndpointStats())
+        return stats
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after_seconds(resp: requests.Response) -> Optional[float]:
+        value = resp.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except Exception:
+            return None
+
+    def get(self, url: str, endpoint: str = 'default', **kwargs) -> requests.Response:
+        return self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str = 'default', **kwargs) -> requests.Response:
+        return self.request('POST', url, endpoint=endpoint, **kwargs)
+
+    def request(self, method: str, url: str, endpoint: str = 'default', retries: Optional[int] = None,
+                queue_timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """Send a request and return the final Response (any status).
+
+        Calls during a Retry-After cooldown or with the host breaker open raise
+        RobloxUnavailable without touching the network or the rate limiter. Otherwise each
+        attempt takes a token from the endpoint's shared bucket, queueing for at most
+        queue_timeout seconds (RobloxRateLimited otherwise). Connection errors, connect
+        timeouts, 429 and 5xx are retried with jittered backoff while the call stays within
+        self.deadline seconds; a read timeout is not retried. A Retry-After longer than
+        max_retry_after puts the endpoint in cooldown and the 429 response is returned
+        immediately. A 429 counts as neither success nor failure for the breaker.
+        """
+        if queue_timeout is None:
+            queue_timeout = self.queue_timeout
+        host = urlparse(url).netloc
+        breaker = self._breaker(host)
+        cooldown_key = f"{host}:{endpoint}"
+        stats = self._endpoint_stats(endpoint)
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint, self.timeouts['default']))
+        max_retries = self.max_retries if retries is None else retries
+        give_up_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            with self._lock:
+                cooldown_until = self._cooldowns.get(cooldown_key, 0)
+            if cooldown_until > time.time():
+                self._bump(stats, 'short_circuited')
+                raise RobloxUnavailable(f"{endpoint} cooling down for {cooldown_until - time.time():.1f}s (Retry-After)")
+            if not breaker.allow():
+                self._bump(stats, 'short_circuited')
+                raise RobloxUnavailable(f"Circuit open for {host}")
+            if self.rate_limiter and not self.rate_limiter.acquire(endpoint, timeout=queue_timeout):
+                breaker.release_probe()
+                self._bump(stats, 'short_circuited')
+                raise RobloxRateLimited(f"No {endpoint} rate limit token within {queue_timeout:.1f}s")
+            started = time.monotonic()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(stats, time.monotonic() - started, error=True)
+                breaker.record_failure()
+                delay = self._backoff(attempt + 1)
+                if (attempt >= max_retries or isinstance(e, requests.exceptions.ReadTimeout)
+                        or time.monotonic() + delay >= give_up_at):
+                    raise
+                attempt += 1
+                self._bump(stats, 'retries')
+                logger.info(f"Roblox {endpoint} {type(e).__name__}; retry {attempt}/{max_retries}")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release_probe()
+                raise
+            self._record(stats, time.monotonic() - started, error=resp.status_code >= 500)
+            if resp.status_code >= 500:
+                breaker.record_failure()
+            elif resp.status_code == 429:
+                breaker.release_probe()
+            else:
+                breaker.record_success()
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            delay = self._backoff(attempt + 1)
+            if resp.status_code == 429:
+                self._bump(stats, 'rate_limited')
+                retry_after = self._retry_after_seconds(resp)
+                if retry_after is not None:
+                    if retry_after > self.max_retry_after:
+                        with self._lock:
+                            self._cooldowns[cooldown_key] = time.time() + retry_after
+                        logger.warning(f"Roblox {endpoint} rate limited; cooling down {retry_after:.1f}s")
+                        return resp
+                    delay = retry_after
+            if attempt >= max_retries or time.monotonic() + delay >= give_up_at:
+                return resp
+            attempt += 1
+            self._bump(stats, 'retries')
+            logger.info(f"Roblox {endpoint} HTTP {resp.status_code}; retry {attempt}/{max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _bump(self, stats: _EndpointStats, field: str):
+        with self._lock:
+            setattr(stats, field, getattr(stats, field) + 1)
+
+    def _record(self, stats: _EndpointStats, elapsed: float, error: bool):
+        with self._lock:
+            stats.requests += 1
+            if error:
+                stats.errors += 1
+            stats.latency_total += elapsed
+            if elapsed > stats.latency_max:
+                stats.latency_max = elapsed
+            stats.samples.append(elapsed)
+
+    def latency_percentile(self, endpoint: str, pct: float, min_samples: int = 20) -> Optional[float]:
+        """Return the pct percentile (0-100) of recent latencies in seconds, or None if too few samples."""
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            samples = sorted(stats.samples) if stats else []
+        if len(samples) < min_samples:
+            return None
+        idx = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[idx]
+
+    def stats(self) -> dict:
+        """Snapshot of per-endpoint counters and per-host breaker states."""
+        with self._lock:
+            endpoints = {}
+            for name, s in self._stats.items():
+                endpoints[name] = {
+                    'requests': s.requests,
+                    'errors': s.errors,
+                    'retries': s.retries,
+                    'rateLimited': s.rate_limited,
+                    'shortCircuited': s.short_circuited,
+                    'avgLatencyMs': round(s.latency_total / s.requests * 1000, 1) if s.requests else None,
+                    'maxLatencyMs': round(s.latency_max * 1000, 1),
+                }
+            breakers = dict(self._breakers)
+            now = time.time()
+            cooldowns = {k: round(v - now, 1) for k, v in self._cooldowns.items() if v > now}
+        for name in endpoints:
+            p95 = self.latency_percentile(name, 95, min_samples=1)
+            endpoints[name]['p95LatencyMs'] = round(p95 * 1000, 1) if p95 is not None else None
+        return {
+            'endpoints': endpoints,
+            'breakers': {host: b.state for host, b in breakers.items()},
+            'cooldowns': cooldowns,
+        }
+
+
+class UsernameResolver:
+    """Exact username -> user id lookups through the batch usernames endpoint.
+
+    Concurrent lookups of the same name share one in-flight future (single-flight).
+    The first caller to queue a name waits batch_window seconds, then sends the queued
+    names (up to max_batch) in one POST. Anything still queued after that - overflow, or
+    names queued while the POST was in flight - is sent by a background flusher thread,
+    so a request thread never waits on batches beyond its own. Found ids and misses are cached with separate TTLs.
+    resolve() returns (user_id, None) or (None, error_code) like fetch_user_id always has.
+    """
+
+    BATCH_URL = 'https://users.roblox.com/v1/usernames/users'
+
+    def __init__(self, client: RobloxClient, batch_window: float = 0.005, max_batch: int = 100,
+                 positive_ttl: float = 6 * 3600, negative_ttl: float = 120, wait_timeout: float = 15.0):
+        self.client = client
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.wait_timeout = wait_timeout
+        self.positive = TTLCache(maxsize=50000, ttl=positive_ttl, name='username_ids')
+        self.negative = TTLCache(maxsize=10000, ttl=negative_ttl, name='username_misses')
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._queue = []
+        self._flushing = False
+        self.batches = 0
+        self.batched_names = 0
+        self.coalesced = 0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.roblox.userLookup overrides."""
+        if not cfg:
+            return
+        self.batch_window = float(cfg.get('batchWindowMs', self.batch_window * 1000)) / 1000.0
+        self.max_batch = max(1, min(100, int(cfg.get('maxBatch', self.max_batch))))
+        self.positive.ttl = float(cfg.get('positiveTtlSeconds', self.positive.ttl))
+        self.negative.ttl = float(cfg.get('negativeTtlSeconds', self.negative.ttl))
+
+    def prime(self, username: str, user_id: int):
+        self.positive[username.strip().lower()] = user_id
+
+    def cached(self, username: str) -> Optional[Tuple[Optional[int], Optional[str]]]:
+        key = username.strip().lower()
+        user_id = self.positive.get(key)
+        if user_id is not None:
+            return user_id, None
+        if key in self.negative:
+            return None, 'USER_NOT_FOUND'
+        return None
+
+    def clear(self):
+        self.positive.clear()
+        self.negative.clear()
+
+    def resolve(self, username: str, timeout: Optional[float] = None) -> Tuple[Optional[int], Optional[str]]:
+        if not username or not username.strip():
+            return None, 'USER_NOT_FOUND'
+        hit = self.cached(username)
+        if hit is not None:
+            return hit
+        key = username.strip().lower()
+        leader = False
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = Future()
+                self._inflight[key] = future
+                self._queue.append(key)
+                if not self._flushing:
+                    self._flushing = True
+                    leader = True
+            else:
+                self.coalesced += 1
+        if leader:
+            time.sleep(self.batch_window)
+            if self._flush_one():
+                threading.Thread(target=self._drain, name='username-flush', daemon=True).start()
+        try:
+            return future.result(timeout=self.wait_timeout if timeout is None else timeout)
+        except FutureTimeout:
+            return None, 'TIMEOUT'
+
+    def _drain(self):
+        while self._flush_one():
+            pass
+
+    def _flush_one(self) -> bool:
+        """Send one batch from the queue. Returns True if names remain queued (the caller
+        keeps the flushing role), False once the queue is empty and the role is released."""
+        with self._lock:
+            if not self._queue:
+                self._flushing = False
+                return False
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            self.batches += 1
+            self.batched_names += len(batch)
+        try:
+            results = self._lookup_batch(batch)
+        except Exception as e:
+            logger.error(f"Unexpected username batch failure: {e}")
+            results = {name: (None, 'UNKNOWN_ERROR') for name in batch}
+        with self._lock:
+            futures = [(self._inflight.pop(name, None), results[name]) for name in batch]
+            remaining = bool(self._queue)
+            if not remaining:
+                self._flushing = False
+        for future, result in futures:
+            if future is not None:
+                future.set_result(result)
+        return remaining
+
+    def _lookup_batch(self, names) -> Dict[str, Tuple[Optional[int], Optional[str]]]:
+        def _all(error):
+            return {name: (None, error) for name in names}
+        try:
+            resp = self.client.post(self.BATCH_URL, endpoint='users',
+                                    json={'usernames': list(names), 'excludeBannedUsers': False})
+        except requests.exceptions.Timeout:
+            return _all('TIMEOUT')
+        except RobloxRateLimited:
+            logger.info(f"Users API token queue timed out for {len(names)} username lookups")
+            return _all('RATE_LIMITED')
+        except RobloxUnavailable as e:
+            logger.warning(f"Roblox users API unavailable for username lookup: {e}")
+            return _all('ROBLOX_UNAVAILABLE')
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error resolving {len(names)} usernames: {e}")
+            return _all('REQUEST_ERROR')
+        if resp.status_code == 429:
+            logger.warning("Roblox API rate limit hit")
+            return _all('ROBLOX_RATE_LIMITED')
+        if resp.status_code != 200:
+            logger.error(f"Username batch lookup HTTP {resp.status_code}: {resp.text[:200]}")
+            return _all('REQUEST_ERROR')
+        found = {}
+        for entry in resp.json().get('data', []):
+            requested = (entry.get('requestedUsername') or entry.get('name') or '').lower()
+            if requested and entry.get('id'):
+                found[requested] = entry['id']
+        results = {}
+        for name in names:
+            user_id = found.get(name)
+            if user_id:
+                self.positive[name] = user_id
+                results[name] = (user_id, None)
+            else:
+                self.negative[name] = True
+                results[name] = (None, 'USER_NOT_FOUND')
+        logger.info(f"Resolved {len(found)}/{len(names)} usernames in one batch")
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {'batches': self.batches, 'batchedNames': self.batched_names,
+                        'coalesced': self.coalesced, 'inFlight': len(self._inflight)}
+        counters['positive'] = self.positive.stats()
+        counters['negative'] = self.negative.stats()
+        return counters
@@ -0,0 +1,312 @@
+"""
+Sales Analytics Rollups
+Per-product hourly and daily rollups (sale count, Robux revenue, unique buyers) updated
+on every sale, so dashboards read O(buckets) instead of scanning the purchase log. Rollups
+are stored one file per month and can be rebuilt from the purchase log with backfill().
+Sales not yet flushed are also kept as per-month deltas, so a flush that finds the file
+changed by another instance adds them to the remote copy instead of overwriting it.
+"""
+
+import json
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {'hour': 13, 'day': 10}  # bucket key = timestamp[:n]
+
+
+def _purchase_time(record: dict) -> str:
+    return record.get('purchase_date') or record.get('ts') or ''
+
+
+class SalesAnalytics:
+    def __init__(self, github_manager=None, root: str = 'Analytics/rollups', hour_retention_days: int = 14,
+                 flush_delay: float = 5.0):
+        """github_manager: storage for the month files under root (rollups stay in memory
+        only when None). Hourly buckets older than hour_retention_days are dropped at flush;
+        daily buckets are kept."""
+        self.github_manager = github_manager
+        self.root = root
+        self.hour_retention_days = hour_retention_days
+        self.flush_delay = flush_delay
+        # month -> granularity -> product_id -> bucket -> {'count', 'revenue', 'buyers': set}
+        self._months: Dict[str, dict] = {}
+        self._shas: Dict[str, Optional[str]] = {}
+        self._deltas: Dict[str, dict] = {}  # same shape as _months: sales applied since the last flush
+        self._replace = set()  # months rebuilt by backfill; their next write replaces the file
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._dirty = set()
+        self._dirty_event = threading.Event()
+        self._flusher = None
+        self._backfill = None  # {'started', 'seen': set, 'replay': list} while a backfill runs
+        self.last_backfill = None
+        self.recorded = 0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.analytics overrides (hourRetentionDays, flushDelaySeconds)."""
+        if not cfg:
+            return
+        self.hour_retention_days = int(cfg.get('hourRetentionDays', self.hour_retention_days))
+        self.flush_delay = float(cfg.get('flushDelaySeconds', self.flush_delay))
+
+    def _path(self, month: str) -> str:
+        return f"{self.root}/{month}.json"
+
+    def _ensure_loaded(self):
+        """Read the stored month files once. Callers block until the read finishes; if it
+        fails it is retried on the next call, and sales recorded meanwhile are kept."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            if not self.github_manager:
+                self._loaded = True
+                return
+            loaded = {}
+            try:
+                for item in self.github_manager.list_directory(self.root) or []:
+                    name = item.get('name') or ''
+                    if not name.endswith('.json'):
+                        continue
+                    text, sha = self.github_manager.get_raw_file(item.get('path') or self._path(name[:-5]))
+                    if not text:
+                        continue
+                    try:
+                        loaded[name[:-5]] = (self._decode(json.loads(text)), sha)
+                    except Exception as e:
+                        logger.error(f"Unreadable analytics rollup {name}: {e}")
+            except Exception as e:
+                logger.error(f"Loading analytics rollups failed: {e}")
+                return
+            with self._lock:
+                for month, (data, sha) in loaded.items():
+                    self._merge(data, self._deltas.get(month))
+                    self._months[month] = data
+                    self._shas[month] = sha
+                self._loaded = True
+
+    @staticmethod
+    def _decode(body: dict) -> dict:
+        out = {}
+        for granularity in GRANULARITIES:
+            out[granularity] = {
+                product_id: {bucket: {'count': r['count'], 'revenue': r['revenue'], 'buyers': set(r.get('buyers') or [])}
+                             for bucket, r in buckets.items()}
+                for product_id, buckets in (body.get(granularity) or {}).items()
+            }
+        return out
+
+    @staticmethod
+    def _encode(month: dict) -> dict:
+        return {
+            granularity: {
+                product_id: {bucket: {'count': r['count'], 'revenue': r['revenue'], 'buyers': sorted(r['buyers'])}
+                             for bucket, r in buckets.items()}
+                for product_id, buckets in products.items()
+            }
+            for granularity, products in month.items()
+        }
+
+    @staticmethod
+    def _merge(month: dict, delta: Optional[dict]):
+        """Add the buckets of delta (one month) into month in place."""
+        for granularity, products in (delta or {}).items():
+            for product_id, buckets in products.items():
+                target = month.setdefault(granularity, {}).setdefault(product_id, {})
+                for bucket, r in buckets.items():
+                    t = target.setdefault(bucket, {'count': 0, 'revenue': 0, 'buyers': set()})
+                    t['count'] += r['count']
+                    t['revenue'] += r['revenue']
+                    t['buyers'] |= r['buyers']
+
+    @staticmethod
+    def _apply(months: dict, record: dict) -> Optional[str]:
+        """Add one sale to months; returns the month touched (None if the record is unusable)."""
+        ts = _purchase_time(record)
+        product_id = record.get('product_id')
+        if len(ts) < 13 or not product_id:
+            return None
+        buyer = (record.get('roblox_username') or record.get('user_id') or '').lower()
+        month = months.setdefault(ts[:7], {g: {} for g in GRANULARITIES})
+        for granularity, width in GRANULARITIES.items():
+            bucket = month[granularity].setdefault(str(product_id), {}).setdefault(
+                ts[:width], {'count': 0, 'revenue': 0, 'buyers': set()})
+            bucket['count'] += 1
+            bucket['revenue'] += record.get('price') or 0
+            if buyer:
+                bucket['buyers'].add(buyer)
+        return ts[:7]
+
+    def record(self, purchase: dict):
+        """Fold one completed sale into the rollups (called on every issued key)."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._backfill is not None:
+                self._backfill['replay'].append(purchase)
+            month = self._apply(self._months, purchase)
+            if month is None:
+                return
+            if self.github_manager:
+                self._apply(self._deltas, purchase)
+            self.recorded += 1
+        self._mark_dirty(month)
+
+    def backfill(self, purchases: Iterable[dict]) -> dict:
+        """Rebuild every rollup from a stream of purchase records (e.g. the purchase log),
+        replacing what is stored. Sales recorded while the pass runs are merged in after."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._backfill is not None:
+                raise RuntimeError('Backfill already running')
+            self._backfill = {'started': time.time(), 'replay': []}
+        months, seen, count = {}, set(), 0
+        try:
+            for record in purchases:
+                if self._apply(months, record) is not None:
+                    count += 1
+                    if record.get('purchase_id'):
+                        seen.add(record['purchase_id'])
+        except Exception:
+            with self._lock:
+                self._backfill = None
+            raise
+        with self._lock:
+            for record in self._backfill['replay']:
+                if record.get('purchase_id') not in seen:
+                    self._apply(months, record)
+            started = self._backfill['started']
+            self._backfill = None
+            stale = set(self._months) - set(months)
+            self._months = months
+            for month in stale:
+                months[month] = {g: {} for g in GRANULARITIES}
+            self._deltas = {}
+            self._replace = set(months)
+        for month in list(months):
+            self._mark_dirty(month)
+        self.last_backfill = {'purchases': count, 'months': len(months),
+                              'seconds': round(time.time() - started, 2), 'finished': time.time()}
+        logger.info(f"Analytics backfill folded {count} purchases into {len(months)} months")
+        return self.last_backfill
+
+    def _mark_dirty(self, month: str):
+        if not self.github_manager:
+            return
+        with self._lock:
+            self._dirty.add(month)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='analytics-flusher', daemon=True)
+                self._flusher.start()
+        self._dirty_event.set()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty_event.wait()
+            time.sleep(self.flush_delay)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Analytics flush failed: {e}")
+
+    def _prune_hours(self, month: dict):
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.hour_retention_days)).strftime('%Y-%m-%dT%H')
+        for product_id in list(month['hour']):
+            buckets = month['hour'][product_id]
+            for bucket in [b for b in buckets if b < cutoff]:
+                del buckets[bucket]
+            if not buckets:
+                del month['hour'][product_id]
+
+    def flush(self) -> int:
+        """Write every dirty month file now. Returns the number written; failures stay dirty."""
+        self._ensure_loaded()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._dirty_event.clear()
+        written = 0
+        for month in sorted(dirty):
+            if self._flush_month(month):
+                written += 1
+            else:
+                with self._lock:
+                    self._dirty.add(month)
+                self._dirty_event.set()
+        return written
+
+    def _flush_month(self, month: str) -> bool:
+        for _attempt in range(3):
+            with self._lock:
+                data = self._months.get(month)
+                if data is None:
+                    return True
+                self._prune_hours(data)
+                body = json.dumps(self._encode(data), separators=(',', ':'))
+                sha = self._shas.get(month)
+                sent = self._deltas.pop(month, None)
+                replace = month in self._replace
+            new_sha = self.github_manager.put_raw_file(self._path(month), body, f"Update sales rollup {month}", sha=sha)
+            if new_sha is not None:
+                with self._lock:
+                    self._shas[month] = new_sha
+                    self._replace.discard(month)
+                return True
+            text, remote_sha = self.github_manager.get_raw_file(self._path(month))
+            with self._lock:
+                if sent is not None:
+                    # Not written after all: put the sent delta back in front of newer sales.
+                    self._merge(sent, self._deltas.get(month))
+                    self._deltas[month] = sent
+                if not text or remote_sha == sha:
+                    return False
+                self._shas[month] = remote_sha
+                if not replace:
+                    # Another instance wrote this month: rebuild it as their file plus our unflushed sales.
+                    merged = self._decode(json.loads(text))
+                    self._merge(merged, self._deltas.get(month))
+                    self._months[month] = merged
+                    logger.info(f"Sales rollup {month} changed remotely; merged local sales into it")
+        return False
+
+    def query(self, granularity: str = 'day', since: Optional[str] = None, until: Optional[str] = None,
+              product_id: Optional[str] = None) -> dict:
+        """Buckets per product between since and until (bucket-key prefixes, inclusive), oldest
+        first, plus per-product totals. Only the month files in range are visited."""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {sorted(GRANULARITIES)}")
+        self._ensure_loaded()
+        since = since or ''
+        until = until or '9999'
+        products = {}
+        with self._lock:
+            for month in sorted(self._months):
+                if month < since[:7] or month > until[:7]:
+                    continue
+                for pid, buckets in self._months[month][granularity].items():
+                    if product_id and pid != str(product_id):
+                        continue
+                    rows = products.setdefault(pid, [])
+                    for bucket in sorted(buckets):
+                        if since <= bucket and bucket[:len(until)] <= until:
+                            r = buckets[bucket]
+                            rows.append({'bucket': bucket, 'count': r['count'], 'revenue': r['revenue'],
+                                         'buyers': len(r['buyers'])})
+        totals = {pid: {'count': sum(r['count'] for r in rows), 'revenue': sum(r['revenue'] for r in rows)}
+                  for pid, rows in products.items()}
+        return {'granularity': granularity, 'products': products, 'totals': totals}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'months': len(self._months),
+                'dirty': len(self._dirty),
+                'recorded': self.recorded,
+                'backfillRunning': self._backfill is not None,
+                'lastBackfill': self.last_backfill,
+            }
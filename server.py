@@ -1,18 +1,33 @@
-import urllib.parse
-import requests
 import logging
 import json
 import threading
 import secrets
 import os
-import bcrypt
 from datetime import datetime, timedelta, timezone
-from flask import Flask, request, jsonify, session, send_file, make_response
+from flask import Flask, request, jsonify, session, send_file, make_response, g
 from flask_cors import CORS
-from github_stock import GitHubStockManager
+from github_stock import GitHubStockManager, GitHubSegmentedLog
+from roblox_client import RobloxClient, UsernameResolver, DEFAULT_RATE_LIMITS
+from rate_limiter import RateLimiter
+from ttl_cache import TTLCache
+from single_flight import SingleFlight
+from keyed_locks import KeyedLocks
+from ownership import OwnershipService
+from password_hashing import PasswordHasher, HashingOverloaded
+from guest_sessions import GuestSessionStore
+from pending_purchases import PendingPurchaseStore
+from sales_analytics import SalesAnalytics
+from stock_snapshot import StockSnapshotService
+from stock_counters import StockCounters
 import time
 from contextlib import contextmanager
 import hashlib
+import heapq
+import click
+import bisect
+import base64
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 app = Flask(__name__, static_folder='.', static_url_path='')
@@ -26,6 +41,7 @@ app.secret_key = secrets.token_hex(32)
 load_dotenv('config/.env')
 
 PRODUCTS_CONFIG = {}
+MAIN_PRODUCTS = []
 ADMIN_CONFIG = {}
 SETTINGS = {}
 SUPPORTED_GAMEPASSES = []
@@ -36,16 +52,210 @@ _products_config_mtime = None
 _products_config_lock = threading.Lock()
 _last_forced_push_time = 0  
 
-_roblox_tx_cache = {}
-_roblox_tx_cache_time = {}
-_roblox_buyer_name_cache = {}
-_user_last_api_call = {}
-_tx_fetch_debug = {}
+roblox_rate_limiter = RateLimiter(DEFAULT_RATE_LIMITS)
+roblox_client = RobloxClient(rate_limiter=roblox_rate_limiter)
+username_resolver = UsernameResolver(roblox_client)
+ownership_service = OwnershipService(roblox_client)
+password_hasher = PasswordHasher()
+guest_sessions = GuestSessionStore()
+pending_purchases = PendingPurchaseStore(ttl=PENDING_PURCHASE_EXPIRY_SECONDS)
+sales_analytics = SalesAnalytics()
+stock_snapshots = StockSnapshotService()
+stock_counters = StockCounters()
+
+# Transaction lists are served fresh for a few seconds but kept longer as stale fallback
+_roblox_tx_cache = TTLCache(maxsize=2048, ttl=900, name='roblox_tx')
+_roblox_buyer_name_cache = TTLCache(maxsize=20000, ttl=86400, name='buyer_names')
+_user_last_api_call = TTLCache(maxsize=4096, ttl=300, name='last_api_call')
+_tx_fetch_debug = TTLCache(maxsize=1024, ttl=3600, name='tx_fetch_debug')
+_seller_id_cache = TTLCache(maxsize=16, ttl=3600, name='seller_ids')
+_tx_flight = SingleFlight()
 
 _claimed_transactions = None  
 _claimed_transactions_lock = threading.Lock()
 _claimed_transactions_file = 'Claimed-Transactions'
-_ownership_cycles = {}  
+_claimed_log_dir = 'Claimed-Log'
+_claimed_archive_dir = 'Claimed-Archive'
+_claim_log = None
+_claim_segments_pending = 0
+_claim_compactor_thread = None
+_claim_compactor_lock = threading.Lock()
+_claim_compaction_wakeup = threading.Event()
+_ownership_cycles = TTLCache(maxsize=10000, ttl=7 * 86400, sliding=True, name='ownership_cycles')
+_recent_gamepass_checks = TTLCache(maxsize=10000, ttl=CHECK_GAMEPASS_COOLDOWN_SECONDS, name='recent_checks')
+
+class WindowedClaimSet:
+    """Claimed transaction ids, each with the epoch time it was created (or claimed).
+    A transaction older than claimWindowHours can never be eligible again, so prune() ages
+    ids out of memory once they pass a horizon (a heap keeps that O(k log n)). Synthetic
+    ownership-cycle ids (OWNC...) are not time based and are never pruned.
+    """
+
+    PINNED_PREFIX = 'OWNC'
+
+    def __init__(self):
+        self._ts = {}
+        self._heap = []
+        self._pinned = set()
+
+    def add(self, tx_id, ts=None):
+        if str(tx_id).startswith(self.PINNED_PREFIX):
+            self._pinned.add(tx_id)
+            return
+        ts = ts if ts is not None else time.time()
+        self._ts[tx_id] = ts
+        heapq.heappush(self._heap, (ts, tx_id))
+
+    def discard(self, tx_id):
+        self._pinned.discard(tx_id)
+        self._ts.pop(tx_id, None)
+
+    def prune(self, horizon):
+        """Drop ids with a timestamp before horizon (epoch seconds). Returns the number dropped."""
+        dropped = 0
+        while self._heap and self._heap[0][0] < horizon:
+            ts, tx_id = heapq.heappop(self._heap)
+            if self._ts.get(tx_id) == ts:
+                del self._ts[tx_id]
+                dropped += 1
+        if len(self._heap) > 2 * len(self._ts) + 64:
+            self._heap = [(ts, tid) for tid, ts in self._ts.items()]
+            heapq.heapify(self._heap)
+        return dropped
+
+    def __contains__(self, tx_id):
+        return tx_id in self._ts or tx_id in self._pinned
+
+    def __len__(self):
+        return len(self._ts) + len(self._pinned)
+
+class _TransactionWaiter:
+    __slots__ = ('buyer', 'gamepass_id', 'event', 'seen')
+
+    def __init__(self, buyer, gamepass_id=None):
+        self.buyer = buyer
+        self.gamepass_id = gamepass_id
+        self.event = threading.Event()
+        self.seen = set()
+
+    def wait(self, timeout):
+        """Block until new transactions for the buyer are signalled or timeout elapses."""
+        signalled = self.event.wait(max(0, timeout))
+        self.event.clear()
+        return signalled
+
+def _tx_may_match_gamepass(tx, gamepass_id):
+    """False only when the transaction names a different item; records without an item id
+    may still match loosely in _eligible_unclaimed_transactions."""
+    if not gamepass_id or not tx.get('detailsId'):
+        return True
+    return str(tx.get('detailsId')) == gamepass_id or gamepass_id in (tx.get('details') or '')
+
+class TransactionWaiterRegistry:
+    """Requests waiting for a (buyer, gamepass) sale register here instead of sleeping.
+    The transaction ingest path calls notify() with freshly fetched transactions; waiters
+    are woken only when transaction ids they have not seen yet arrive for their gamepass,
+    and re-evaluate eligibility themselves (gamepass matching stays in
+    _eligible_unclaimed_transactions). Ids already fetched for a buyer before a waiter
+    registers count as seen, so they do not wake it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._known = TTLCache(maxsize=20000, ttl=86400, name='tx_known_ids')
+
+    def register(self, buyer, gamepass_id=None):
+        waiter = _TransactionWaiter(buyer.lower(), str(gamepass_id) if gamepass_id else None)
+        with self._lock:
+            waiter.seen = set(self._known.get(waiter.buyer) or ())
+            self._waiters.setdefault(waiter.buyer, set()).add(waiter)
+        _ensure_transaction_ingest()
+        return waiter
+
+    def unregister(self, waiter):
+        with self._lock:
+            bucket = self._waiters.get(waiter.buyer)
+            if bucket is not None:
+                bucket.discard(waiter)
+                if not bucket:
+                    del self._waiters[waiter.buyer]
+
+    def buyers(self):
+        with self._lock:
+            return list(self._waiters.keys())
+
+    def notify(self, buyer, transactions):
+        """Wake waiters for buyer if transactions contains ids they have not seen. Returns wake count."""
+        if not buyer or not transactions:
+            return 0
+        buyer = buyer.lower()
+        transactions = [tx for tx in transactions if tx.get('transactionId')]
+        woken = 0
+        with self._lock:
+            known = self._known.get(buyer) or frozenset()
+            self._known.set(buyer, known | {tx['transactionId'] for tx in transactions})
+            for waiter in self._waiters.get(buyer, ()):
+                new_ids = {tx['transactionId'] for tx in transactions
+                           if tx['transactionId'] not in waiter.seen and _tx_may_match_gamepass(tx, waiter.gamepass_id)}
+                if new_ids:
+                    waiter.seen |= new_ids
+                    waiter.event.set()
+                    woken += 1
+        return woken
+
+transaction_waiters = TransactionWaiterRegistry()
+_tx_ingest_thread = None
+_tx_ingest_lock = threading.Lock()
+
+def _ensure_transaction_ingest():
+    """Start the background ingest poller if it is not already running."""
+    global _tx_ingest_thread
+    with _tx_ingest_lock:
+        if _tx_ingest_thread is not None:
+            return
+        _tx_ingest_thread = threading.Thread(target=_transaction_ingest_loop, name='tx-ingest', daemon=True)
+        _tx_ingest_thread.start()
+
+def _ingest_seller_feed():
+    """Fetch the seller's sale feed once; its fetch fans the records out to every waiter.
+    Returns False when the sale feed is not usable (no cookie, seller lookup or HTTP error)."""
+    roblox_cfg = SETTINGS.get('roblox', {})
+    cookie = roblox_cfg.get('securityCookie')
+    if not roblox_cfg.get('preferSalesAPI', True) or not cookie or 'PUT_.ROBLOSECURITY' in cookie:
+        return False
+    seller_id, _err = _seller_id_for(cookie)
+    if not seller_id:
+        return False
+    limit = min(100, roblox_cfg.get('saleTransactionsLimit', roblox_cfg.get('transactionsLimit', 100)))
+    records, _source = _seller_sales_page(cookie, seller_id, limit, 0.4)
+    return records is not None
+
+def _transaction_ingest_loop():
+    """Refresh transaction feeds while any buyer has a registered waiter: one seller sale
+    feed read per tick (shared by every waiter), or each buyer's purchase feed when the
+    sale feed is unavailable. Exits (and is restarted on demand) once idle.
+    """
+    global _tx_ingest_thread
+    while True:
+        with _tx_ingest_lock:
+            buyers = transaction_waiters.buyers()
+            if not buyers:
+                _tx_ingest_thread = None
+                return
+        try:
+            fed = _ingest_seller_feed()
+        except Exception as e:
+            logger.warning(f"Sale feed ingest failure: {e}")
+            fed = False
+        if not fed:
+            for buyer in buyers:
+                try:
+                    _fetch_user_transactions(buyer, force_refresh=True)
+                except Exception as e:
+                    logger.warning(f"Transaction ingest failure for {buyer}: {e}")
+        interval_ms = int(SETTINGS.get('roblox', {}).get('ingestIntervalMs', 1000))
+        time.sleep(max(interval_ms, 100) / 1000.0)
 
 def _claimed_file_name():
     try:
@@ -53,55 +263,320 @@ def _claimed_file_name():
     except Exception:
         return _claimed_transactions_file
 
+def _claimed_log_dir_name():
+    return SETTINGS.get('roblox', {}).get('claimLogDir') or _claimed_log_dir
+
+def _get_claim_log():
+    """Return the claim log for the configured snapshot file / segment directory (None without GitHub)."""
+    global _claim_log
+    if not github_manager:
+        return None
+    snapshot, segment_dir = _claimed_file_name(), _claimed_log_dir_name().rstrip('/')
+    log = _claim_log
+    if log is None or log.manager is not github_manager or log.snapshot_path != snapshot or log.segment_dir != segment_dir:
+        log = _claim_log = GitHubSegmentedLog(github_manager, snapshot, segment_dir)
+    return log
+
+def _claim_horizon():
+    """Epoch seconds before which a claimed id can no longer matter (claim window plus margin)."""
+    roblox_cfg = SETTINGS.get('roblox', {})
+    hours = float(roblox_cfg.get('claimWindowHours', 12)) + float(roblox_cfg.get('claimRetentionMarginHours', 24))
+    return time.time() - hours * 3600
+
+def _epoch_from_iso(value):
+    dt = parse_ts(value) if value else None
+    return dt.replace(tzinfo=timezone.utc).timestamp() if dt else None
+
+def _iso_from_epoch(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def _claim_record_ts(record):
+    """Transaction creation time of a claim record, falling back to the claim time."""
+    return _epoch_from_iso(record.get('created')) or _epoch_from_iso(record.get('ts'))
+
+def _claim_records_from_lines(lines):
+    """Parse snapshot entries into [(id, epoch_ts or None)]. Entries are {"id","ts"} JSON lines;
+    plain transaction ids from older snapshots carry no timestamp."""
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{') and line.endswith('}'):
+            try:
+                obj = json.loads(line)
+                tid = obj.get('transactionId') or obj.get('id')
+                if tid:
+                    records.append((tid, _claim_record_ts(obj)))
+            except Exception:
+                continue
+        else:
+            records.append((line, None))
+    return records
+
+def _archive_claims(records):
+    """Append cold claim records to monthly archive files (duplicate lines are collapsed)."""
+    archive_dir = (SETTINGS.get('roblox', {}).get('claimArchiveDir') or _claimed_archive_dir).rstrip('/')
+    by_month = {}
+    for rec in records:
+        by_month.setdefault(rec['ts'][:7], []).append(json.dumps(rec, separators=(',', ':')))
+    for month, lines in by_month.items():
+        def mutate(existing, lines=lines):
+            return existing + lines
+        if not github_atomic_update(f"{archive_dir}/{month}", mutate, f"Archive {len(lines)} claimed transactions"):
+            raise RuntimeError(f"archive write failed for {month}")
+
 def _load_claimed_transactions(force: bool = False):
     """Load (or return cached) set of claimed transaction IDs from GitHub storage.
-    This file is stored as newline-separated JSON or plain lines of transaction IDs.
+    The set is rebuilt from the compacted snapshot file plus the not yet compacted log segments,
+    keeping only ids young enough to matter (see WindowedClaimSet).
     """
-    global _claimed_transactions
+    global _claimed_transactions, _claim_segments_pending
     if _claimed_transactions is not None and not force:
         return _claimed_transactions
-    claimed = set()
+    claimed = WindowedClaimSet()
     try:
-        if github_manager:
-            lines = github_manager.get_file_content(_claimed_file_name()) or []
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith('{') and line.endswith('}'):
-                    try:
-                        obj = json.loads(line)
-                        tid = obj.get('transactionId') or obj.get('id')
-                        if tid:
-                            claimed.add(tid)
-                    except Exception:
-                        continue
-                else:
-                    claimed.add(line)
+        log = _get_claim_log()
+        if log:
+            lines, _sha = log.read_snapshot()
+            for tid, ts in _claim_records_from_lines(lines):
+                claimed.add(tid, ts)
+            segments = log.read_segments()
+            for _entry, record in segments:
+                tid = record.get('id') or record.get('transactionId')
+                if tid:
+                    claimed.add(tid, _claim_record_ts(record))
+            _claim_segments_pending = len(segments)
+            claimed.prune(_claim_horizon())
+            _ensure_claim_compactor()
     except Exception as e:
         logging.getLogger(__name__).error(f"Failed loading claimed transactions: {e}")
     _claimed_transactions = claimed
     return _claimed_transactions
 
-def _persist_claimed_transactions():
-    """Persist current claimed transaction id set back to GitHub."""
-    if _claimed_transactions is None:
-        return
+def _record_claim(tx_id, tx_created=None):
+    """Mark a transaction claimed and append it to the claim log before the key is handed out.
+    Returns (ok, err); on a failed append the id is released again so the sale can be retried.
+    """
+    global _claim_segments_pending
+    with _claimed_transactions_lock:
+        claimed = _load_claimed_transactions()
+        if tx_id in claimed:
+            return False, 'ALREADY_CLAIMED'
+        claimed.add(tx_id, _epoch_from_iso(tx_created))
+        claimed.prune(_claim_horizon())
+    log = _get_claim_log()
+    if log is None:
+        return True, None
     try:
-        if not github_manager:
-            return
-        lines = sorted(list(_claimed_transactions))
-        github_manager.update_file_content(_claimed_file_name(), lines, f"Update claimed transactions ({len(lines)})")
+        ok = log.append({'id': tx_id, 'created': tx_created, 'ts': utc_now_iso()})
     except Exception as e:
-        logging.getLogger(__name__).error(f"Failed persisting claimed transactions: {e}")
+        logger.error(f"Claim log append failed for {tx_id}: {e}")
+        ok = False
+    if not ok:
+        with _claimed_transactions_lock:
+            claimed.discard(tx_id)
+        return False, 'CLAIM_LOG_WRITE_FAILED'
+    with _claimed_transactions_lock:
+        _claim_segments_pending += 1
+        pending = _claim_segments_pending
+    if pending >= int(SETTINGS.get('roblox', {}).get('claimCompactionSegments', 50)):
+        _claim_compaction_wakeup.set()
+    return True, None
+
+def _ensure_claim_compactor():
+    global _claim_compactor_thread
+    with _claim_compactor_lock:
+        if _claim_compactor_thread is not None:
+            return
+        _claim_compactor_thread = threading.Thread(target=_claim_compactor_loop, name='claim-compactor', daemon=True)
+        _claim_compactor_thread.start()
+
+def _claim_compactor_loop():
+    """Fold claim log segments into the snapshot every claimCompactionSeconds, or sooner once
+    claimCompactionSegments records are pending. Snapshot rows past the retention horizon
+    move to the monthly archive once the snapshot write has succeeded (rows whose archive
+    write fails are kept in memory and retried on the next pass)."""
+    global _claim_segments_pending
+    unarchived = []
+    while True:
+        interval = float(SETTINGS.get('roblox', {}).get('claimCompactionSeconds', 300))
+        _claim_compaction_wakeup.wait(interval)
+        _claim_compaction_wakeup.clear()
+        if _claimed_transactions is not None:
+            with _claimed_transactions_lock:
+                _claimed_transactions.prune(_claim_horizon())
+        if unarchived:
+            try:
+                _archive_claims(unarchived)
+                unarchived = []
+            except Exception as e:
+                logger.warning(f"Claim archive retry failed ({len(unarchived)} rows pending): {e}")
+        with _claimed_transactions_lock:
+            pending = _claim_segments_pending
+        if pending <= 0:
+            continue
+        try:
+            log = _get_claim_log()
+            if not log:
+                continue
+            cold = []
+            def merge(lines, records):
+                del cold[:]
+                merged = dict(_claim_records_from_lines(lines))
+                for r in records:
+                    tid = r.get('id') or r.get('transactionId')
+                    if tid:
+                        merged[tid] = _claim_record_ts(r)
+                now = time.time()
+                horizon = _claim_horizon()
+                keep = []
+                for tid, ts in merged.items():
+                    ts = ts if ts is not None else now
+                    rec = {'id': tid, 'ts': _iso_from_epoch(ts)}
+                    if str(tid).startswith(WindowedClaimSet.PINNED_PREFIX) or ts >= horizon:
+                        keep.append((ts, rec))
+                    else:
+                        cold.append(rec)
+                keep.sort(key=lambda item: item[0])
+                return [json.dumps(rec, separators=(',', ':')) for _ts, rec in keep]
+            folded = log.compact(merge)
+            with _claimed_transactions_lock:
+                _claim_segments_pending = max(0, _claim_segments_pending - folded)
+            if folded and cold:
+                try:
+                    _archive_claims(cold)
+                except Exception as e:
+                    unarchived.extend(cold)
+                    logger.warning(f"Claim archive failed, will retry {len(cold)} rows: {e}")
+        except Exception as e:
+            logger.warning(f"Claim log compaction failed: {e}")
+
+def _tx_debug_ts():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+
+def _roblox_cookie_headers(cookie):
+    return {'Cookie': f'.ROBLOSECURITY={cookie}', 'Accept': 'application/json'}
+
+def _seller_id_for(cookie):
+    """Return (seller_id, err) for the account owning the configured cookie, cached per cookie."""
+    cookie_key = hashlib.sha256(cookie.encode('utf-8')).hexdigest()[:16]
+    seller_id = _seller_id_cache.get(cookie_key)
+    if seller_id:
+        return seller_id, None
+    def _load():
+        seller_id = _seller_id_cache.get(cookie_key)
+        if seller_id:
+            return seller_id, None
+        resp = roblox_client.get('https://users.roblox.com/v1/users/authenticated', endpoint='users', headers=_roblox_cookie_headers(cookie))
+        if resp.status_code != 200:
+            return None, f'AUTH_{resp.status_code}'
+        seller_id = resp.json().get('id')
+        if not seller_id:
+            return None, 'AUTH_NO_ID'
+        _seller_id_cache[cookie_key] = seller_id
+        return seller_id, None
+    return _tx_flight.do(('seller_id', cookie_key), _load)
+
+def _seller_sales_page(cookie, seller_id, limit, max_age):
+    """Return (records, source) for the seller's newest sale feed page, shared by every buyer.
+
+    source is 'CACHE_HIT', 'FETCHED' or an error code (records is None on error). Concurrent
+    callers share one upstream call; buyers with registered waiters are notified on fetch.
+    """
+    cache_key = f"sale_feed_{seller_id}_{limit}"
+    cached = _roblox_tx_cache.get(cache_key, max_age=max_age)
+    if cached is not None:
+        return cached, 'CACHE_HIT'
+    def _load():
+        cached = _roblox_tx_cache.get(cache_key, max_age=max_age)
+        if cached is not None:
+            return cached, 'CACHE_HIT'
+        headers = _roblox_cookie_headers(cookie)
+        url = f'https://economy.roblox.com/v2/users/{seller_id}/transactions?transactionType=sale&limit={limit}&sortOrder=Desc'
+        resp = roblox_client.get(url, endpoint='economy', headers=headers)
+        if resp.status_code != 200:
+            return None, f'SALES_HTTP_{resp.status_code}'
+        records = []
+        for tx in resp.json().get('data', []):
+            agent = tx.get('agent') or {}
+            buyer_id = agent.get('id')
+            if not buyer_id:
+                continue
+            buyer_name = _roblox_buyer_name_cache.get(buyer_id)
+            if not buyer_name:
+                try:
+                    u_resp = roblox_client.get(f'https://users.roblox.com/v1/users/{buyer_id}', endpoint='users', headers=headers)
+                    if u_resp.status_code == 200:
+                        buyer_name = u_resp.json().get('name')
+                        if buyer_name:
+                            _roblox_buyer_name_cache[buyer_id] = buyer_name
+                except Exception:
+                    buyer_name = None
+            if not buyer_name:
+                continue
+            details = tx.get('details') or {}
+            records.append({
+                'transactionId': tx.get('id') or tx.get('transactionId') or tx.get('purchaseToken') or tx.get('idHash'),
+                'created': tx.get('created'),
+                'details': details.get('name'),
+                'detailsId': details.get('id'),
+                'amount': (tx.get('currency') or {}).get('amount'),
+                'buyerName': buyer_name
+            })
+        _roblox_tx_cache[cache_key] = records
+        by_buyer = {}
+        for rec in records:
+            by_buyer.setdefault(rec['buyerName'].lower(), []).append(rec)
+        for buyer, recs in by_buyer.items():
+            transaction_waiters.notify(buyer, recs)
+        _match_pending_sales(records)
+        return records, 'FETCHED'
+    return _tx_flight.do(('sale_feed', seller_id, limit), _load)
+
+def _buyer_purchase_page(cookie, uid, limit, max_age):
+    """Return (records, source) for a buyer's newest purchase feed page; same contract as _seller_sales_page."""
+    cache_key = f"purchase_feed_{uid}_{limit}"
+    cached = _roblox_tx_cache.get(cache_key, max_age=max_age)
+    if cached is not None:
+        return cached, 'CACHE_HIT'
+    def _load():
+        cached = _roblox_tx_cache.get(cache_key, max_age=max_age)
+        if cached is not None:
+            return cached, 'CACHE_HIT'
+        url = f'https://economy.roblox.com/v2/users/{uid}/transactions?transactionType=Purchase&limit={limit}&sortOrder=Desc'
+        resp = roblox_client.get(url, endpoint='economy', headers=_roblox_cookie_headers(cookie))
+        if resp.status_code != 200:
+            try:
+                body = resp.text[:1000]
+            except Exception:
+                body = ''
+            logger.warning(f"Purchase transactions HTTP {resp.status_code} for uid={uid}: {body}")
+            return None, f'HTTP_{resp.status_code}'
+        records = []
+        for t in resp.json().get('data', []):
+            tx_id = t.get('id') or t.get('transactionId') or t.get('purchaseToken') or t.get('idHash')
+            created = t.get('created')
+            details = t.get('details') or {}
+            if not tx_id or not created:
+                continue
+            records.append({
+                'transactionId': tx_id,
+                'created': created,
+                'detailsId': details.get('id'),
+                'details': details.get('name')
+            })
+        _roblox_tx_cache[cache_key] = records
+        return records, 'FETCHED'
+    return _tx_flight.do(('purchase_feed', uid, limit), _load)
 
 def _fetch_user_transactions(username: str, force_refresh: bool = False, limit: int = None):
     """Fetch recent PURCHASE transactions for a given buyer (user perspective).
 
     This complements _fetch_sale_transactions (developer/seller perspective). We look up the
-    target user's id and call the Purchase transaction endpoint. Returns a list of normalized
-    dicts [{transactionId, created, detailsId, details, buyerName}]. Always returns a list.
-    Caches results for a short window unless force_refresh is True.
+    target user's id and read that user's Purchase feed (shared per uid, see _buyer_purchase_page).
+    Returns a list of normalized dicts [{transactionId, created, detailsId, details, buyerName}].
+    Always returns a list. force_refresh only accepts a page younger than 0.5s.
     """
     roblox_cfg = SETTINGS.get('roblox', {})
     cookie = roblox_cfg.get('securityCookie')
@@ -109,222 +584,109 @@ def _fetch_user_transactions(username: str, force_refresh: bool = False, limit:
         logger.warning(f"[TXFETCH][purchase] No securityCookie configured; cannot fetch purchase transactions for {username}")
         _tx_fetch_debug[username.lower()] = {
             'mode': 'purchase', 'reason': 'NO_COOKIE', 'count': 0,
-            'force_refresh': force_refresh, 'ts': datetime.now(timezone.utc).isoformat()+'Z'
+            'force_refresh': force_refresh, 'ts': _tx_debug_ts()
         }
         return []
     if 'PUT_.ROBLOSECURITY' in cookie:
         logger.warning(f"[TXFETCH][purchase] Placeholder cookie detected; update config to real .ROBLOSECURITY value")
         _tx_fetch_debug[username.lower()] = {
             'mode': 'purchase', 'reason': 'PLACEHOLDER_COOKIE', 'count': 0,
-            'force_refresh': force_refresh, 'ts': datetime.now(timezone.utc).isoformat()+'Z'
+            'force_refresh': force_refresh, 'ts': _tx_debug_ts()
         }
         return []
     if limit is None:
         limit = roblox_cfg.get('transactionsLimit', 25)
     if limit > 100:
         limit = 100
-    cache_key = f"purchase_tx_{username.lower()}"
-    now = time.time()
-    if (not force_refresh) and cache_key in _roblox_tx_cache and (now - _roblox_tx_cache_time.get(cache_key,0)) < 10:
-        _tx_fetch_debug[username.lower()] = {
-            'mode':'purchase','reason':'CACHE_HIT','count':len(_roblox_tx_cache[cache_key]),
-            'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat()+'Z'
-        }
-        return _roblox_tx_cache[cache_key]
-    rl_key = f"purchase_{username.lower()}"
-    last_call = _user_last_api_call.get(rl_key, 0)
-    min_interval = 0.5 if force_refresh else 2
-    if now - last_call < min_interval:
-        if cache_key in _roblox_tx_cache:
-            _tx_fetch_debug[username.lower()] = {
-                'mode':'purchase','reason':'RATE_LIMIT_CACHE','count':len(_roblox_tx_cache[cache_key]),
-                'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat()+'Z'
-            }
-            return _roblox_tx_cache[cache_key]
-        _tx_fetch_debug[username.lower()] = {
-            'mode':'purchase','reason':'RATE_LIMIT_NO_CACHE','count':0,
-            'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat()+'Z'
-        }
-        return []
-    _user_last_api_call[rl_key] = now
-    headers = {'Cookie': f'.ROBLOSECURITY={cookie}', 'Accept': 'application/json'}
     try:
         uid, _err = fetch_user_id(username)
         if not uid:
             return []
-        url = f'https://economy.roblox.com/v2/users/{uid}/transactions?transactionType=Purchase&limit={limit}&sortOrder=Desc'
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code != 200:
-            try:
-                body = resp.text[:1000]
-            except Exception:
-                body = ''
-            if resp.status_code == 429:
-                _user_last_api_call[rl_key] = now
+        records, source = _buyer_purchase_page(cookie, uid, limit, 0.5 if force_refresh else 10)
+        if records is None:
             _tx_fetch_debug[username.lower()] = {
-                'mode':'purchase','reason':f'HTTP_{resp.status_code}','count':0,
-                'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z'),
-                'httpBody': body
+                'mode':'purchase','reason':source,'count':0,
+                'force_refresh': force_refresh,'ts': _tx_debug_ts()
             }
-            logger.warning(f"Purchase transactions HTTP {resp.status_code} for uid={uid}: {body}")
             return []
-        raw = resp.json().get('data', [])
-        out = []
-        sample = []
-        for t in raw:
-            if len(sample) < 3:
-                sample.append({k: t.get(k) for k in ['id','created','agent','details']})
-            tx_id = t.get('id') or t.get('transactionId') or t.get('purchaseToken') or t.get('idHash')
-            created = t.get('created')
-            details = t.get('details') or {}
-            details_id = details.get('id')
-            details_name = details.get('name')
-            if not tx_id or not created:
-                continue
-            out.append({
-                'transactionId': tx_id,
-                'created': created,
-                'detailsId': details_id,
-                'details': details_name,
-                'buyerName': username
-            })
-        _roblox_tx_cache[cache_key] = out
-        _roblox_tx_cache_time[cache_key] = now
+        out = [dict(rec, buyerName=username) for rec in records]
         _tx_fetch_debug[username.lower()] = {
             'mode': 'purchase',
             'username': username,
+            'reason': source,
             'force_refresh': force_refresh,
             'count': len(out),
-            'sample': sample,
-            'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+            'sample': out[:3],
+            'ts': _tx_debug_ts()
         }
+        if source == 'FETCHED':
+            transaction_waiters.notify(username, out)
         return out
     except Exception as e:
         logger.warning(f"Purchase transaction fetch failure for {username}: {e}")
         _tx_fetch_debug[username.lower()] = {
             'mode':'purchase','reason':f'EXC_{type(e).__name__}','count':0,
-            'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+            'force_refresh': force_refresh,'ts': _tx_debug_ts()
         }
         return []
 
 def _fetch_sale_transactions(username: str, force_refresh: bool = False, limit: int = None):
     """Fetch recent SALE transactions (developer sales) and match those where buyer == username.
 
-    This mirrors logic from the separate Greier script but adds caching, rate limiting, and
-    normalization. Use this when the account whose cookie we have is the CREATOR receiving the
-    Robux from the user's gamepass purchase. The sale record contains the buyer (agent) we match.
+    This mirrors logic from the separate Greier script but adds caching and normalization.
+    Use this when the account whose cookie we have is the CREATOR receiving the Robux from
+    the user's gamepass purchase. The sale record contains the buyer (agent) we match. The
+    seller's feed page is fetched once and shared by every buyer (see _seller_sales_page).
     """
     roblox_cfg = SETTINGS.get('roblox', {})
     cookie = roblox_cfg.get('securityCookie')
     if not cookie:
         logger.warning(f"[TXFETCH][sale] No securityCookie configured; cannot fetch sale transactions for buyer={username}")
         _tx_fetch_debug[username.lower()] = {
-            'mode':'sale','reason':'NO_COOKIE','count':0,'force_refresh':force_refresh,'ts':datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+            'mode':'sale','reason':'NO_COOKIE','count':0,'force_refresh':force_refresh,'ts':_tx_debug_ts()
         }
         return []
     if 'PUT_.ROBLOSECURITY' in cookie:
         logger.warning(f"[TXFETCH][sale] Placeholder cookie detected; update config")
         _tx_fetch_debug[username.lower()] = {
-            'mode':'sale','reason':'PLACEHOLDER_COOKIE','count':0,'force_refresh':force_refresh,'ts':datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+            'mode':'sale','reason':'PLACEHOLDER_COOKIE','count':0,'force_refresh':force_refresh,'ts':_tx_debug_ts()
         }
         return []
     if limit is None:
         limit = roblox_cfg.get('saleTransactionsLimit', roblox_cfg.get('transactionsLimit', 100))
-    cache_key = f"sale_tx_{username.lower()}"
-    now = time.time()
-    if (not force_refresh) and cache_key in _roblox_tx_cache and (now - _roblox_tx_cache_time.get(cache_key,0)) < 8:
-        _tx_fetch_debug[username.lower()] = {
-            'mode':'sale','reason':'CACHE_HIT','count':len(_roblox_tx_cache[cache_key]),
-            'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
-        }
-        return _roblox_tx_cache[cache_key]
-    rl_key = f"sale_{username.lower()}"
-    last_call = _user_last_api_call.get(rl_key, 0)
-    min_interval = 0.4 if force_refresh else 2
-    if now - last_call < min_interval:
-        if cache_key in _roblox_tx_cache:
-            _tx_fetch_debug[username.lower()] = {
-                'mode':'sale','reason':'RATE_LIMIT_CACHE','count':len(_roblox_tx_cache[cache_key]),
-                'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
-            }
-            return _roblox_tx_cache[cache_key]
-        _tx_fetch_debug[username.lower()] = {
-            'mode':'sale','reason':'RATE_LIMIT_NO_CACHE','count':0,
-            'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
-        }
-        return []
-    _user_last_api_call[rl_key] = now
-    headers = {'Cookie': f'.ROBLOSECURITY={cookie}', 'Accept': 'application/json'}
+    if limit > 100:
+        limit = 100
     try:
-        auth_resp = requests.get('https://users.roblox.com/v1/users/authenticated', headers=headers, timeout=10)
-        if auth_resp.status_code != 200:
+        seller_id, err = _seller_id_for(cookie)
+        if not seller_id:
             _tx_fetch_debug[username.lower()] = {
-                'mode':'sale','reason':f'AUTH_{auth_resp.status_code}','count':0,
-                'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+                'mode':'sale','reason':err,'count':0,
+                'force_refresh': force_refresh,'ts': _tx_debug_ts()
             }
             return []
-        seller_id = auth_resp.json().get('id')
-        if not seller_id:
-            return []
-        if limit > 100: 
-            limit = 100
-        url = f'https://economy.roblox.com/v2/users/{seller_id}/transactions?transactionType=sale&limit={limit}&sortOrder=Desc'
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code != 200:
+        records, source = _seller_sales_page(cookie, seller_id, limit, 0.4 if force_refresh else 8)
+        if records is None:
             _tx_fetch_debug[username.lower()] = {
-                'mode':'sale','reason':f'SALES_HTTP_{resp.status_code}','count':0,
-                'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+                'mode':'sale','reason':source,'count':0,
+                'force_refresh': force_refresh,'ts': _tx_debug_ts()
             }
             return []
-        data = resp.json().get('data', [])
-        matched = []
-        samples = []
-        for tx in data:
-            if len(samples) < 3:
-                samples.append({k: tx.get(k) for k in ['id','created','agent','details','currency']})
-            agent = tx.get('agent') or {}
-            buyer_id = agent.get('id')
-            if not buyer_id:
-                continue
-            buyer_name = _roblox_buyer_name_cache.get(buyer_id)
-            if not buyer_name:
-                try:
-                    u_resp = requests.get(f'https://users.roblox.com/v1/users/{buyer_id}', headers=headers, timeout=5)
-                    if u_resp.status_code == 200:
-                        buyer_name = u_resp.json().get('name')
-                        if buyer_name:
-                            _roblox_buyer_name_cache[buyer_id] = buyer_name
-                except Exception:
-                    buyer_name = None
-            if not buyer_name:
-                continue
-            if buyer_name.lower() != username.lower():
-                continue
-            tx_id = tx.get('id') or tx.get('transactionId') or tx.get('purchaseToken') or tx.get('idHash')
-            created = tx.get('created')
-            details = tx.get('details', {})
-            matched.append({
-                'transactionId': tx_id,
-                'created': created,
-                'details': details.get('name'),
-                'detailsId': details.get('id'),
-                'amount': (tx.get('currency') or {}).get('amount'),
-                'buyerName': buyer_name
-            })
-        _roblox_tx_cache[cache_key] = matched
-        _roblox_tx_cache_time[cache_key] = now
+        buyer = username.lower()
+        matched = [rec for rec in records if rec['buyerName'].lower() == buyer]
         _tx_fetch_debug[username.lower()] = {
             'mode': 'sale',
+            'reason': source,
             'count': len(matched),
-            'sample': samples,
-            'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+            'feedSize': len(records),
+            'sample': records[:3],
+            'ts': _tx_debug_ts()
         }
         return matched
     except Exception as e:
         logger.warning(f"Sale transaction fetch failure: {e}")
         _tx_fetch_debug[username.lower()] = {
             'mode':'sale','reason':f'EXC_{type(e).__name__}','count':0,
-            'force_refresh': force_refresh,'ts': datetime.now(timezone.utc).isoformat().replace('+00:00','Z')
+            'force_refresh': force_refresh,'ts': _tx_debug_ts()
         }
         return []
 
@@ -338,17 +700,17 @@ def _refetch_transactions_fallback(username: str, force_refresh: bool = False):
     limit = roblox_cfg.get('transactionsLimit', 10)
     if not cookie or 'PUT_.ROBLOSECURITY' in cookie:
         return []
-    now = time.time()
     cache_key = f"tx_{username.lower()}"
-    if (not force_refresh) and cache_key in _roblox_tx_cache and (now - _roblox_tx_cache_time.get(cache_key,0)) < 15:
-        return _roblox_tx_cache[cache_key]
+    cached = None if force_refresh else _roblox_tx_cache.get(cache_key, max_age=15)
+    if cached is not None:
+        return cached
     headers = {'Cookie': f'.ROBLOSECURITY={cookie}', 'Accept': 'application/json'}
     try:
         uid, _ = fetch_user_id(username)
         if not uid:
             return []
         sales_url = f'https://economy.roblox.com/v2/users/{uid}/transactions?transactionType=sale&limit={limit}&sortOrder=Desc'
-        resp = requests.get(sales_url, headers=headers, timeout=10)
+        resp = roblox_client.get(sales_url, endpoint='economy', headers=headers)
         if resp.status_code != 200:
             return []
         data = resp.json().get('data', [])
@@ -369,7 +731,6 @@ def _refetch_transactions_fallback(username: str, force_refresh: bool = False):
                 'buyerName': username
             })
         _roblox_tx_cache[cache_key] = out
-        _roblox_tx_cache_time[cache_key] = now
         return out
     except Exception:
         return []
@@ -378,7 +739,7 @@ def _load_products_config(force: bool = False):
     """Load products configuration from config/products.json.
     Reload only if file mtime changed unless force=True.
     """
-    global PRODUCTS_CONFIG, SUPPORTED_GAMEPASSES, _products_config_mtime, github_manager, ADMIN_CONFIG, SETTINGS
+    global PRODUCTS_CONFIG, MAIN_PRODUCTS, SUPPORTED_GAMEPASSES, _products_config_mtime, github_manager, ADMIN_CONFIG, SETTINGS
     path = 'config/products.json'
     try:
         if not os.path.exists(path):
@@ -407,6 +768,7 @@ def _load_products_config(force: bool = False):
                         except Exception as inner_e:
                             logging.getLogger(__name__).error(f"Failed parsing product {p}: {inner_e}")
                     PRODUCTS_CONFIG = new_map
+                    MAIN_PRODUCTS = cfg.get('mainProducts', []) or []
                     ADMIN_CONFIG = {
                         'username': os.getenv('ADMIN_USERNAME', cfg.get('admin', {}).get('username', '')),
                         'password': os.getenv('ADMIN_PASSWORD', cfg.get('admin', {}).get('password', ''))
@@ -414,6 +776,17 @@ def _load_products_config(force: bool = False):
                     SETTINGS = cfg.get('settings', {}) or {}
                     SETTINGS['roblox'] = SETTINGS.get('roblox', {})
                     SETTINGS['roblox']['securityCookie'] = os.getenv('ROBLOX_SECURITY_COOKIE', SETTINGS['roblox'].get('securityCookie', ''))
+                    roblox_client.configure(SETTINGS['roblox'].get('client'))
+                    roblox_rate_limiter.configure(SETTINGS['roblox'].get('rateLimits'))
+                    username_resolver.configure(SETTINGS['roblox'].get('userLookup'))
+                    ownership_service.configure(SETTINGS['roblox'].get('ownership'))
+                    password_hasher.configure(SETTINGS.get('passwordHashing'))
+                    guest_sessions.configure(SETTINGS.get('guestSessions'))
+                    pending_purchases.configure(SETTINGS.get('pendingPurchases'))
+                    sales_analytics.configure(SETTINGS.get('analytics'))
+                    stock_snapshots.configure(SETTINGS.get('stockSnapshot'))
+                    stock_counters.configure(SETTINGS.get('stockCounters'))
+                    stock_snapshots.invalidate()
                     SUPPORTED_GAMEPASSES = list(PRODUCTS_CONFIG.keys())
                     _products_config_mtime = current_mtime
                     logging.getLogger(__name__).info(f"Reloaded products config ({len(PRODUCTS_CONFIG)} products)")
@@ -424,96 +797,48 @@ def ensure_products_config_loaded():
     _load_products_config()
 
 _load_products_config(force=True)
+atexit.register(password_hasher.shutdown)
+atexit.register(guest_sessions.save_snapshot)
+atexit.register(pending_purchases.save_snapshot)
 
 
-_latest_stock_snapshot = None
-_latest_stock_snapshot_time = 0
-_products_cache_lock = threading.Lock()
-_products_cache_data = None
-_products_cache_etag = None
-_products_cache_time = 0
-_PRODUCTS_TTL = 5  
+def _stock_catalog():
+    ensure_products_config_loaded()
+    return PRODUCTS_CONFIG, MAIN_PRODUCTS
 
-def _compute_etag(obj):
-    try:
-        payload = json.dumps(obj, sort_keys=True, separators=(',',':'))
-    except Exception:
-        payload = repr(obj)
-    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+def _count_stock(product_id, product):
+    if not github_manager:
+        return 'not_configured'
+    return stock_counters.count(product_id)
 
-def _build_products_payload():
-    import json as _json
-    with open('config/products.json', 'r') as f:
-        config = _json.load(f)
-    products = []
-    for product_id, product_config in PRODUCTS_CONFIG.items():
-        try:
-            if github_manager:
-                stock_file = product_config.get('stock_file', f'Stock/{product_id.upper()}-Stock')
-                if '/' not in stock_file:
-                    stock_file = f'Stock/{stock_file}'
-                current_stock = github_manager.get_file_content(stock_file)
-                stock_count = len(current_stock) if current_stock else 0
-            else:
-                stock_count = 'not_configured'
-            products.append({
-                'id': product_id,
-                'name': product_config.get('name', product_id.title()),
-                'price': product_config.get('price', 1),
-                'gamepass_id': product_config.get('gamepass_id') or product_config.get('gamepassId'),
-                'gamepassUrl': product_config.get('gamepass_url') or product_config.get('gamepassUrl'),
-                'duration': product_config.get('duration', '7 Days'),
-                'stock': stock_count,
-                'parentProduct': product_config.get('parentProduct')
-            })
-        except Exception as e:
-            logger.error(f"Error getting stock for {product_id}: {e}")
-            products.append({
-                'id': product_id,
-                'name': product_config.get('name', product_id.title()),
-                'price': product_config.get('price', 1),
-                'gamepass_id': product_config.get('gamepass_id') or product_config.get('gamepassId'),
-                'gamepassUrl': product_config.get('gamepass_url') or product_config.get('gamepassUrl'),
-                'duration': product_config.get('duration', '7 Days'),
-                'stock': 'unavailable',
-                'parentProduct': product_config.get('parentProduct')
-            })
-    main_products = []
-    if 'mainProducts' in config:
-        for main_product in config['mainProducts']:
-            variants = [p for p in products if p.get('parentProduct') == main_product['id']]
-            total_stock = sum(p['stock'] for p in variants if isinstance(p['stock'], int))
-            min_price = min((p['price'] for p in variants), default=0)
-            main_products.append({
-                **main_product,
-                'totalStock': total_stock,
-                'minPrice': min_price,
-                'variantProducts': variants
-            })
-    payload = {
-        'products': products,
-        'mainProducts': main_products,
-        'generatedAt': datetime.now(timezone.utc).isoformat() + 'Z'
-    }
-    return payload
+def _load_stock_count(product_id):
+    product = PRODUCTS_CONFIG.get(product_id)
+    if not github_manager or not product:
+        return None
+    current_stock = github_manager.read_stock_keys(product['stock_file'])
+    return None if current_stock is None else len(current_stock)
+
+def _on_stock_written(file_path, key_count):
+    for product_id, product in PRODUCTS_CONFIG.items():
+        if product.get('stock_file') == file_path:
+            stock_counters.set_stored(product_id, key_count)
+
+stock_snapshots.catalog = _stock_catalog
+stock_snapshots.count_stock = _count_stock
+stock_counters.load = _load_stock_count
+stock_counters.product_ids = lambda: list(PRODUCTS_CONFIG)
+stock_counters.on_change = lambda _product_id: stock_snapshots.invalidate()
 
 @app.route('/products')
 def get_products():
-    global _products_cache_data, _products_cache_time, _products_cache_etag
     try:
-        now = time.time()
-        with _products_cache_lock:
-            if (not _products_cache_data) or (now - _products_cache_time > _PRODUCTS_TTL):
-                _products_cache_data = _build_products_payload()
-                _products_cache_etag = _compute_etag(_products_cache_data)
-                _products_cache_time = now
-        inm = request.headers.get('If-None-Match')
-        if inm and inm == _products_cache_etag:
+        snapshot = stock_snapshots.get()
+        if snapshot.etag in request.if_none_match:
             resp = make_response('', 304)
         else:
-            resp = make_response(jsonify(_products_cache_data))
+            resp = make_response(jsonify(snapshot.payload))
         resp.headers['Cache-Control'] = 'public, max-age=5'
-        resp.headers['ETag'] = _products_cache_etag
+        resp.set_etag(snapshot.etag)
         return resp
     except Exception as e:
         logger.error(f"Error loading products: {e}")
@@ -545,22 +870,24 @@ def get_products():
     }
     cache_key = f"tx_{username.lower()}"
     now = time.time()
-    if (not force_refresh) and cache_key in _roblox_tx_cache and (now - _roblox_tx_cache_time.get(cache_key,0)) < 15:
+    cached = None if force_refresh else _roblox_tx_cache.get(cache_key, max_age=15)
+    if cached is not None:
         diag['used_cache'] = True
-        diag['matched_buyer_records'] = len(_roblox_tx_cache[cache_key])
+        diag['matched_buyer_records'] = len(cached)
         _tx_fetch_debug[username.lower()] = diag
-        return _roblox_tx_cache[cache_key]
+        return cached
     rate_limit_seconds = 0.5 if force_refresh else 2
     user_key = username.lower()
     last_call = _user_last_api_call.get(user_key, 0)
     if now - last_call < rate_limit_seconds:
         logger.info(f"Rate limiting Roblox API for {username}, last call {now - last_call:.1f}s ago (limit: {rate_limit_seconds}s)")
-        if cache_key in _roblox_tx_cache:
+        stale = _roblox_tx_cache.get(cache_key)
+        if stale is not None:
             diag['used_cache'] = True
-            diag['matched_buyer_records'] = len(_roblox_tx_cache[cache_key])
+            diag['matched_buyer_records'] = len(stale)
             _tx_fetch_debug[username.lower()] = diag
             logger.info(f"Using expired cache for {username} due to rate limit")
-            return _roblox_tx_cache[cache_key]
+            return stale
         else:
             diag['error'] = 'RATE_LIMIT_NO_CACHE'
             _tx_fetch_debug[username.lower()] = diag
@@ -569,12 +896,13 @@ def get_products():
     _user_last_api_call[user_key] = now
     def _return_stale(reason):
         diag['error'] = reason
-        if cache_key in _roblox_tx_cache:
+        stale = _roblox_tx_cache.get(cache_key)
+        if stale is not None:
             diag['used_cache'] = True
-            diag['matched_buyer_records'] = len(_roblox_tx_cache[cache_key])
+            diag['matched_buyer_records'] = len(stale)
             _tx_fetch_debug[username.lower()] = diag
             logger.info(f"Transaction fetch diag (stale {reason}): {diag}")
-            return _roblox_tx_cache[cache_key]
+            return stale
         _tx_fetch_debug[username.lower()] = diag
         logger.info(f"Transaction fetch diag (no stale {reason}): {diag}")
         return []
@@ -585,19 +913,15 @@ def get_products():
         return _return_stale('PLACEHOLDER_COOKIE')
     headers = {'Cookie': f'.ROBLOSECURITY={cookie}', 'Accept': 'application/json'}
     try:
-        auth_resp = requests.get('https://users.roblox.com/v1/users/authenticated', headers=headers, timeout=10)
+        auth_resp = roblox_client.get('https://users.roblox.com/v1/users/authenticated', endpoint='users', headers=headers)
         diag['auth_status'] = auth_resp.status_code
         if auth_resp.status_code != 200:
-            if auth_resp.status_code == 429:
-                _user_last_api_call[user_key] = now + 60  
             return _return_stale(f'AUTH_{auth_resp.status_code}')
         authed_id = auth_resp.json().get('id')
         sales_url = f'https://economy.roblox.com/v2/users/{authed_id}/transactions?transactionType=sale&limit={limit}&sortOrder=Desc'
-        sales_resp = requests.get(sales_url, headers=headers, timeout=10)
+        sales_resp = roblox_client.get(sales_url, endpoint='economy', headers=headers)
         diag['sales_status'] = sales_resp.status_code
         if sales_resp.status_code != 200:
-            if sales_resp.status_code == 429:
-                _user_last_api_call[user_key] = now + 60 
             return _return_stale(f'SALES_{sales_resp.status_code}')
         raw_json = sales_resp.json()
         data = raw_json.get('data', [])
@@ -652,7 +976,7 @@ def get_products():
                 if not bname:
                     try:
                         diag['per_tx_name_lookups'] += 1
-                        u_resp = requests.get(f'https://users.roblox.com/v1/users/{buyer_id}', headers=headers, timeout=5)
+                        u_resp = roblox_client.get(f'https://users.roblox.com/v1/users/{buyer_id}', endpoint='users', headers=headers)
                         if u_resp.status_code == 200:
                             bname = u_resp.json().get('name','')
                             if bname:
@@ -686,13 +1010,21 @@ def get_products():
             diag['skip_missing_created'] = skip_missing_created
             diag['fallback_id_used'] = fallback_id_used
         _roblox_tx_cache[cache_key] = out
-        _roblox_tx_cache_time[cache_key] = now
         _tx_fetch_debug[username.lower()] = diag
         logger.info(f"Transaction fetch diag: {diag}")
         return out
     except Exception as e:
         return _return_stale(f'EXC_{type(e).__name__}')
 
+def _fetch_transactions_for(username, force_refresh=False):
+    """Fetch the buyer's recent transactions from the preferred feed, falling back to the other."""
+    if SETTINGS.get('roblox', {}).get('preferSalesAPI', True):
+        txs = _fetch_sale_transactions(username, force_refresh=force_refresh)
+        if not txs:
+            txs = _fetch_user_transactions(username, force_refresh=force_refresh)
+        return txs
+    return _fetch_user_transactions(username, force_refresh=force_refresh)
+
 def _eligible_unclaimed_transactions(username, gamepass_id=None, force_refresh=False):
     """Return recent, unclaimed purchase transactions optionally filtered by gamepass id.
 
@@ -702,13 +1034,7 @@ def _eligible_unclaimed_transactions(username, gamepass_id=None, force_refresh=F
     prefer_sales = SETTINGS.get('roblox', {}).get('preferSalesAPI', True)
     extreme_debug = SETTINGS.get('roblox', {}).get('extremeDebug', False)
     extreme_trace_limit = int(SETTINGS.get('roblox', {}).get('extremeTraceLimit', 120))
-    txs = []
-    if prefer_sales:
-        txs = _fetch_sale_transactions(username, force_refresh=force_refresh)
-        if not txs: 
-            txs = _fetch_user_transactions(username, force_refresh=force_refresh)
-    else:
-        txs = _fetch_user_transactions(username, force_refresh=force_refresh)
+    txs = _fetch_transactions_for(username, force_refresh=force_refresh)
     if extreme_debug:
         logger.info(f"[EXTDBG] Initial transactions fetched for {username}: {len(txs)} (prefer_sales={prefer_sales})")
     claimed = _load_claimed_transactions()
@@ -809,112 +1135,19 @@ def _eligible_unclaimed_transactions(username, gamepass_id=None, force_refresh=F
         _tx_fetch_debug[username.lower()] = diag
     return eligible
 
-def _check_gamepass_ownership(roblox_user_id: int, gamepass_id: str, cookie: str):
-    """Fast ownership probe. Returns (owned: bool, detail: str). Tries multiple endpoints.
-    Endpoints:
-      - https://inventory.roblox.com/v1/users/{uid}/items/GamePass/{gamepass_id} (presence in data array)
-      - https://games.roblox.com/v1/games/game-passes/{gamepass_id}/servers (not reliable for ownership; skipped)
-      - https://api.roblox.com/ownership/hasasset?userId={uid}&assetId={gamepass_id} (legacy, still works for some passes)
-    """
-    headers = {'Accept': 'application/json'}
-    if cookie and 'PUT_.ROBLOSECURITY' not in cookie:
-        headers['Cookie'] = f'.ROBLOSECURITY={cookie}'
-    try:
-        inv_url = f"https://inventory.roblox.com/v1/users/{roblox_user_id}/items/GamePass/{gamepass_id}?limit=10"
-        r = requests.get(inv_url, headers=headers, timeout=6)
-        if r.status_code == 200:
-            j = r.json()
-            data = j.get('data', []) if isinstance(j, dict) else []
-            if any(str(item.get('id')) == str(gamepass_id) for item in data):
-                return True, 'inventory'
-        elif r.status_code == 429:
-            return False, 'inventory_rate'
-    except Exception:
-        pass
-    try:
-        legacy_url = f"https://api.roblox.com/ownership/hasasset?userId={roblox_user_id}&assetId={gamepass_id}"
-        r2 = requests.get(legacy_url, headers=headers, timeout=6)
-        if r2.status_code == 200:
-            txt = r2.text.strip().lower()
-            if txt == 'true':
-                return True, 'legacy'
-        elif r2.status_code == 429:
-            return False, 'legacy_rate'
-    except Exception:
-        pass
-    return False, 'none'
-
-def _gather_stock_snapshot():
-    """Build a snapshot of current stock and aggregated main product stock."""
-    global _latest_stock_snapshot, _latest_stock_snapshot_time
-    ensure_products_config_loaded()
-    snapshot = {'products': {}, 'generatedAt': datetime.now(timezone.utc).isoformat() + 'Z'}
-    try:
-        for pid, pconf in PRODUCTS_CONFIG.items():
-            stock_count = None
-            if github_manager:
-                try:
-                    raw = github_manager.get_file_content(pconf.get('stock_file', f'{pid.upper()}-Stock'))
-                    stock_count = len(raw) if raw else 0
-                except Exception:
-                    stock_count = None
-            snapshot['products'][pid] = {
-                'stock': stock_count,
-                'price': pconf.get('price'),
-                'parentProduct': pconf.get('parentProduct')
-            }
-        try:
-            with open('config/products.json','r') as f:
-                cfg = json.load(f)
-            main_products_cfg = cfg.get('mainProducts', [])
-            main_products = []
-            for mp in main_products_cfg:
-                variants = [pid for pid, pc in PRODUCTS_CONFIG.items() if pc.get('parentProduct') == mp['id']]
-                total_stock = 0
-                min_price = None
-                for vid in variants:
-                    vs = snapshot['products'].get(vid, {})
-                    s = vs.get('stock')
-                    if isinstance(s, int):
-                        total_stock += s
-                    price = vs.get('price')
-                    if price is not None:
-                        if min_price is None or price < min_price:
-                            min_price = price
-                main_products.append({
-                    'id': mp['id'],
-                    'name': mp.get('name'),
-                    'totalStock': total_stock,
-                    'minPrice': min_price,
-                    'variantIds': variants
-                })
-            snapshot['mainProducts'] = main_products
-        except Exception:
-            snapshot['mainProducts'] = []
-    finally:
-        _latest_stock_snapshot = snapshot
-        _latest_stock_snapshot_time = time.time()
-    return snapshot
-
-def _get_stock_snapshot(max_age=5):
-    if not _latest_stock_snapshot or (time.time() - _latest_stock_snapshot_time) > max_age:
-        return _gather_stock_snapshot()
-    return _latest_stock_snapshot
-
 @app.route('/stock-stream')
 def stock_stream():
     """Server-Sent Events endpoint streaming stock updates."""
     def event_stream():
         retry_ms = 5000
         yield f'retry: {retry_ms}\n'  
-        last_payload = None
+        last_version = None
         while True:
             try:
-                snapshot = _get_stock_snapshot()
-                payload = json.dumps(snapshot)
-                if payload != last_payload:
-                    yield f'data: {payload}\n\n'
-                    last_payload = payload
+                snapshot = stock_snapshots.get()
+                if snapshot.version != last_version:
+                    yield f'data: {snapshot.stream_json}\n\n'
+                    last_version = snapshot.version
                 default_sleep = SETTINGS.get('sse', {}).get('sleepDefault', 10)
                 burst_sleep = SETTINGS.get('sse', {}).get('sleepBurst', 2)
                 sleep_time = default_sleep
@@ -928,6 +1161,80 @@ def stock_stream():
                 time.sleep(5)
     return app.response_class(event_stream(), mimetype='text/event-stream')
 
+class PurchaseStatusBoard:
+    """Latest status of each pending purchase (waiting -> detected -> key_issued, or expired).
+    Entries carry a monotonically increasing version so SSE streams can block until a
+    newer status is published instead of polling. Each key being waited on gets its own
+    condition (sharing one lock), so a publish only wakes the streams of that purchase.
+    """
+
+    TERMINAL = ('key_issued', 'expired')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conds = {}  # key -> [Condition, waiting streams], only while someone waits
+        self._entries = TTLCache(maxsize=10000, ttl=PENDING_PURCHASE_EXPIRY_SECONDS + PRE_START_GRACE_SECONDS, name='purchase_status')
+        self._subscribers = {}
+        self._version = 0
+
+    def publish(self, key, status, **data):
+        if not key:
+            return
+        with self._lock:
+            self._version += 1
+            self._entries[key] = {'status': status, 'version': self._version, 'updatedAt': utc_now_iso(), **data}
+            slot = self._conds.get(key)
+            if slot:
+                slot[0].notify_all()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry else None
+
+    def wait_for_change(self, key, after_version, timeout):
+        """Return the entry once its version exceeds after_version, or None on timeout."""
+        deadline = time.time() + timeout
+        with self._lock:
+            slot = self._conds.get(key)
+            if slot is None:
+                slot = self._conds[key] = [threading.Condition(self._lock), 0]
+            slot[1] += 1
+            try:
+                while True:
+                    entry = self._entries.get(key)
+                    if entry and entry['version'] > after_version:
+                        return dict(entry)
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    slot[0].wait(remaining)
+            finally:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._conds[key]
+
+    def subscribe(self, key):
+        with self._lock:
+            self._subscribers[key] = self._subscribers.get(key, 0) + 1
+
+    def unsubscribe(self, key):
+        with self._lock:
+            count = self._subscribers.get(key, 0) - 1
+            if count > 0:
+                self._subscribers[key] = count
+            else:
+                self._subscribers.pop(key, None)
+
+    def subscriber_count(self, key):
+        with self._lock:
+            return self._subscribers.get(key, 0)
+
+purchase_status = PurchaseStatusBoard()
+
+def _purchase_status_key(owner_id, product_id, roblox_username):
+    return f"{owner_id}::{product_id}::{roblox_username.lower()}"
+
 app.config.update(
     SESSION_COOKIE_SECURE=False,
     SESSION_COOKIE_HTTPONLY=True,
@@ -982,12 +1289,26 @@ def ensure_naive_utc(dt: datetime):
             return dt.replace(tzinfo=None)
     return dt
 
-user_locks = {}
-lock_manager_lock = threading.Lock()
-rate_limit_cache = {}
-request_cache = {}
+# Per-username locks exist only while held or waited on (see keyed_locks)
+user_locks = KeyedLocks(name='user_locks')
+request_cache = TTLCache(maxsize=4096, ttl=3600, name='request_cache')
+# session user_id -> (account revision, user view); stale once the account revision moves
+_session_user_cache = TTLCache(maxsize=4096, ttl=600, name='session_users')
+# user_id -> (history version, merged oldest-first purchase index) for /purchase-history
+_purchase_index_cache = TTLCache(maxsize=2048, ttl=600, name='purchase_history_index')
+
+# Local runtime state (snapshots etc.) lives under DATA_DIR; static_folder='.' must never serve it
+DATA_DIR = 'data'
 
-persistent_user_cache = {}
+@app.before_request
+def refuse_private_files():
+    if request.endpoint != 'static':
+        return None
+    path = os.path.normpath((request.view_args or {}).get('filename') or '')
+    private = {os.path.normpath(p) for p in (pending_purchases.snapshot_path, guest_sessions.snapshot_path) if p}
+    if path.split(os.sep)[0] == DATA_DIR or path in private or path.split('.tmp')[0] in private:
+        return jsonify({'error': 'Not found'}), 404
+    return None
 
 @app.after_request
 def add_cache_headers(response):
@@ -1011,10 +1332,10 @@ def add_cache_headers(response):
 @app.route('/clear-cache', methods=['POST'])
 def clear_cache_endpoint():
     """Clear cache endpoint for testing."""
-    global request_cache, persistent_user_cache, rate_limit_cache
     request_cache.clear()
-    persistent_user_cache.clear()
-    rate_limit_cache.clear()
+    username_resolver.clear()
+    ownership_service.clear()
+    roblox_rate_limiter.reset()
     logger.info("All caches cleared")
     return jsonify({'message': 'All caches cleared successfully'})
 
@@ -1025,32 +1346,15 @@ def get_user_lock(username, product_id=None):
     if product_id not provided.
     """
     key = f"{username.lower()}::{product_id}" if product_id else username.lower()
-    with lock_manager_lock:
-        if key not in user_locks:
-            user_locks[key] = threading.Lock()
-        return user_locks[key]
-
-def is_rate_limited(key, limit_seconds=30):
-    """Check if a request is rate limited."""
-    now = datetime.now()
-    if key in rate_limit_cache:
-        last_request = rate_limit_cache[key]
-        if now - last_request < timedelta(seconds=limit_seconds):
-            return True
-    rate_limit_cache[key] = now
-    return False
+    return user_locks.get(key)
 
 def get_cached_response(cache_key, max_age_seconds=60):
     """Get cached response if available and not expired."""
-    if cache_key in request_cache:
-        cached_data, timestamp = request_cache[cache_key]
-        if datetime.now() - timestamp < timedelta(seconds=max_age_seconds):
-            return cached_data
-    return None
+    return request_cache.get(cache_key, max_age=max_age_seconds)
 
 def cache_response(cache_key, data):
     """Cache a response."""
-    request_cache[cache_key] = (data, datetime.now())
+    request_cache[cache_key] = data
 
 class KeyManager:
     def __init__(self):
@@ -1079,166 +1383,614 @@ class KeyManager:
         random_part = secrets.token_urlsafe(8)
         return f"{prefix}_{random_part}"
 
+MIGRATIONS_DIR = 'Migrations'
+
+def migration_done(gh, name):
+    """True once mark_migration_done(name) has been recorded in storage."""
+    text, _sha = gh.get_raw_file(f"{MIGRATIONS_DIR}/{name}.json")
+    return bool(text)
+
+def mark_migration_done(gh, name, **info):
+    """Record that a one-time migration finished so later starts skip it."""
+    body = json.dumps({'name': name, 'completed_at': utc_now_iso(), **info}, separators=(',', ':'))
+    if gh.put_raw_file(f"{MIGRATIONS_DIR}/{name}.json", body, f"Mark migration {name} complete") is None:
+        logger.warning(f"Could not record completion of migration {name}; it will be re-checked next start")
+        return False
+    return True
+
 class AccountManager:
+    """Accounts stored one record per file at AccountRecords/<uid[:2]>/<uid>.json.
+
+    Every record carries a version that is bumped on each write, and writes go through the
+    contents API with the record's last known sha, so a save costs one small PUT no matter
+    how many accounts exist. Lookups by account username and by Roblox username go through
+    an index stored in 16 shard files (AccountIndex/<h>.json: user_id -> username and Roblox
+    names), so startup reads those rather than every record; records themselves are fetched
+    on first use and cached. The index is built once from a per-directory listing of
+    AccountRecords (the legacy single-blob 'Accounts' file is migrated at the same time) and
+    kept in step with every create/update/delete. Until it has loaded, registration and
+    account writes are refused; a failed load is retried after accounts.loadRetrySeconds,
+    not on every request. Low-value updates
+    (last_login, password rehashes) are applied in memory and flushed in debounced batches;
+    registration and purchase history stay synchronous.
+    """
+
     def __init__(self, github_manager):
         self.github_manager = github_manager
-        self.accounts_file = 'Accounts'
-        self.cache = {}
-        self.cache_timestamp = None
-        self.cache_duration = 60
-    
-    def _is_cache_valid(self):
-        """Check if cache is still valid"""
-        if not self.cache_timestamp:
+        self.records_dir = 'AccountRecords'
+        self.legacy_accounts_file = 'Accounts'
+        self.index_dir = 'AccountIndex'
+        self.accounts = {}  # user_id -> record, for the records fetched so far
+        self._shas = {}
+        self._loaded = False
+        self._load_failed_at = 0.0
+        self._load_lock = threading.Lock()
+        self._register_lock = threading.Lock()
+        self._record_locks = KeyedLocks(name='account_locks')
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._dirty_event = threading.Event()
+        self._flusher = None
+        self._index_lock = threading.Lock()
+        self._index_save_lock = threading.Lock()
+        self._entries = {}  # user_id -> {'u': username, 'r': [roblox names]} for every account
+        self._index_dirty = {}  # user_id -> entry (None once deleted) not yet in the stored index
+        self._by_username = {}
+        self._by_roblox_username = {}
+        self._revisions = {}
+        self._deferred = {}  # user_id -> deferred mutators applied in memory but not yet written
+
+    def revision(self, user_id):
+        """In-memory change counter for one account; moves on every create/update/delete."""
+        return self._revisions.get(user_id, 0)
+
+    def _bump_revision(self, user_id):
+        self._revisions[user_id] = self._revisions.get(user_id, 0) + 1
+
+    @staticmethod
+    def _roblox_names(account):
+        names = set()
+        if account.get('roblox_username'):
+            names.add(account['roblox_username'].lower())
+        names.update(n.lower() for n in account.get('roblox_usernames') or [])
+        for entry in account.get('purchase_history') or []:
+            if isinstance(entry, dict) and entry.get('roblox_username'):
+                names.add(entry['roblox_username'].lower())
+        return names
+
+    @classmethod
+    def _index_entry(cls, account):
+        return {'u': (account.get('username') or '').lower(), 'r': sorted(cls._roblox_names(account))}
+
+    def _set_entry(self, user_id, entry, persist=True):
+        """Point the lookup indexes at entry (None drops the account). With persist=True a
+        change is queued for the stored index (see _save_index)."""
+        with self._index_lock:
+            old = self._entries.get(user_id)
+            if old == entry:
+                return
+            if old:
+                if old['u'] and self._by_username.get(old['u']) == user_id:
+                    del self._by_username[old['u']]
+                for name in old['r']:
+                    uids = self._by_roblox_username.get(name)
+                    if uids is not None:
+                        uids.discard(user_id)
+                        if not uids:
+                            del self._by_roblox_username[name]
+            if entry:
+                self._entries[user_id] = entry
+                if entry['u']:
+                    self._by_username[entry['u']] = user_id
+                for name in entry['r']:
+                    self._by_roblox_username.setdefault(name, set()).add(user_id)
+            else:
+                self._entries.pop(user_id, None)
+            if persist:
+                self._index_dirty[user_id] = entry
+
+    def _index_path(self, user_id):
+        return f"{self.index_dir}/{hashlib.sha1(user_id.encode('utf-8')).hexdigest()[0]}.json"
+
+    def _save_index(self):
+        """Write queued index changes, one read-merge-write per touched shard against the
+        shard's sha. Changes that fail stay queued (the flusher retries them). Returns True
+        when nothing is left unsaved."""
+        with self._index_save_lock:
+            with self._index_lock:
+                dirty, self._index_dirty = self._index_dirty, {}
+            by_shard = {}
+            for uid, entry in dirty.items():
+                by_shard.setdefault(self._index_path(uid), {})[uid] = entry
+            failed = {}
+            for path, changes in by_shard.items():
+                saved = False
+                try:
+                    for _attempt in range(3):
+                        text, sha = self.github_manager.get_raw_file(path)
+                        shard = json.loads(text) if text else {}
+                        for uid, entry in changes.items():
+                            if entry is None:
+                                shard.pop(uid, None)
+                            else:
+                                shard[uid] = entry
+                        body = json.dumps(shard, separators=(',', ':'), sort_keys=True)
+                        if self.github_manager.put_raw_file(path, body, f"Update account index ({len(changes)} changes)", sha=sha):
+                            saved = True
+                            break
+                except Exception as e:
+                    logger.warning(f"Account index shard {path} not saved: {e}")
+                if not saved:
+                    failed.update(changes)
+            if failed:
+                with self._index_lock:
+                    for uid, entry in failed.items():
+                        self._index_dirty.setdefault(uid, entry)  # a newer change wins
+                logger.warning(f"{len(failed)} account index changes not saved; will retry")
+                self._wake_flusher()
+            return not failed
+
+    def find_user_id(self, username):
+        """O(1) account username (case-insensitive) -> user_id, or None."""
+        self._ensure_loaded()
+        return self._by_username.get((username or '').lower())
+
+    def find_by_roblox_username(self, roblox_username):
+        """Return the set of user_ids linked to a Roblox username (profile or purchases)."""
+        self._ensure_loaded()
+        with self._index_lock:
+            return set(self._by_roblox_username.get((roblox_username or '').lower(), ()))
+
+    def search(self, query):
+        """Exact-match admin search over user id, account username and Roblox username."""
+        self._ensure_loaded()
+        q = (query or '').strip()
+        found = []
+        if q in self._entries:
+            found.append(q)
+        uid = self.find_user_id(q)
+        if uid and uid not in found:
+            found.append(uid)
+        for uid in sorted(self.find_by_roblox_username(q)):
+            if uid not in found:
+                found.append(uid)
+        return found
+
+    def _record_path(self, user_id):
+        return f"{self.records_dir}/{user_id[:2]}/{user_id}.json"
+
+    def _record_lock(self, user_id):
+        return self._record_locks.get(user_id)
+
+    def _fetch(self, user_id):
+        """The cached record of a known account, read from storage on first use; None if
+        there is no such account. Caller holds the record lock."""
+        account = self.accounts.get(user_id)
+        if account is None and user_id in self._entries:
+            text, sha = self.github_manager.get_raw_file(self._record_path(user_id))
+            if text:
+                account = self.accounts[user_id] = json.loads(text)
+                self._shas[user_id] = sha
+        return account
+
+    def _get(self, user_id):
+        if not user_id or not self._ensure_loaded():
+            return None
+        if user_id in self.accounts:
+            return self.accounts[user_id]
+        with self._record_lock(user_id):
+            return self._fetch(user_id)
+
+    def _ensure_loaded(self):
+        """Load the account index, building it on first run. Returns False while it is not
+        available; writers must then refuse rather than act on a partial index."""
+        if self._loaded:
+            return True
+        if not self.github_manager:
             return False
-        return (datetime.now() - self.cache_timestamp).seconds < self.cache_duration
-    
-    def load_accounts(self):
-        """Load accounts from GitHub"""
-        if self._is_cache_valid():
-            return self.cache
-            
+        with self._load_lock:
+            if self._loaded:
+                return True
+            if time.time() - self._load_failed_at < float(SETTINGS.get('accounts', {}).get('loadRetrySeconds', 30)):
+                return False
+            try:
+                build = not migration_done(self.github_manager, 'account-index')
+                entries = self._scan_records() if build else self._read_index()
+                with self._index_lock:
+                    self._entries, self._by_username, self._by_roblox_username = {}, {}, {}
+                for uid, entry in entries.items():
+                    self._set_entry(uid, entry, persist=build)
+                self._migrate_legacy_blob()
+                if self._save_index() and build:
+                    mark_migration_done(self.github_manager, 'account-index', accounts=len(self._entries))
+                self._loaded = True
+                logger.info(f"Loaded account index: {len(self._entries)} accounts{' (built from records)' if build else ''}")
+            except Exception as e:
+                self._load_failed_at = time.time()
+                logger.error(f"Error loading accounts (account writes refused until it loads): {e}")
+                return False
+        self._import_legacy_pending()
+        return True
+
+    def _read_index(self):
+        paths = [f"{self.index_dir}/{h}.json" for h in '0123456789abcdef']
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix='account-load') as pool:
+            texts = list(pool.map(lambda path: self.github_manager.get_raw_file(path)[0], paths))
+        entries = {}
+        for text in texts:
+            if text:
+                entries.update(json.loads(text))
+        return entries
+
+    def _scan_records(self):
+        """Index build: list AccountRecords one shard directory at a time and read every record
+        (cached, so they need not be fetched again). A failed listing or read aborts the build
+        instead of producing an index with accounts missing."""
+        gm = self.github_manager
+        def _list(shard):
+            listing = gm.list_directory(shard)
+            if len(listing) >= 1000:
+                raise RuntimeError(f"{shard} has 1000+ entries, more than one directory listing returns")
+            return listing
+        shards = [e['path'] for e in gm.list_directory(self.records_dir, entry_type='dir')]
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix='account-load') as pool:
+            files = [e for listing in pool.map(_list, shards) for e in listing if e['name'].endswith('.json')]
+            reads = list(pool.map(lambda e: gm.get_raw_file(e['path']), files))
+        entries = {}
+        for entry, (text, sha) in zip(files, reads):
+            if text:
+                uid = entry['name'][:-len('.json')]
+                self.accounts[uid] = json.loads(text)
+                self._shas[uid] = sha
+                entries[uid] = self._index_entry(self.accounts[uid])
+        return entries
+
+    def _migrate_legacy_blob(self):
+        """Copy accounts from the old single 'Accounts' JSON blob into per-record files.
+        Already migrated ids are skipped, so an interrupted migration resumes on next start;
+        once every id is copied a marker is written and the blob is never read again (so
+        accounts deleted afterwards stay deleted)."""
+        if migration_done(self.github_manager, 'accounts-blob'):
+            return
+        content_list = self.github_manager.get_file_content(self.legacy_accounts_file)
+        legacy = {}
+        if content_list:
+            try:
+                legacy = json.loads(content_list[0])
+            except Exception as e:
+                logger.error(f"Legacy accounts blob unreadable, not migrating: {e}")
+                return
+        missing = {uid: acct for uid, acct in legacy.items() if uid not in self._entries}
+        if missing:
+            logger.info(f"Migrating {len(missing)} accounts from legacy '{self.legacy_accounts_file}' blob")
+        failed = 0
+        for uid, acct in missing.items():
+            acct.setdefault('version', 0)
+            if self._write_record(uid, acct):
+                self.accounts[uid] = acct
+                self._set_entry(uid, self._index_entry(acct))
+            elif not self.github_manager.get_raw_file(self._record_path(uid))[0]:
+                # A record that appeared meanwhile (another instance migrating) counts as copied.
+                failed += 1
+        if failed:
+            logger.warning(f"{failed} legacy accounts not migrated; retrying next start")
+            return
+        mark_migration_done(self.github_manager, 'accounts-blob', accounts=len(legacy), copied=len(missing))
+
+    def _import_legacy_pending(self):
+        """Hand pending purchases still stored on account records to the pending purchase store.
+        Only records already in memory are looked at (all of them right after an index build)."""
+        moved = 0
+        for uid, acct in list(self.accounts.items()):
+            pending = acct.get('pending_purchases')
+            if not isinstance(pending, dict) or not pending:
+                continue
+            for key, info in pending.items():
+                product_id, _sep, roblox_username = key.partition('::')
+                started = _epoch_from_iso(info.get('started_at')) if isinstance(info, dict) else None
+                if product_id and roblox_username and started and started + PENDING_PURCHASE_EXPIRY_SECONDS > time.time():
+                    gamepass_id = (PRODUCTS_CONFIG.get(product_id) or {}).get('gamepass_id')
+                    pending_purchases.start(uid, roblox_username, product_id, gamepass_id, started_at=started)
+                    moved += 1
+            self._mutate(uid, lambda a: a.pop('pending_purchases', None), defer=True)
+        if moved:
+            logger.info(f"Moved {moved} pending purchases from account records into the pending store")
+
+    def _write_record(self, user_id, account):
+        """Persist one account against its last known sha; bumps account['version'].
+        A sha conflict fails like any other error (the remote record is never overwritten);
+        see _rebase. Caller holds the record lock."""
+        if not self.github_manager:
+            logger.warning("GitHub manager not available")
+            return False
+        account['version'] = int(account.get('version', 0)) + 1
+        body = json.dumps(account, separators=(',', ':'))
+        sha = self.github_manager.put_raw_file(self._record_path(user_id), body, f"Update account {user_id} v{account['version']}", sha=self._shas.get(user_id))
+        if sha is None:
+            account['version'] -= 1
+            return False
+        self._shas[user_id] = sha
+        return True
+
+    def _rebase(self, user_id):
+        """After a failed write, adopt the remote record if it moved under us and re-apply the
+        deferred mutators not yet written. Returns the new in-memory record, or None when the
+        failure was not a conflict (remote unchanged, gone or unreadable). Caller holds the lock."""
         try:
-            if not self.github_manager:
-                logger.warning("GitHub manager not available")
-                return {}
-            
-            content_list = self.github_manager.get_file_content(self.accounts_file)
-            if content_list and len(content_list) > 0:
-                accounts = json.loads(content_list[0])
-                self.cache = accounts
-                self.cache_timestamp = datetime.now()
-                logger.info(f"Loaded accounts, found {len(accounts)} accounts")
-                return accounts
-            else:
-                logger.info("No accounts file found, initializing empty")
-                return {}
-                
+            text, remote_sha = self.github_manager.get_raw_file(self._record_path(user_id))
         except Exception as e:
-            logger.error(f"Error loading accounts: {e}")
-            return {}
-    
-    def save_accounts(self, accounts):
-        """Save accounts to GitHub"""
-        try:
-            if not self.github_manager:
-                logger.warning("GitHub manager not available")
-                return False
-            
-            self.cache = accounts
-            self.cache_timestamp = datetime.now()
-            
-            logger.info("Attempting to save accounts data to GitHub")
-            json_data = json.dumps(accounts, indent=2)
-            logger.info(f"Converted accounts to JSON, length: {len(json_data)}")
-            
-            success = self.github_manager.update_file_content(
-                self.accounts_file,
-                [json_data],
-                "Update accounts data"
-            )
-            logger.info(f"GitHub update result: {success}")
-            return success
-        except Exception as e:
-            logger.error(f"Failed to save accounts: {e}")
+            logger.warning(f"Could not re-read account {user_id} after a failed write: {e}")
+            return None
+        if not text or remote_sha == self._shas.get(user_id):
+            return None
+        remote = json.loads(text)
+        for fn in self._deferred.get(user_id, ()):
+            fn(remote)
+        logger.info(f"Account {user_id} changed remotely (v{remote.get('version')}); re-applying local changes")
+        self._shas[user_id] = remote_sha
+        self._replace(user_id, remote)
+        return remote
+
+    def _replace(self, user_id, updated):
+        self.accounts[user_id] = updated
+        self._bump_revision(user_id)
+        self._set_entry(user_id, self._index_entry(updated))
+        if self._index_dirty:
+            self._wake_flusher()
+
+    def _mutate(self, user_id, fn, defer=False):
+        """Apply fn(account_copy) -> result to one account and persist it.
+        With defer=True the change is applied in memory immediately and the record is only
+        marked dirty; the background flusher writes it (coalesced with later changes).
+        If the record changed remotely, fn is re-applied to the remote version and the write
+        retried, so fn must be safe to run more than once.
+        Returns (saved, result); saved is None when the account does not exist."""
+        if not self._ensure_loaded():
+            return False, None
+        with self._record_lock(user_id):
+            current = self._fetch(user_id)
+            if current is None:
+                return None, None
+            for _attempt in range(3):
+                # Mutators only touch top-level fields and containers, so copying one level deep is
+                # enough; purchase history entries themselves are shared, not cloned per update.
+                updated = {k: (v.copy() if isinstance(v, (dict, list)) else v) for k, v in current.items()}
+                result = fn(updated)
+                if defer:
+                    self._deferred.setdefault(user_id, []).append(fn)
+                    break
+                if self._write_record(user_id, updated):
+                    self._deferred.pop(user_id, None)
+                    with self._dirty_lock:
+                        self._dirty.discard(user_id)
+                    break
+                current = self._rebase(user_id)
+                if current is None:
+                    return False, result
+            else:
+                return False, result
+            self._replace(user_id, updated)
+        if defer:
+            self._mark_dirty(user_id)
+        return True, result
+
+    def _mark_dirty(self, user_id):
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+        self._wake_flusher()
+
+    def _wake_flusher(self):
+        with self._dirty_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='account-flusher', daemon=True)
+                self._flusher.start()
+        self._dirty_event.set()
+
+    def _flush_loop(self):
+        """Wait for dirty records, let a burst settle for flushDelaySeconds, then write each once."""
+        while True:
+            self._dirty_event.wait()
+            time.sleep(float(SETTINGS.get('accounts', {}).get('flushDelaySeconds', 2)))
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Account flush failed: {e}")
+
+    def update_account(self, user_id, fn):
+        """Apply fn(account) -> result to one account and save it now (see _mutate for the
+        conflict handling; fn may run more than once). Returns (saved, result); saved is None
+        when the account does not exist."""
+        return self._mutate(user_id, fn)
+
+    def flush(self):
+        """Write every dirty account record (and queued index changes) now. Returns the number
+        of records written; failures stay dirty."""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+            self._dirty_event.clear()
+        written, failed = 0, []
+        for user_id in dirty:
+            with self._record_lock(user_id):
+                account = self.accounts.get(user_id)
+                if account is None:
+                    continue
+                ok = self._write_record(user_id, account)
+                if not ok:
+                    account = self._rebase(user_id)
+                    ok = account is not None and self._write_record(user_id, account)
+                if ok:
+                    self._deferred.pop(user_id, None)
+                    written += 1
+                else:
+                    failed.append(user_id)
+        if failed:
+            logger.warning(f"{len(failed)} account records failed to flush; will retry")
+            with self._dirty_lock:
+                self._dirty.update(failed)
+            self._dirty_event.set()
+        if written:
+            logger.info(f"Flushed {written} coalesced account updates")
+        if self._index_dirty:
+            self._save_index()
+        return written
+
+    def create_account(self, user_id, account):
+        """Write a brand new account record and its index entry. Returns True on success
+        (False as well while the index is not loaded)."""
+        if not self._ensure_loaded():
             return False
+        with self._record_lock(user_id):
+            if user_id in self._entries:
+                return False
+            record = dict(account)
+            if not self._write_record(user_id, record):
+                return False
+            self.accounts[user_id] = record
+            self._bump_revision(user_id)
+            self._set_entry(user_id, self._index_entry(record))
+        self._save_index()
+        return True
+
+    def load_accounts(self):
+        """Return {user_id: account} for every account (read-only view). Fetches any record
+        not cached yet, so this is for admin views and CLI commands, not request paths."""
+        if not self._ensure_loaded():
+            return {}
+        missing = [uid for uid in list(self._entries) if uid not in self.accounts]
+        if missing:
+            with ThreadPoolExecutor(max_workers=8, thread_name_prefix='account-load') as pool:
+                list(pool.map(self._get, missing))
+        return dict(self.accounts)
     
     def hash_password(self, password):
-        """Hash password using bcrypt"""
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """Hash password using bcrypt (off-thread, in the hashing pool)"""
+        return password_hasher.hash(password)
     
     def verify_password(self, password, hashed):
         """Verify password against hash"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        return password_hasher.verify(password, hashed)
+
+    def _rehash_in_background(self, user_id, password):
+        """Re-hash a password stored with an outdated cost factor and swap it in once done."""
+        try:
+            future = password_hasher.hash_async(password)
+        except HashingOverloaded:
+            return  # try again on a quieter login
+
+        def _store(f):
+            try:
+                new_hash = f.result()
+            except Exception as e:
+                logger.error(f"Password rehash failed for {user_id}: {e}")
+                return
+            def _swap(acct):
+                acct['password_hash'] = new_hash
+            self._mutate(user_id, _swap, defer=True)
+        future.add_done_callback(_store)
     
     def register_user(self, username, password, roblox_username=None):
         """Register a new user"""
+        if not self._ensure_loaded():
+            return False, "Accounts are temporarily unavailable, please try again shortly"
         try:
-            accounts = self.load_accounts()
-            
-            if username.lower() in [acc['username'].lower() for acc in accounts.values()]:
-                return False, "Username already exists"
-            
-            user_id = secrets.token_hex(16)
-            while user_id in accounts:
+            password_hash = self.hash_password(password)
+            with self._register_lock:
+                if self.find_user_id(username):
+                    return False, "Username already exists"
+                
                 user_id = secrets.token_hex(16)
-            
-            accounts[user_id] = {
-                'username': username,
-                'password_hash': self.hash_password(password),
-                'roblox_username': roblox_username or '',
-                'created_at': datetime.now().isoformat(),
-                'purchase_history': [],
-                'total_purchases': 0,
-                'last_login': None,
-                'pending_purchases': {}
-            }
-            
-            if self.save_accounts(accounts):
-                return True, user_id
-            else:
-                return False, "Failed to save account"
+                while user_id in self._entries:
+                    user_id = secrets.token_hex(16)
+                
+                account = {
+                    'username': username,
+                    'password_hash': password_hash,
+                    'roblox_username': roblox_username or '',
+                    'created_at': datetime.now().isoformat(),
+                    'total_purchases': 0,
+                    'last_login': None
+                }
                 
+                if self.create_account(user_id, account):
+                    return True, user_id
+                else:
+                    return False, "Failed to save account"
+                
+        except HashingOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Registration error: {e}")
             return False, str(e)
     
     def login_user(self, username, password):
         """Login user and return user data"""
+        if not self._ensure_loaded():
+            return False, "Accounts are temporarily unavailable, please try again shortly"
         try:
-            accounts = self.load_accounts()
-            
-            user_id = None
-            for uid, account in accounts.items():
-                if account['username'].lower() == username.lower():
-                    user_id = uid
-                    break
-            
-            if not user_id:
+            user_id = self.find_user_id(username)
+            user_account = self._get(user_id)
+            if not user_account:
                 return False, "User not found"
             
-            user_account = accounts[user_id]
-            
             if not self.verify_password(password, user_account['password_hash']):
                 return False, "Invalid password"
+            if password_hasher.needs_rehash(user_account['password_hash']):
+                self._rehash_in_background(user_id, password)
             
-            user_account['last_login'] = datetime.now().isoformat()
-            accounts[user_id] = user_account
-            self.save_accounts(accounts)
+            last_login = datetime.now().isoformat()
+            def _touch(acct):
+                acct['last_login'] = last_login
+            self._mutate(user_id, _touch, defer=True)
             
             user_data = user_account.copy()
+            user_data['last_login'] = last_login
             del user_data['password_hash']
             user_data['user_id'] = user_id
             
             return True, user_data
             
+        except HashingOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Login error: {e}")
             return False, str(e)
     
-    def get_user_by_id(self, user_id):
-        """Get user data by ID"""
+    def get_user_by_id(self, user_id, include_history=True):
+        """Get user data by ID (shallow copy without the password hash).
+        include_history=False leaves out the embedded purchase_history list."""
         try:
-            accounts = self.load_accounts()
-            if user_id in accounts:
-                user_data = accounts[user_id].copy()
+            account = self._get(user_id)
+            if account is not None:
+                user_data = account.copy()
                 user_data.pop('password_hash', None)
+                if not include_history:
+                    user_data.pop('purchase_history', None)
                 user_data['user_id'] = user_id
                 return user_data
         except Exception as e:
             logger.error(f"Error getting user by ID: {e}")
         return None
     
+    @staticmethod
+    def purchase_count(account):
+        count = account.get('total_purchases')
+        return int(count) if count is not None else len(account.get('purchase_history') or [])
+
+    def embedded_purchase_history(self, user_id):
+        """The legacy purchase_history list stored on the account (shared, do not mutate)."""
+        return (self._get(user_id) or {}).get('purchase_history') or []
+
     def add_purchase_to_history(self, user_id, purchase_data):
-        """Add purchase to legacy embedded account list AND external purchase log."""
+        """Record a purchase in the purchase log and bump the account's total_purchases.
+        The purchase is embedded in the account record only if the log write fails."""
         try:
-            accounts = self.load_accounts()
-            if user_id not in accounts:
+            account = self._get(user_id)
+            if account is None:
                 return False
             purchase_entry = {
                 'purchase_id': secrets.token_hex(8),
                 'user_id': user_id,
-                'username': accounts[user_id].get('username'),
+                'username': account.get('username'),
                 'product_name': purchase_data['product_name'],
                 'product_id': purchase_data['product_id'],
                 'key': purchase_data['key'],
@@ -1249,78 +2001,42 @@ class AccountManager:
                 'transaction_id': purchase_data.get('transaction_id'),
                 'transaction_created': purchase_data.get('transaction_created')
             }
-            accounts[user_id].setdefault('purchase_history', []).append(purchase_entry)
-            accounts[user_id]['total_purchases'] = len(accounts[user_id]['purchase_history'])
-            self.save_accounts(accounts)
             try:
-                purchase_history_manager.add_purchase(purchase_entry)
+                logged, _purchase_id = purchase_history_manager.add_purchase(purchase_entry)
             except Exception as e:
                 logger.error(f"Failed to append to external purchase history: {e}")
+                logged = False
+            sales_analytics.record(purchase_entry)
+            def _count(acct):
+                acct['total_purchases'] = self.purchase_count(acct) + 1
+                buyer = (purchase_entry['roblox_username'] or '').lower()
+                if buyer and buyer not in acct.setdefault('roblox_usernames', []):
+                    acct['roblox_usernames'].append(buyer)
+                if not logged:
+                    acct.setdefault('purchase_history', []).append(purchase_entry)
+            self._mutate(user_id, _count, defer=logged)
             return True
         except Exception as e:
             logger.error(f"Error adding purchase to history: {e}")
             return False
 
-    def set_pending_purchase(self, user_id, roblox_username, product_id):
-        try:
-            accounts = self.load_accounts()
-            if user_id not in accounts:
-                return False, 'Account not found'
-            acct = accounts[user_id]
-            if 'pending_purchases' not in acct or not isinstance(acct['pending_purchases'], dict):
-                acct['pending_purchases'] = {}
-            key = f"{product_id}::{roblox_username.lower()}"
-            if key in acct['pending_purchases'] and isinstance(acct['pending_purchases'][key], dict):
-                existing_started = acct['pending_purchases'][key].get('started_at')
-                logger.info(f"Reuse existing pending purchase user={user_id} product={product_id} username={roblox_username} started_at={existing_started}")
-            else:
-                started_at = utc_now_iso()
-                acct['pending_purchases'][key] = {'started_at': started_at}
-                logger.info(f"Set pending purchase user={user_id} product={product_id} username={roblox_username} started_at={started_at}")
-            saved = self.save_accounts(accounts)
-            return (True, None) if saved else (False, 'Save failed')
-        except Exception as e:
-            logger.error(f"Error setting pending purchase: {e}")
-            return False, 'Internal error'
-
-    def pop_pending_purchase(self, user_id, roblox_username, product_id):
-        try:
-            accounts = self.load_accounts()
-            if user_id not in accounts:
-                return None
-            key = f"{product_id}::{roblox_username.lower()}"
-            acct = accounts[user_id]
-            entry = None
-            if 'pending_purchases' in acct and isinstance(acct['pending_purchases'], dict):
-                entry = acct['pending_purchases'].pop(key, None)
-                self.save_accounts(accounts)
-            return entry
-        except Exception as e:
-            logger.error(f"Error popping pending purchase: {e}")
-            return None
-
-    def get_pending_purchase(self, user_id, roblox_username, product_id):
-        try:
-            accounts = self.load_accounts()
-            if user_id not in accounts:
-                return None
-            acct = accounts[user_id]
-            key = f"{product_id}::{roblox_username.lower()}"
-            return acct.get('pending_purchases', {}).get(key)
-        except Exception as e:
-            logger.error(f"Error getting pending purchase: {e}")
-            return None
-
     def delete_account(self, user_id):
         """Delete a user account by id"""
         try:
-            accounts = self.load_accounts()
-            if user_id not in accounts:
-                return False, 'User not found'
-            del accounts[user_id]
-            if self.save_accounts(accounts):
-                return True, 'Deleted'
-            return False, 'Save failed'
+            if not self._ensure_loaded():
+                return False, 'Accounts unavailable'
+            with self._record_lock(user_id):
+                if self._fetch(user_id) is None:
+                    return False, 'User not found'
+                sha = self._shas.get(user_id)
+                if sha and not self.github_manager.delete_file(self._record_path(user_id), sha, f"Delete account {user_id}"):
+                    return False, 'Save failed'
+                self.accounts.pop(user_id, None)
+                self._shas.pop(user_id, None)
+                self._bump_revision(user_id)
+                self._set_entry(user_id, None)
+            self._save_index()
+            return True, 'Deleted'
         except Exception as e:
             logger.error(f"Delete account error: {e}")
             return False, 'Error'
@@ -1337,115 +2053,436 @@ def start_purchase():
         if product_id not in PRODUCTS_CONFIG:
             return jsonify({'error': 'Unknown product'}), 400
         if not user:
-            guest_key = 'guest_' + hashlib.sha256(f"{request.remote_addr}:{roblox_username}".encode()).hexdigest()[:24]
-            accounts = account_manager.load_accounts()
-            if guest_key not in accounts:
-                accounts[guest_key] = {
-                    'user_id': guest_key,
-                    'username': guest_key,
-                    'created_at': utc_now_iso(),
-                    'last_login': utc_now_iso(),
-                    'guest': True,
-                    'pending_purchases': {}
-                }
-                account_manager.save_accounts(accounts)
-            user = accounts[guest_key]
+            guest_key = GuestSessionStore.PREFIX + hashlib.sha256(f"{request.remote_addr}:{roblox_username}".encode()).hexdigest()[:24]
+            user = guest_sessions.get_or_create(guest_key)
             session['user_id'] = guest_key  
             logger.info(f"/start-purchase guest session created guest_id={guest_key} roblox_username={roblox_username} product_id={product_id}")
         else:
             logger.info(f"/start-purchase attempt user_id={user['user_id']} accountName={user.get('username')} roblox_username={roblox_username} product_id={product_id}")
-        ok, err = account_manager.set_pending_purchase(user['user_id'], roblox_username, product_id)
-        if not ok:
-            return jsonify({'error': err or 'Failed to start purchase'}), 500
-        pending_info = account_manager.get_pending_purchase(user['user_id'], roblox_username, product_id) or {}
-        logger.info(f"/start-purchase stored pending key={product_id}::{roblox_username.lower()} info={pending_info}")
+        pending_info, created = pending_purchases.start(user['user_id'], roblox_username, product_id, PRODUCTS_CONFIG[product_id].get('gamepass_id'))
+        logger.info(f"/start-purchase {'stored' if created else 'reused'} pending key={product_id}::{roblox_username.lower()} started_at={pending_info['started_at']}")
+        purchase_status.publish(_purchase_status_key(user['user_id'], product_id, roblox_username), 'waiting', startedAt=pending_info.get('started_at'))
         return jsonify({'started': True, 'started_at': pending_info.get('started_at'), 'guest': user.get('guest', False)})
     except Exception as e:
         logger.error(f"Error in start_purchase: {e}")
         return jsonify({'error': 'Internal error'}), 500
 
-class GitHubUserDataManager:
-    """Manages user data using GitHub as storage backend"""
-    
+class UserDataStore:
+    """Issued-key records stored one file per (Roblox username, product) at
+    UserDataRecords/<name[:2]>/<name>/<product_id>.json.
+
+    A record is read from storage the first time its (username, product) is looked up and
+    then cached; misses are remembered for a few minutes. Issuing a key updates the in-memory
+    record immediately; persist() later writes that record's current state with its sha and
+    a bumped version, so a sale costs one GET (first time) and one small PUT however many
+    buyers exist. Without a GitHub manager everything is kept in user_data.json locally.
+
+    Key entries older than RETENTION_DAYS are dropped by a background sweeper. Issued keys
+    are noted per issue day in UserDataExpiry/<YYYY-MM-DD> (queued in memory, appended every
+    expiryFlushSeconds) and a sweep only reads the day files past the cutoff; locally a
+    min-heap of issue times does the same. The legacy single 'user_data' blob migration and
+    the one-time backfill of day files for older records run in the sweeper thread too, so
+    nothing on the sale path scales with the number of buyers or historic entries.
+    """
+
+    RETENTION_DAYS = 30
+
     def __init__(self, github_manager):
         self.github_manager = github_manager
-        self.cache = {}
-        self.cache_timestamp = None
-        self.cache_duration = 60
-    
-    def _is_cache_valid(self):
-        """Check if cache is still valid"""
-        if not self.cache_timestamp:
-            return False
-        return (datetime.now() - self.cache_timestamp).seconds < self.cache_duration
-    
-    def load_user_data(self):
-        """Load user data from GitHub"""
-        if self._is_cache_valid():
-            return self.cache
-            
-        try:
+        self.records_dir = 'UserDataRecords'
+        self.expiry_dir = 'UserDataExpiry'
+        self.legacy_file = 'user_data'
+        self.local_file = 'user_data.json'
+        self.records = {}  # record key -> record, for the records read so far
+        self._shas = {}
+        self._absent = TTLCache(maxsize=10000, ttl=300, name='user_data_absent')
+        self._loaded = False
+        self._migrated = False
+        self._load_lock = threading.Lock()
+        self._record_locks = KeyedLocks(name='user_data_locks')
+        self._expiry = []  # local mode: (issued_at epoch, record key) per issued key
+        self._expiry_days = {}  # GitHub mode: issue day -> record keys not yet in its day file
+        self._expiry_lock = threading.Lock()
+        self._sweeper = None
+        self.expired_keys = 0
+
+    @staticmethod
+    def _key(username, product_id):
+        return (username or '').lower(), str(product_id)
+
+    def _record_path(self, key):
+        return f"{self.records_dir}/{key[0][:2]}/{key[0]}/{key[1]}.json"
+
+    def _record_lock(self, key):
+        return self._record_locks.get(key)
+
+    @staticmethod
+    def _normalize(username, product_id, entry):
+        """Turn a legacy entry (bool or single key_issued dict) into a {'keys': [...]} record."""
+        record = {'username': username, 'product_id': product_id, 'keys': [], 'version': 0}
+        if isinstance(entry, dict) and isinstance(entry.get('keys'), list):
+            record.update(entry)
+            record['username'], record['product_id'] = username, product_id
+        elif isinstance(entry, dict) and entry.get('key_issued'):
+            record['keys'] = [{
+                'key': entry.get('key'),
+                'issued_at': entry.get('issued_at'),
+                'expiry_date': entry.get('expiry_date'),
+                'transaction_id': entry.get('transaction_id')
+            }]
+        elif entry is True:
+            record['keys'] = [{'key': f"ByorlHub_legacy_{secrets.token_urlsafe(8)}", 'issued_at': utc_now_iso()}]
+        return record
+
+    def _ensure_loaded(self):
+        """Locally, read user_data.json; with GitHub, only start the sweeper (records are read
+        per key, see _fetch)."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
             if not self.github_manager:
-                logger.warning("GitHub manager not available, falling back to local file")
-                return self._load_local_fallback()
-            
-            content_list = self.github_manager.get_file_content('user_data')
-            if content_list and len(content_list) > 0:
+                logger.warning("GitHub manager not available, using local user data file")
+                self._import_blob(self._load_local_fallback(), persist=False)
+                self._build_expiry_index()
+            else:
+                self._ensure_sweeper()
+            self._loaded = True
+
+    def _fetch(self, key):
+        """The in-memory record for key, read from storage on first use (read errors raise, so
+        callers never take an unreadable record for a missing one). Caller holds the record lock."""
+        record = self.records.get(key)
+        if record is None and self.github_manager and self._absent.get(key) is None:
+            text, sha = self.github_manager.get_raw_file(self._record_path(key))
+            if text:
+                record = self.records[key] = json.loads(text)
+                self._shas[key] = sha
+            else:
+                self._absent.set(key, True)
+        return record
+
+    def _run_migrations(self):
+        """One-time jobs, run from the sweeper: the legacy blob copy and the expiry day-file
+        backfill. An exception leaves them to be retried on the next pass."""
+        if self._migrated:
+            return
+        self._migrate_legacy_blob()
+        self._backfill_expiry_days()
+        self._migrated = True
+
+    def _backfill_expiry_days(self):
+        """Note the keys of records written before expiry day files existed, found by listing
+        UserDataRecords one directory at a time. Any failed listing or read aborts the pass."""
+        gm = self.github_manager
+        if migration_done(gm, 'user-data-expiry-days'):
+            return
+        def _list(path, entry_type):
+            listing = gm.list_directory(path, entry_type=entry_type)
+            if len(listing) >= 1000:
+                raise RuntimeError(f"{path} has 1000+ entries, more than one directory listing returns")
+            return listing
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix='user-data-scan') as pool:
+            shards = [e['path'] for e in _list(self.records_dir, 'dir')]
+            names = [e['path'] for listing in pool.map(lambda p: _list(p, 'dir'), shards) for e in listing]
+            files = [e['path'] for listing in pool.map(lambda p: _list(p, 'file'), names) for e in listing if e['name'].endswith('.json')]
+            for text, _sha in pool.map(gm.get_raw_file, files):
+                if text:
+                    record = json.loads(text)
+                    key = self._key(record.get('username'), record.get('product_id'))
+                    for key_entry in record.get('keys') or []:
+                        self._index_key(key, key_entry)
+        if self._flush_expiry_days():
+            mark_migration_done(gm, 'user-data-expiry-days', records=len(files))
+
+    def _migrate_legacy_blob(self):
+        """Copy records from the old single 'user_data' blob into per-record files, once: after
+        every record is copied a marker is written and the blob is never read again, so records
+        that later expire or are deleted stay gone."""
+        if migration_done(self.github_manager, 'user-data-blob'):
+            return
+        content_list = self.github_manager.get_file_content(self.legacy_file)
+        if content_list:
+            try:
                 data = json.loads(content_list[0])
-                self.cache = data
-                self.cache_timestamp = datetime.now()
-                logger.info("User data loaded from GitHub")
-                return data
+            except Exception as e:
+                logger.error(f"Legacy user data blob unreadable, not migrating: {e}")
+                return
+            if self._import_blob(data, persist=True):
+                logger.warning("Some legacy user data records were not migrated; retrying next start")
+                return
+        mark_migration_done(self.github_manager, 'user-data-blob', records=len(self.records))
+
+    def _import_blob(self, data, persist):
+        """Adopt records from a {username: {product_id: entry}} blob that are not loaded yet.
+        Returns the number of records that could not be written."""
+        migrated = failed = 0
+        for username, products in (data or {}).items():
+            if not isinstance(products, dict):
+                continue
+            for product_id, entry in products.items():
+                key = self._key(username, product_id)
+                if key in self.records:
+                    continue
+                record = self._normalize(username, product_id, entry)
+                if not record['keys']:
+                    continue
+                if persist and not self._write_record(key, record):
+                    failed += 1
+                    continue
+                self.records[key] = record
+                migrated += 1
+        if migrated and persist:
+            logger.info(f"Migrated {migrated} user data records from legacy '{self.legacy_file}' blob")
+        return failed
+
+    def _write_record(self, key, record):
+        """Persist one record with its sha; bumps record['version']. If another writer changed
+        the file, its keys are merged into the in-memory record and the write is retried.
+        Caller holds the record lock."""
+        path = self._record_path(key)
+        for _attempt in range(3):
+            record['version'] = int(record.get('version', 0)) + 1
+            body = json.dumps(record, separators=(',', ':'))
+            message = f"Update user data {key[0]}/{key[1]} v{record['version']}"
+            sha = self.github_manager.put_raw_file(path, body, message, sha=self._shas.get(key))
+            if sha is not None:
+                self._shas[key] = sha
+                return True
+            record['version'] -= 1
+            try:
+                text, remote_sha = self.github_manager.get_raw_file(path)
+            except Exception as e:
+                logger.warning(f"Could not re-read user data {key[0]}/{key[1]} after a failed write: {e}")
+                return False
+            if not text or remote_sha == self._shas.get(key):
+                return False
+            self._merge_remote(key, record, json.loads(text))
+            self._shas[key] = remote_sha
+        return False
+
+    def _merge_remote(self, key, record, remote):
+        """Fold a newer remote copy into record: keys are unioned by key value (entries past
+        retention stay dropped) and the remote version is adopted. Caller holds the record lock."""
+        cutoff = time.time() - self.RETENTION_DAYS * 86400
+        known = {k.get('key') for k in record['keys']}
+        added = [k for k in remote.get('keys') or []
+                 if k.get('key') not in known and (_epoch_from_iso(k.get('issued_at')) or cutoff) >= cutoff]
+        if added:
+            record['keys'] = sorted(record['keys'] + added, key=lambda k: k.get('issued_at') or '')
+            for key_entry in added:
+                self._index_key(key, key_entry)
+        record['version'] = max(int(record.get('version', 0)), int(remote.get('version', 0)))
+        logger.info(f"User data {key[0]}/{key[1]} changed remotely; merged {len(added)} keys from v{remote.get('version')}")
+
+    def get(self, username, product_id):
+        """Return the record for (username, product) or None, reading it on first use.
+        Shared; do not mutate."""
+        self._ensure_loaded()
+        key = self._key(username, product_id)
+        record = self.records.get(key)
+        if record is not None or not self.github_manager:
+            return record
+        with self._record_lock(key):
+            return self._fetch(key)
+
+    def usernames(self):
+        """Usernames of the records in memory (every record only in local mode)."""
+        self._ensure_loaded()
+        return sorted({r.get('username') or k[0] for k, r in list(self.records.items())})
+
+    def add_key(self, username, product_id, key_entry):
+        """Append an issued key to the in-memory record right away; call persist() to save it."""
+        self._ensure_loaded()
+        key = self._key(username, product_id)
+        with self._record_lock(key):
+            current = self._fetch(key) or self._normalize(username, product_id, None)
+            updated = dict(current, keys=current['keys'] + [key_entry])
+            self.records[key] = updated
+            self._absent.pop(key)
+        self._index_key(key, key_entry)
+        return updated
+
+    def _index_key(self, key, key_entry):
+        issued = _epoch_from_iso(key_entry.get('issued_at'))
+        if issued is None:
+            return
+        with self._expiry_lock:
+            if self.github_manager:
+                day = datetime.fromtimestamp(issued, timezone.utc).strftime('%Y-%m-%d')
+                self._expiry_days.setdefault(day, set()).add(key)
             else:
-                logger.info("User data file not found on GitHub, initializing empty")
-                return {}
-                
-        except Exception as e:
-            logger.error(f"Error loading user data from GitHub: {e}")
-            return self._load_local_fallback()
-    
-    def save_user_data(self, data):
-        """Save user data to GitHub"""
-        try:
+                heapq.heappush(self._expiry, (issued, key))
+
+    def _flush_expiry_days(self):
+        """Append queued record keys to their UserDataExpiry/<day> files (read-merge-write
+        against the file's sha). Keys that fail stay queued. Returns True when all were saved."""
+        with self._expiry_lock:
+            queued, self._expiry_days = self._expiry_days, {}
+        failed = {}
+        for day, keys in queued.items():
+            path = f"{self.expiry_dir}/{day}"
+            saved = False
+            try:
+                for _attempt in range(3):
+                    text, sha = self.github_manager.get_raw_file(path)
+                    lines = [line for line in (text or '').splitlines() if line.strip()]
+                    new = [line for line in (json.dumps(list(k)) for k in sorted(keys)) if line not in set(lines)]
+                    if not new:
+                        saved = True
+                        break
+                    body = '\n'.join(lines + new) + '\n'
+                    if self.github_manager.put_raw_file(path, body, f"Note {len(new)} keys issued {day}", sha=sha):
+                        saved = True
+                        break
+            except Exception as e:
+                logger.warning(f"Expiry day file {path} not saved: {e}")
+            if not saved:
+                failed[day] = keys
+        if failed:
+            with self._expiry_lock:
+                for day, keys in failed.items():
+                    self._expiry_days.setdefault(day, set()).update(keys)
+        return not failed
+
+    def _build_expiry_index(self):
+        heap = []
+        for key, record in self.records.items():
+            for key_entry in record.get('keys', []):
+                issued = _epoch_from_iso(key_entry.get('issued_at'))
+                if issued is not None:
+                    heap.append((issued, key))
+        heapq.heapify(heap)
+        with self._expiry_lock:
+            self._expiry = heap
+        self._ensure_sweeper()
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='user-data-expiry', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        """Run the one-time migrations, save queued expiry day entries every
+        expiryFlushSeconds and expire old keys every expirySweepSeconds."""
+        next_sweep = 0.0
+        while True:
+            cfg = SETTINGS.get('userData', {})
+            try:
+                if self.github_manager:
+                    self._run_migrations()
+                    self._flush_expiry_days()
+                if time.time() >= next_sweep:
+                    self.expire_old_keys()
+                    next_sweep = time.time() + float(cfg.get('expirySweepSeconds', 3600))
+            except Exception as e:
+                logger.error(f"User data upkeep failed: {e}")
+            time.sleep(float(cfg.get('expiryFlushSeconds', 60)))
+
+    def _due_day_files(self, cutoff):
+        """Day files wholly before cutoff, with the record keys they list."""
+        cutoff_day = datetime.fromtimestamp(cutoff, timezone.utc).strftime('%Y-%m-%d')
+        files, keys = [], set()
+        for entry in self.github_manager.list_directory(self.expiry_dir):
+            if entry['name'] < cutoff_day:
+                text, _sha = self.github_manager.get_raw_file(entry['path'])
+                keys.update(tuple(json.loads(line)) for line in (text or '').splitlines() if line.strip())
+                files.append(entry['path'])
+        return files, keys
+
+    def expire_old_keys(self, now=None):
+        """Drop key entries issued more than RETENTION_DAYS ago and save the touched records.
+        Only records listed in day files (or heap entries) past the cutoff are visited; a day
+        file is removed once all its records are saved. Returns the number of keys dropped."""
+        cutoff = (time.time() if now is None else now) - self.RETENTION_DAYS * 86400
+        due = set()
+        with self._expiry_lock:
+            while self._expiry and self._expiry[0][0] < cutoff:
+                due.add(heapq.heappop(self._expiry)[1])
+        day_files = []
+        if self.github_manager:
+            day_files, listed = self._due_day_files(cutoff)
+            due |= listed
+        dropped = 0
+        all_saved = True
+        for key in due:
+            with self._record_lock(key):
+                try:
+                    record = self._fetch(key)
+                except Exception as e:
+                    logger.warning(f"Could not read user data {key[0]}/{key[1]} for expiry: {e}")
+                    all_saved = False
+                    continue
+                if record is None:
+                    continue
+                kept = [k for k in record['keys'] if (_epoch_from_iso(k.get('issued_at')) or cutoff) >= cutoff]
+                if len(kept) == len(record['keys']):
+                    continue
+                dropped += len(record['keys']) - len(kept)
+                if kept:
+                    self.records[key] = dict(record, keys=kept)
+                    if self.github_manager and not self._write_record(key, self.records[key]):
+                        all_saved = False
+                elif not self._delete_record(key):
+                    all_saved = False
+        if day_files and all_saved:
+            self.github_manager.delete_files(day_files, f"Remove {len(day_files)} expired key day files")
+        if dropped:
+            self.expired_keys += dropped
             if not self.github_manager:
-                logger.warning("GitHub manager not available, saving locally")
-                return self._save_local_fallback(data)
-            
-            self.cache = data
-            self.cache_timestamp = datetime.now()
-            
-            content_json = json.dumps(data, indent=2)
-            success = self.github_manager.update_file_content('user_data', [content_json], 
-                                                            f"Update user data - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            if success:
-                logger.info("User data saved to GitHub successfully")
-            else:
-                logger.error("Failed to save user data to GitHub")
-                self._save_local_fallback(data)
-                
-        except Exception as e:
-            logger.error(f"Error saving user data to GitHub: {e}")
-            self._save_local_fallback(data)
-    
+                self._save_local_fallback()
+            logger.info(f"Expired {dropped} issued keys older than {self.RETENTION_DAYS} days from {len(due)} records")
+        return dropped
+
+    def _delete_record(self, key):
+        """Remove an emptied record. Caller holds the record lock."""
+        sha = self._shas.get(key)
+        if self.github_manager and sha and not self.github_manager.delete_file(self._record_path(key), sha, f"Expire user data {key[0]}/{key[1]}"):
+            return False
+        self.records.pop(key, None)
+        self._shas.pop(key, None)
+        self._absent.set(key, True)
+        return True
+
+    def persist(self, username, product_id):
+        """Write the current state of one record. Returns True on success."""
+        self._ensure_loaded()
+        key = self._key(username, product_id)
+        if not self.github_manager:
+            return self._save_local_fallback()
+        with self._record_lock(key):
+            record = self.records.get(key)
+            if record is None:
+                return False
+            if not self._write_record(key, record):
+                logger.error(f"Failed to save user data record {key[0]}/{key[1]}")
+                return False
+            return True
+
     def _load_local_fallback(self):
         """Fallback to local file loading"""
         try:
-            if os.path.exists('user_data.json'):
-                with open('user_data.json', 'r') as f:
+            if os.path.exists(self.local_file):
+                with open(self.local_file, 'r') as f:
                     return json.load(f)
             return {}
         except Exception as e:
             logger.error(f"Error loading local user data: {e}")
             return {}
-    
-    def _save_local_fallback(self, data):
+
+    def _save_local_fallback(self):
         """Fallback to local file saving"""
+        data = {}
+        for (name, product_id), record in list(self.records.items()):
+            data.setdefault(record.get('username') or name, {})[product_id] = record
         try:
-            with open('user_data.json', 'w') as f:
+            with open(self.local_file, 'w') as f:
                 json.dump(data, f, indent=4)
+            return True
         except Exception as e:
             logger.error(f"Error saving local user data: {e}")
+            return False
 
 def load_github_manager():
     try:
@@ -1464,8 +2501,27 @@ def load_github_manager():
     return None
 
 github_manager = load_github_manager()
+if github_manager:
+    github_manager.on_stock_written = _on_stock_written
 account_manager = AccountManager(github_manager)
-github_user_data_manager = GitHubUserDataManager(github_manager)
+atexit.register(account_manager.flush)
+
+def _promote_guest(user_id):
+    """Give a guest a durable account record once a key is issued to them."""
+    guest = guest_sessions.get_user_by_id(user_id)
+    if guest is None or account_manager.get_user_by_id(user_id, include_history=False):
+        return
+    now = utc_now_iso()
+    if account_manager.create_account(user_id, {
+        'user_id': user_id,
+        'username': user_id,
+        'created_at': guest.get('created_at') or now,
+        'last_login': now,
+        'guest': True
+    }):
+        guest_sessions.mark_promoted(user_id)
+        logger.info(f"Promoted guest {user_id} to an account record")
+user_data_store = UserDataStore(github_manager)
 key_manager = KeyManager()
 
 _github_atomic_lock = threading.Lock()
@@ -1495,12 +2551,37 @@ def github_atomic_update(file_name: str, mutator, commit_message: str, max_retri
     return False
 
 class PurchaseHistoryManager:
-    def __init__(self, github_manager, file_name='Purchases'):
+    """Append-only purchase log split into JSON-lines segments named <YYYY-MM>-<seq>.jsonl
+    under PurchaseLog/segments/<YYYY-MM>/ (older segments sit directly in PurchaseLog/segments),
+    rotated at month boundaries or maxSegmentBytes (64 KB by default).
+
+    Only the open (newest) segment is ever rewritten, and it is kept in memory with its
+    sha, so an append is one PUT of at most maxSegmentBytes. Each user also has an index file at
+    PurchaseLog/index/<uid[:2]>/<uid>.json listing [segment, line, date, purchase_id, price]
+    for their purchases in append order, so a user's history is read from their index plus
+    the few segments it points at. Index writes are idempotent (entries already listed are
+    skipped), so rebuild_indexes() can re-derive every index from the segments at any time.
+
+    The legacy single 'Purchases' file is split into segments and the indexes rebuilt until
+    that completes once; a migration marker then retires the file. Index writes that fail
+    after their segment PUT are kept and retried before the next append or index read.
+    """
+
+    def __init__(self, github_manager, file_name='Purchases', log_dir='PurchaseLog'):
         self.github_manager = github_manager
         self.file_name = file_name
-        self._cache = []
-        self._cache_time = 0
-        self._ttl = 10
+        self.segment_dir = f"{log_dir}/segments"
+        self.index_dir = f"{log_dir}/index"
+        self._segments = []  # segment names, oldest first
+        self._paths = {}  # segment name -> path, for the segments listed on load
+        self._open = None  # {'name', 'text', 'sha', 'lines'}; guarded by _append_lock
+        self._loaded = False
+        self._append_lock = threading.RLock()
+        self._segment_cache = TTLCache(maxsize=64, ttl=86400, name='purchase_segments')
+        self._indexes = TTLCache(maxsize=4096, ttl=1800, name='purchase_indexes')
+        self._index_locks = KeyedLocks(name='purchase_index_locks')
+        self._unindexed = {}  # user_id -> index entries whose index write failed
+        self._unindexed_lock = threading.Lock()
 
     def _parse(self, lines):
         out = []
@@ -1514,211 +2595,301 @@ class PurchaseHistoryManager:
                 continue
         return out
 
-    def list_purchases(self, force=False):
-        now = time.time()
-        if (not force) and self._cache and (now - self._cache_time) < self._ttl:
-            return list(self._cache)
+    def _max_segment_bytes(self):
+        return int(SETTINGS.get('purchaseLog', {}).get('maxSegmentBytes', 64 * 1024))
+
+    def _segment_path(self, name):
+        return self._paths.get(name) or f"{self.segment_dir}/{name[:7]}/{name}"
+
+    def _index_path(self, user_id):
+        return f"{self.index_dir}/{user_id[:2]}/{user_id}.json"
+
+    def _ensure_loaded(self):
+        """Find the open segment (newest name); finish the legacy migration if it never completed."""
+        if self._loaded:
+            return
         if not self.github_manager:
-            return []
+            raise RuntimeError('GitHub manager not configured')
+        self._load_segments()
+        if not migration_done(self.github_manager, 'purchase-log-legacy'):
+            self._migrate_legacy_file()
+        self._loaded = True
+
+    def load(self):
+        """Load the segment list, finishing the legacy migration if it never completed.
+        Reads and appends do this on first use; CLI commands call it up front."""
+        with self._append_lock:
+            self._ensure_loaded()
+
+    def _load_segments(self):
+        entries = self.github_manager.list_directory(self.segment_dir)
+        for month in self.github_manager.list_directory(self.segment_dir, entry_type='dir'):
+            entries += self.github_manager.list_directory(month['path'])
+        self._paths = {e['name']: e['path'] for e in entries if e['name'].endswith('.jsonl')}
+        names = sorted(self._paths)
+        self._segments = names
+        self._open = None
+        if names:
+            text, sha = self.github_manager.get_raw_file(self._segment_path(names[-1]))
+            self._open = {'name': names[-1], 'text': text or '', 'sha': sha, 'lines': (text or '').count('\n')}
+
+    def _next_segment_name(self, month):
+        seq = max((int(n[8:12]) for n in self._segments if n.startswith(month)), default=0) + 1
+        return f"{month}-{seq:04d}.jsonl"
+
+    def _needs_rotation(self, month, line, pending=()):
+        if self._open is None:
+            return True
+        if not self._open['name'].startswith(month):
+            return True
+        size = len(self._open['text'].encode('utf-8')) + sum(len(p.encode('utf-8')) + 1 for p in pending)
+        return size > 0 and size + len(line.encode('utf-8')) + 1 > self._max_segment_bytes()
+
+    def _rotate(self, month):
+        self._open = {'name': self._next_segment_name(month), 'text': '', 'sha': None, 'lines': 0}
+        self._segments.append(self._open['name'])
+
+    def _append_lines(self, lines, month):
+        """Append lines to the open segment, rotating as needed, with one PUT per segment
+        touched. Returns (positions, complete): [(segment, line_no)] for the leading lines
+        that were written, and False if a write failed before all of them were. Caller holds
+        _append_lock."""
+        positions, pending = [], []
+        for line in lines:
+            if self._needs_rotation(month, line, pending):
+                if pending:
+                    if not self._write_pending(pending, positions):
+                        return positions, False
+                    pending = []
+                if self._needs_rotation(month, line):
+                    self._rotate(month)
+            pending.append(line)
+        if pending and not self._write_pending(pending, positions):
+            return positions, False
+        return positions, True
+
+    def _write_pending(self, pending, positions):
+        seg = self._open
+        for attempt in range(2):
+            text = seg['text'] + ''.join(line + '\n' for line in pending)
+            sha = self.github_manager.put_raw_file(self._segment_path(seg['name']), text, f"Append {len(pending)} purchase(s) to {seg['name']}", sha=seg['sha'])
+            if sha is not None:
+                first = seg['lines']
+                seg.update(text=text, sha=sha, lines=first + len(pending))
+                positions.extend((seg['name'], first + i) for i in range(len(pending)))
+                return True
+            if attempt == 0:
+                remote_text, remote_sha = self.github_manager.get_raw_file(self._segment_path(seg['name']))
+                seg.update(text=remote_text or '', sha=remote_sha, lines=(remote_text or '').count('\n'))
+        return False
+
+    def _open_lines(self, name):
+        """Lines of the open segment if name is the open segment, else None."""
+        with self._append_lock:
+            if self._open and name == self._open['name']:
+                return self._open['text'].split('\n')
+        return None
+
+    def _read_segment(self, name):
+        lines = self._open_lines(name)
+        if lines is not None:
+            return lines
+        lines = self._segment_cache.get(name)
+        if lines is None:
+            text, _sha = self.github_manager.get_raw_file(self._segment_path(name))
+            lines = (text or '').split('\n')
+            self._segment_cache.set(name, lines)
+        return lines
+
+    def _load_index(self, user_id):
+        """Return [entries, sha] for a user's index (cached)."""
+        cached = self._indexes.get(user_id)
+        if cached is not None:
+            return cached
+        text, sha = self.github_manager.get_raw_file(self._index_path(user_id))
+        entries = (json.loads(text).get('entries') or []) if text else []
+        cached = [entries, sha]
+        self._indexes.set(user_id, cached)
+        return cached
+
+    def _index_append(self, user_id, new_entries):
+        """Add entries to a user's index, skipping positions it already lists."""
+        with self._index_locks.get(user_id):
+            for attempt in range(2):
+                cached = self._load_index(user_id)
+                listed = {(e[0], e[1]) for e in cached[0]}
+                added = [e for e in new_entries if (e[0], e[1]) not in listed]
+                if not added:
+                    return True
+                entries = cached[0] + added
+                body = json.dumps({'user_id': user_id, 'entries': entries}, separators=(',', ':'))
+                sha = self.github_manager.put_raw_file(self._index_path(user_id), body, f"Index purchases for {user_id}", sha=cached[1])
+                if sha is not None:
+                    self._indexes.set(user_id, [entries, sha])
+                    return True
+                self._indexes.pop(user_id)
+            logger.error(f"Failed to update purchase index for {user_id}")
+            return False
+
+    def _migrate_legacy_file(self):
+        """Split the legacy file into segments, rebuild every index from the segments, then
+        write the migration marker. Legacy lines already in a segment are not copied again,
+        so an interrupted run (before or after its segments landed) resumes on next start."""
         lines = self.github_manager.get_file_content(self.file_name) or []
-        parsed = self._parse(lines)
-        self._cache = parsed
-        self._cache_time = now
-        return list(parsed)
-
-    def list_purchases_for_user(self, user_id=None, username=None):
-        purchases = self.list_purchases()
-        res = []
-        for p in purchases:
-            if user_id and p.get('user_id') == user_id:
-                res.append(p)
-            elif (not user_id) and username and p.get('username','').lower() == username.lower():
-                res.append(p)
-        return res
+        records = self._parse(lines)
+        present = {line.strip() for name in self._segments for line in self._read_segment(name)}
+        missing = [rec for rec in records if json.dumps(rec, separators=(',', ':')) not in present]
+        if missing:
+            logger.info(f"Splitting {len(missing)} purchases from legacy '{self.file_name}' into segments")
+            for rec in missing:
+                line = json.dumps(rec, separators=(',', ':'))
+                month = (rec.get('ts') or rec.get('purchase_date') or utc_now_iso())[:7]
+                if self._needs_rotation(month, line):
+                    if self._open and self._open['text']:
+                        self._flush_migrated_segment()
+                    self._rotate(month)
+                self._open['text'] += line + '\n'
+                self._open['lines'] += 1
+            self._flush_migrated_segment()
+            self._load_segments()
+        if not self.rebuild_indexes()['failed']:
+            mark_migration_done(self.github_manager, 'purchase-log-legacy', purchases=len(records), copied=len(missing))
+
+    def rebuild_indexes(self, segments=None):
+        """Re-derive per-user index entries from segments (default: all) and add any that are
+        missing. Idempotent. Returns {'segments', 'users', 'failed'}."""
+        per_user = {}
+        names = list(self._segments if segments is None else segments)
+        for name in names:
+            for line_no, line in enumerate(self._read_segment(name)):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                if rec.get('user_id'):
+                    per_user.setdefault(rec['user_id'], []).append(self._index_entry(name, line_no, rec))
+        failed = [user_id for user_id, entries in per_user.items() if not self._index_append(user_id, entries)]
+        if failed:
+            logger.error(f"Purchase index rebuild left {len(failed)} users unindexed; re-run to retry")
+        return {'segments': len(names), 'users': len(per_user), 'failed': failed}
+
+    def _retry_unindexed(self, user_ids=None):
+        """Retry index writes that failed after their purchases were appended."""
+        with self._unindexed_lock:
+            due = {uid: self._unindexed.pop(uid) for uid in list(self._unindexed)
+                   if user_ids is None or uid in user_ids}
+        for user_id, entries in due.items():
+            if not self._index_append(user_id, entries):
+                self._remember_unindexed(user_id, entries)
+
+    def _remember_unindexed(self, user_id, entries):
+        with self._unindexed_lock:
+            self._unindexed.setdefault(user_id, []).extend(entries)
+
+    def _flush_migrated_segment(self):
+        seg = self._open
+        sha = self.github_manager.put_raw_file(self._segment_path(seg['name']), seg['text'], f"Migrate purchases into {seg['name']}", sha=seg['sha'])
+        if sha is None:
+            raise RuntimeError(f"Failed to write purchase segment {seg['name']}")
+        seg['sha'] = sha
+
+    def iter_purchases(self):
+        """Yield every purchase in append order, reading one segment at a time."""
+        with self._append_lock:
+            self._ensure_loaded()
+            names = list(self._segments)
+        for name in names:
+            lines = self._open_lines(name)
+            if lines is not None:
+                yield from self._parse(lines)
+                continue
+            text, _sha = self.github_manager.get_raw_file(self._segment_path(name))
+            yield from self._parse((text or '').split('\n'))
+
+    def list_purchases(self):
+        """Every purchase in append order (reads all segments; admin/backfill use only)."""
+        return list(self.iter_purchases())
+
+    @staticmethod
+    def _index_entry(segment, line_no, rec):
+        return [segment, line_no, rec.get('purchase_date') or rec.get('ts'), rec.get('purchase_id'), rec.get('price')]
+
+    def user_index(self, user_id):
+        """Return (entries, sha) of a user's index; entries are shared, do not mutate."""
+        if not self.github_manager or not user_id:
+            return [], None
+        self.load()
+        self._retry_unindexed({user_id})
+        entries, sha = self._load_index(user_id)
+        return entries, sha
+
+    def read_refs(self, refs):
+        """Records for [(segment, line)] references, in the order given."""
+        out = []
+        for segment, line_no in refs:
+            lines = self._read_segment(segment)
+            if line_no < len(lines) and lines[line_no].strip():
+                try:
+                    out.append(json.loads(lines[line_no]))
+                except Exception:
+                    continue
+        return out
+
+    def list_purchases_for_user(self, user_id):
+        """A user's purchases in append order, read through their index."""
+        entries, _sha = self.user_index(user_id)
+        return self.read_refs([(e[0], e[1]) for e in entries])
 
     def add_purchase(self, record: dict):
-        rec = dict(record)
-        rec.setdefault('ts', datetime.now(timezone.utc).isoformat() + 'Z')
-        if not rec.get('purchase_id'):
-            rec['purchase_id'] = secrets.token_hex(8)
-        line = json.dumps(rec, separators=(',',':'))
-        def mut(lines):
-            lines.append(line)
-            return lines
-        ok = github_atomic_update(self.file_name, mut, f"Append purchase {rec['purchase_id']}")
-        if ok:
-            self._cache.append(rec)
-        return ok, rec['purchase_id']
+        ok, purchase_ids = self.add_purchases([record])
+        return ok, purchase_ids[0]
+
+    def add_purchases(self, records):
+        """Append records in order (one PUT per segment touched, one index write per user).
+        Returns (ok, [purchase_id, ...]). If a segment write fails part way, the records
+        already written are still indexed (so they show up in user_index) and ok is False."""
+        recs = []
+        for record in records:
+            rec = dict(record)
+            rec.setdefault('ts', datetime.now(timezone.utc).isoformat() + 'Z')
+            if not rec.get('purchase_id'):
+                rec['purchase_id'] = secrets.token_hex(8)
+            recs.append(rec)
+        purchase_ids = [rec['purchase_id'] for rec in recs]
+        if not recs:
+            return True, purchase_ids
+        self._retry_unindexed()
+        lines = [json.dumps(rec, separators=(',',':')) for rec in recs]
+        with self._append_lock:
+            self._ensure_loaded()
+            positions, ok = self._append_lines(lines, datetime.now(timezone.utc).strftime('%Y-%m'))
+        if not ok:
+            logger.error(f"Appended {len(positions)} of {len(recs)} purchase(s) starting at {purchase_ids[0]}; the rest failed")
+        per_user = {}
+        for rec, (segment, line_no) in zip(recs, positions):
+            if rec.get('user_id'):
+                per_user.setdefault(rec['user_id'], []).append(self._index_entry(segment, line_no, rec))
+        for user_id, entries in per_user.items():
+            if not self._index_append(user_id, entries):
+                self._remember_unindexed(user_id, entries)
+                ok = False
+        return ok, purchase_ids
 
 purchase_history_manager = PurchaseHistoryManager(github_manager)
-
-def init_user_data():
-    """Initialize the user data if it doesn't exist."""
-    data = github_user_data_manager.load_user_data()
-    if not data:
-        logger.info("User data not found. Initializing empty user data.")
-        github_user_data_manager.save_user_data({})
-        logger.info("User data initialized successfully.")
-
-def load_user_data():
-    """Load user data using GitHub manager."""
-    return github_user_data_manager.load_user_data()
-
-def save_user_data(data):
-    """Save user data using GitHub manager."""
-    cleaned_data = cleanup_old_entries(data)
-    github_user_data_manager.save_user_data(cleaned_data)
-
-def cleanup_old_entries(data):
-    """Remove old entries to prevent file bloat."""
-    if not data:
-        return {}
-    
-    current_time = ensure_naive_utc(datetime.now(timezone.utc))
-    cleaned_data = {}
-    
-    for username, user_info in data.items():
-        cleaned_user_info = {}
-        
-        for gamepass_id, entry in user_info.items():
-            if isinstance(entry, dict) and 'issued_at' in entry:
-                issued_time = parse_ts(entry['issued_at'])
-                if issued_time and (current_time - issued_time < timedelta(days=30)):
-                    cleaned_user_info[gamepass_id] = entry
-                else:
-                    logger.info(f"Cleaned up old entry for {username} - {gamepass_id}")
-            elif isinstance(entry, bool):
-                if entry:
-                    cleaned_user_info[gamepass_id] = {
-                        'key_issued': True,
-                        'issued_at': utc_now_iso(),
-                        'key': f"ByorlHub_legacy_{secrets.token_urlsafe(8)}"
-                    }
-        if cleaned_user_info:
-            cleaned_data[username] = cleaned_user_info
-    
-    return cleaned_data
+sales_analytics.github_manager = github_manager
+atexit.register(lambda: sales_analytics.github_manager and sales_analytics.flush())
 
 def fetch_user_id(username):
-    """Fetch a Roblox user ID by username with caching and improved rate limiting."""
-    cache_key = f"user_id_{username.lower()}"
-    logger.info(f"Fetching user ID for username: {username}")
-    
-    if username.lower() in persistent_user_cache:
-        cached_data = persistent_user_cache[username.lower()]
-        if cached_data['timestamp'] + 3600 > datetime.now().timestamp():  
-            logger.info(f"Using persistent cache for user ID: {cached_data['result']}")
-            return cached_data['result']
-    
-    cached_result = get_cached_response(cache_key, 600) 
-    if cached_result:
-        logger.info(f"Using cached user ID result: {cached_result}")
-        return cached_result
-
-    global_rate_key = "global_user_fetch"
-    if is_rate_limited(global_rate_key, 2):  
-        logger.info("Global rate limit hit for user fetching")
-        return None, "RATE_LIMITED"
-    
-    rate_key = f"user_fetch_{username.lower()}"
-    if is_rate_limited(rate_key, 60):  
-        return None, "RATE_LIMITED"
-    
-    encoded_username = urllib.parse.quote(username)
-    search_url = f'https://users.roblox.com/v1/users/search?keyword={encoded_username}'
-    logger.info(f"Making request to Roblox user search API: {search_url}")
-    
-    try:
-        response = requests.get(search_url, timeout=10)  
-        logger.info(f"User search API response status: {response.status_code}")
-        
-        if response.status_code == 429:
-            logger.warning("Roblox API rate limit hit")
-            return None, "ROBLOX_RATE_LIMITED"
-            
-        response.raise_for_status()
-        
-        data = response.json()
-        logger.info(f"User search API response data: {data}")
-        users = data.get('data', [])
-        
-        for user in users:
-            if user.get('name', '').lower() == username.lower():
-                result = user.get('id'), None
-                logger.info(f"Found matching user: {result}")
-                cache_response(cache_key, result)
-                persistent_user_cache[username.lower()] = {
-                    'result': result,
-                    'timestamp': datetime.now().timestamp()
-                }
-                return result
-        
-        result = None, "USER_NOT_FOUND"
-        logger.info(f"User not found in search results: {result}")
-        cache_response(cache_key, result)
-        persistent_user_cache[username.lower()] = {
-            'result': result,
-            'timestamp': datetime.now().timestamp()
-        }
-        return result
-        
-    except requests.exceptions.Timeout:
-        return None, "TIMEOUT"
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching user ID for {username}: {e}")
-        return None, "REQUEST_ERROR"
-    except Exception as e:
-        logger.error(f"Unexpected error fetching user ID for {username}: {e}")
-        return None, "UNKNOWN_ERROR"
-
-def check_gamepass_ownership(user_id, gamepass_id, force_refresh=False):
-    """Check if a user owns a specific gamepass with optimized caching."""
-    cache_key = f"gamepass_{user_id}_{gamepass_id}"
-    
-    if not force_refresh:
-        cached_result = get_cached_response(cache_key, 15)  
-        if cached_result is not None:
-            logger.info(f"Using cached gamepass result: {cached_result}")
-            return cached_result
-    
-    global_gamepass_rate_key = "global_gamepass_check"
-    if is_rate_limited(global_gamepass_rate_key, 1): 
-        logger.info("Global rate limit hit for gamepass checking")
-        return None
-    
-    rate_key = f"gamepass_check_{user_id}_{gamepass_id}"
-    if is_rate_limited(rate_key, 10): 
-        return None
-    
-    url = f'https://inventory.roblox.com/v1/users/{user_id}/items/GamePass/{gamepass_id}'
-    
-    try:
-        response = requests.get(url, timeout=5)  
-        
-        if response.status_code == 429:
-            logger.warning(f"Roblox API rate limit hit for gamepass check")
-            return None
-            
-        response.raise_for_status()
-        
-        data = response.json()
-        has_gamepass = len(data.get('data', [])) > 0
-        
-        cache_time = 8 if not has_gamepass else 30
-        cache_response(cache_key, has_gamepass)
-        
-        logger.info(f"Gamepass check result: user_id={user_id}, gamepass_id={gamepass_id}, has_gamepass={has_gamepass}")
-        return has_gamepass
-        
-    except requests.exceptions.Timeout:
-        logger.warning(f"Timeout checking gamepass {gamepass_id} for user {user_id}")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error checking gamepass ownership: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error checking gamepass: {e}")
-        return None
+    """Resolve a Roblox user ID by exact username. Returns (user_id, None) or (None, error_code).
+    Lookups are cached, coalesced per name and batched across concurrent buyers by username_resolver.
+    """
+    user_id, err = username_resolver.resolve(username)
+    if err:
+        logger.info(f"User ID lookup for {username} failed: {err}")
+    return user_id, err
 
 try:
     with open('config/products.json', 'r') as f:
@@ -1750,20 +2921,14 @@ except Exception as e:
 
 SUPPORTED_GAMEPASSES = list(PRODUCTS_CONFIG.keys())
 
-init_user_data()
-
 def warm_user_cache():
     """Pre-populate cache with known usernames to avoid API calls"""
     try:
-        persistent_user_cache['byorlals'] = {
-            'result': (9213180540, None),  
-            'timestamp': datetime.now().timestamp()
-        }
+        username_resolver.prime('byorlals', 9213180540)
         logger.info("Pre-populated cache with known user: byorlals")
         
-        user_data = load_user_data()
-        for username in user_data.keys():
-            if username.lower() not in persistent_user_cache:
+        for username in user_data_store.usernames():
+            if username_resolver.cached(username) is None:
                 logger.info(f"Cache warming needed for user: {username}")
     except Exception as e:
         logger.error(f"Error warming cache: {e}")
@@ -1789,21 +2954,41 @@ def get_client_ip():
         return request.remote_addr
 
 def get_authenticated_user():
-    """Get authenticated user from session or token"""
+    """Get authenticated user from session or token.
+    Memoized on flask.g for the request; the returned dict is shared, treat it as read-only."""
+    if 'auth_user' not in g:
+        g.auth_user = _resolve_authenticated_user()
+    return g.auth_user
+
+def _session_user(user_id):
+    """User view for a session, rebuilt only when the account's revision has moved."""
+    if user_id in guest_sessions:
+        return guest_sessions.get_user_by_id(user_id)
+    revision = account_manager.revision(user_id)
+    cached = _session_user_cache.get(user_id)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+    user_data = account_manager.get_user_by_id(user_id, include_history=False)
+    if user_data:
+        _session_user_cache.set(user_id, (revision, user_data))
+    else:
+        _session_user_cache.pop(user_id)
+    return user_data
+
+def _resolve_authenticated_user():
     try:
         if 'user_id' in session:
-            logger.info(f"Found user_id in session: {session['user_id']}")
-            user_data = account_manager.get_user_by_id(session['user_id'])
+            user_data = _session_user(session['user_id'])
             if user_data:
-                logger.info(f"Authentication successful via session for user: {user_data['username']}")
+                logger.debug(f"Authenticated via session: {user_data['username']}")
                 return user_data
         
         auth_header = request.headers.get('Authorization')
         if auth_header and auth_header.startswith('Bearer '):
             token = auth_header.split(' ')[1]
-            logger.info(f"Auth token check: token={token[:10]}..., found_user_id=None")
+            logger.debug(f"Auth token check: token={token[:10]}..., found_user_id=None")
         
-        logger.info("No authentication found (no session or valid token)")
+        logger.debug("No authentication found (no session or valid token)")
         return None
         
     except Exception as e:
@@ -1811,6 +2996,12 @@ def get_authenticated_user():
         return None
 
 
+def _auth_overloaded_response():
+    resp = jsonify({'success': False, 'error': 'Server is busy, please try again in a moment', 'shouldRetry': True})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '2'
+    return resp
+
 @app.route('/register', methods=['POST'])
 def register():
     """Register a new user account"""
@@ -1840,6 +3031,9 @@ def register():
         else:
             return jsonify({'success': False, 'error': result}), 400
             
+    except HashingOverloaded:
+        logger.warning("Registration shed: password hashing pool is saturated")
+        return _auth_overloaded_response()
     except Exception as e:
         logger.error(f"Registration endpoint error: {e}")
         return jsonify({'success': False, 'error': 'Registration failed'}), 500
@@ -1856,7 +3050,7 @@ def login():
             return jsonify({'success': False, 'error': 'Username and password required'}), 400
         
         if 'user_id' in session:
-            existing = account_manager.get_user_by_id(session['user_id'])
+            existing = get_authenticated_user()
             if existing and existing['username'].lower() == username.lower():
                 return jsonify({'success': True, 'message': 'Already logged in', 'user': existing})
 
@@ -1874,6 +3068,9 @@ def login():
         else:
             return jsonify({'success': False, 'error': result}), 401
             
+    except HashingOverloaded:
+        logger.warning("Login shed: password hashing pool is saturated")
+        return _auth_overloaded_response()
     except Exception as e:
         logger.error(f"Login endpoint error: {e}")
         return jsonify({'success': False, 'error': 'Login failed'}), 500
@@ -1904,37 +3101,358 @@ def get_current_user():
         logger.error(f"Error getting current user: {e}")
         return jsonify({'authenticated': False})
 
+def _purchase_history_index(user_id):
+    """Oldest-first [(date, purchase_id, price, ref)] merging the legacy embedded list with the
+    purchase log index, plus a version string. Rebuilt only when either source changes."""
+    legacy = account_manager.embedded_purchase_history(user_id)
+    entries, index_sha = purchase_history_manager.user_index(user_id)
+    version = f"{account_manager.revision(user_id)}:{len(legacy)}:{index_sha}:{len(entries)}"
+    cached = _purchase_index_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1], version
+    merged = {}
+    for p in legacy:
+        if p.get('purchase_id'):
+            merged[p['purchase_id']] = (p.get('purchase_date') or p.get('ts') or '', p['purchase_id'], p.get('price') or 0, p)
+    for entry in entries:
+        segment, line_no, date, purchase_id = entry[:4]
+        price = entry[4] if len(entry) > 4 else (merged.get(purchase_id, (None, None, 0))[2])
+        merged[purchase_id] = (date or '', purchase_id, price or 0, (segment, line_no))
+    ordered = sorted(merged.values(), key=lambda e: (e[0], e[1]))
+    _purchase_index_cache.set(user_id, (version, ordered))
+    return ordered, version
+
+def _encode_history_cursor(entry):
+    return base64.urlsafe_b64encode(f"{entry[0]}\n{entry[1]}".encode('utf-8')).decode('ascii')
+
+def _decode_history_cursor(cursor):
+    try:
+        date, purchase_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('\n', 1)
+        return date, purchase_id
+    except Exception:
+        return None
+
 @app.route('/purchase-history', methods=['GET'])
 def get_purchase_history():
-    """Get purchase history for authenticated user"""
+    """Purchase history for the authenticated user, newest first.
+    Query params: limit= (default 25, max 100), before= (nextCursor of the previous page).
+    Responses carry a per-user ETag; a matching If-None-Match gets 304."""
     try:
-        logger.info(f"Purchase history request - Session: {dict(session)}")
-        logger.info(f"Purchase history request - Headers: {dict(request.headers)}")
-        
         user = get_authenticated_user()
         if not user:
-            logger.info("No authenticated user found for purchase history request")
             return jsonify({'error': 'Authentication required'}), 401
-        
-        logger.info(f"Getting purchase history for user: {user['user_id']} ({user['username']})")
-        external = purchase_history_manager.list_purchases_for_user(user_id=user['user_id'])
-        embedded = account_manager.get_user_by_id(user['user_id']) or {}
-        legacy = embedded.get('purchase_history', [])
-        combined = {p.get('purchase_id'): p for p in legacy if p.get('purchase_id')}
-        for p in external:
-            combined[p.get('purchase_id')] = p
-        purchase_history = list(combined.values())
-        purchase_history.sort(key=lambda x: x.get('purchase_date') or x.get('ts') or '', reverse=True)
-        logger.info(f"Combined purchase history: external={len(external)} legacy={len(legacy)} total={len(purchase_history)}")
-        return jsonify({
-            'purchases': purchase_history,
-            'total_purchases': len(purchase_history)
+        try:
+            limit = max(1, min(100, int(request.args.get('limit', 25))))
+        except ValueError:
+            return jsonify({'error': 'limit must be a number'}), 400
+        before = request.args.get('before')
+        cursor = _decode_history_cursor(before) if before else None
+        if before and cursor is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        ordered, version = _purchase_history_index(user['user_id'])
+        etag = hashlib.sha1(f"{user['user_id']}|{version}|{limit}|{before or ''}".encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            resp = make_response('', 304)
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+
+        # cursor is a (date, purchase_id) prefix, so it sorts just before its own entry
+        end = bisect.bisect_left(ordered, cursor) if cursor else len(ordered)
+        start = max(0, end - limit)
+        page = ordered[start:end][::-1]
+        log_refs = [e[3] for e in page if isinstance(e[3], tuple)]
+        from_log = {r.get('purchase_id'): r for r in purchase_history_manager.read_refs(log_refs)}
+        purchases = [from_log.get(e[1]) if isinstance(e[3], tuple) else e[3] for e in page]
+        logger.debug(f"Purchase history page for {user['user_id']}: {len(page)} of {len(ordered)}")
+        resp = jsonify({
+            'purchases': [p for p in purchases if p],
+            'total_purchases': len(ordered),
+            'total_spent': sum(e[2] for e in ordered),
+            'nextCursor': _encode_history_cursor(page[-1]) if start > 0 else None
         })
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
         
     except Exception as e:
         logger.error(f"Error getting purchase history: {e}")
         return jsonify({'error': 'Failed to load purchase history'}), 500
 
+def _process_gamepass_check(username, product_id, authenticated_user, force_refresh=False):
+    """Run the transaction-based issuance pipeline for one buyer + product.
+
+    Shared by the /check-gamepass route and the background purchase matcher; the caller
+    must hold get_user_lock(username). Returns (response_body, http_status). The pipeline
+    never blocks waiting for transactions; when none are eligible the body carries
+    awaitingTransactions so the caller can wait (without the lock) and try again.
+    """
+    product = PRODUCTS_CONFIG[product_id]
+    status_key = _purchase_status_key(authenticated_user['user_id'], product_id, username) if authenticated_user else None
+    user_id, user_error = fetch_user_id(username)
+    if user_id is None or user_error:
+        return {'error':'Failed to verify user','detail':user_error}, 400
+    if authenticated_user:
+        pending_info = pending_purchases.get(authenticated_user['user_id'], username, product_id)
+        logger.info(f"/check-gamepass pending lookup user={authenticated_user['user_id']} product={product_id} username={username} found={bool(pending_info)} info={pending_info}")
+    else:
+        pending_info = {'started_at': utc_now_iso(), 'guest': True}
+    pending_started_dt = None
+    if not pending_info:
+        if authenticated_user:
+            return {'hasGamepass': False, 'needStart': True, 'message': 'Start a purchase first.'}, 200
+        else:
+            pending_info = {'started_at': utc_now_iso(), 'guest': True}
+    pending_started_dt = ensure_naive_utc(parse_ts(pending_info.get('started_at')))
+    now_naive = ensure_naive_utc(datetime.now(timezone.utc))
+    if authenticated_user and pending_started_dt and (now_naive - pending_started_dt).total_seconds() > PENDING_PURCHASE_EXPIRY_SECONDS:
+        try:
+            pending_purchases.pop(authenticated_user['user_id'], username, product_id)
+        except Exception:
+            pass
+        purchase_status.publish(status_key, 'expired')
+        return {'hasGamepass': False, 'needStart': True, 'purchaseExpired': True, 'message': 'Purchase session expired. Start a new one.'}, 200
+    prod_record = user_data_store.get(username, product_id)
+    prior_key_count = len(prod_record['keys']) if prod_record else 0
+
+    force_refresh = force_refresh or bool(pending_info)
+
+    use_fast_path = SETTINGS.get('roblox', {}).get('useOwnershipFastPath', False)
+    ownership_fast_path_used = False
+    eligible_txs = []
+    if use_fast_path:
+        cycle_key = (username.lower(), product_id)
+        state = _ownership_cycles.get(cycle_key, {'cycle': 1, 'lastOwned': False})
+        roblox_cookie = SETTINGS.get('roblox', {}).get('securityCookie')
+        owned_now, owned_mode = ownership_service.check(user_id, product['gamepass_id'], roblox_cookie)
+        if state['lastOwned'] and owned_now is False:
+            state['cycle'] += 1
+            logger.info(f"Ownership drop detected for {username} {product_id}; advancing to cycle {state['cycle']}")
+        if owned_now:
+            synthetic_tx_id = f"OWNC{state['cycle']}-{user_id}-{product_id}"
+            claimed_set_prefetch = _load_claimed_transactions()
+            already_claimed_cycle = synthetic_tx_id in claimed_set_prefetch
+            if not already_claimed_cycle:
+                duplicate = any(krec.get('transaction_id') == synthetic_tx_id
+                                for krec in (prod_record or {}).get('keys', []))
+                if not duplicate:
+                    ownership_fast_path_used = True
+                    eligible_txs = [{
+                        'transactionId': synthetic_tx_id,
+                        'created': (pending_started_dt or datetime.now(timezone.utc).replace(tzinfo=None)).isoformat() + 'Z',
+                        'amount': product.get('price'),
+                        'details': f"Gamepass {product['gamepass_id']} ownership cycle {state['cycle']} ({owned_mode})",
+                        'buyerName': username
+                    }]
+                    logger.info(f"Ownership fast-path cycle {state['cycle']} success for {username} via {owned_mode}; synthetic {synthetic_tx_id}")
+        if owned_now is not None:
+            state['lastOwned'] = owned_now
+        _ownership_cycles[cycle_key] = state
+        if not ownership_fast_path_used:
+            eligible_txs = _eligible_unclaimed_transactions(username, gamepass_id=product['gamepass_id'], force_refresh=force_refresh)
+    else:
+        eligible_txs = _eligible_unclaimed_transactions(username, gamepass_id=product['gamepass_id'], force_refresh=force_refresh)
+    debug_diag = _tx_fetch_debug.get(username.lower())
+    rate_limited = False
+    if debug_diag and isinstance(debug_diag, dict) and str(debug_diag.get('reason','')).startswith('HTTP_429'):
+        rate_limited = True
+    logger.info(f"Eligible tx count for {username} force_refresh={force_refresh}: {len(eligible_txs)} diag={debug_diag} rate_limited={rate_limited}")
+    if not eligible_txs:
+        if use_fast_path and not ownership_fast_path_used:
+            roblox_cfg = SETTINGS.get('roblox', {}).get('securityCookie')
+            owned, mode = ownership_service.check(user_id, product['gamepass_id'], roblox_cfg)
+            if owned:
+                cycle_key = (username.lower(), product_id)
+                state = _ownership_cycles.get(cycle_key, {'cycle': 1, 'lastOwned': owned})
+                synthetic_tx_id = f"OWNC{state['cycle']}-{user_id}-{product_id}"
+                claimed_set_prefetch = _load_claimed_transactions()
+                if synthetic_tx_id not in claimed_set_prefetch:
+                    eligible_txs = [{
+                        'transactionId': synthetic_tx_id,
+                        'created': (pending_started_dt or datetime.now(timezone.utc).replace(tzinfo=None)).isoformat() + 'Z',
+                        'amount': product.get('price'),
+                        'details': f"Gamepass {product['gamepass_id']} ownership fallback cycle {state['cycle']}",
+                        'buyerName': username
+                    }]
+                    debug_diag = debug_diag or {}
+                    debug_diag['ownershipFallback'] = mode
+                    debug_diag['syntheticTxId'] = synthetic_tx_id
+        if not eligible_txs:
+            resp = {'hasGamepass': False,
+                    'awaitingTransactions': not rate_limited,
+                    'message':'No recent purchase transactions detected for this user within claim window.' if not rate_limited else 'Rate limited by Roblox API. Please wait a moment then press the button again.',
+                    'priorKeyCount': prior_key_count,
+                    'hadPreviousKeys': prior_key_count > 0,
+                    'debug': debug_diag,
+                    'rate_limited': rate_limited,
+                    'shouldRetry': rate_limited}
+            if rate_limited:
+                return resp, 429
+            return resp, 200
+    existing_product_record = user_data_store.get(username, product_id) or {'keys': []}
+
+    claimed_set = _load_claimed_transactions()
+    last_issued_dt = None
+    try:
+        for k in existing_product_record.get('keys', [])[-5:]: 
+            t_created = k.get('transaction_created') or k.get('issued_at') or k.get('expiry_date')
+            if not t_created: continue
+            try:
+                dt = parse_ts(t_created)
+                if (last_issued_dt is None) or dt > last_issued_dt:
+                    last_issued_dt = dt
+            except Exception:
+                continue
+    except Exception as _e:
+        logger.warning(f"Failed computing last_issued_dt: {_e}")
+
+    new_tx = None
+    fallback_old_tx = None  
+    for tx in eligible_txs:
+        tx_id = tx.get('transactionId')
+        tx_created_raw = tx.get('created')
+        logger.info(f"Candidate tx id={tx_id} created={tx_created_raw} lastIssued={last_issued_dt}")
+        if not tx_id or not tx_created_raw:
+            logger.info("Skipping tx (missing id or created)")
+            continue
+        enforce_pending = SETTINGS.get('roblox', {}).get('enforcePendingStart', False)
+        if enforce_pending and pending_started_dt:
+            try:
+                _tx_dt_pending = ensure_naive_utc(datetime.fromisoformat(tx_created_raw.replace('Z','')))
+                if pending_started_dt and _tx_dt_pending <= pending_started_dt - timedelta(seconds=300):
+                    logger.info(f"Skip tx {tx_id} due to enforcePendingStart gating")
+                    continue
+            except Exception:
+                logger.info(f"Skip tx {tx_id}: invalid date vs pending start (enforcePendingStart)")
+                continue
+        if tx_id in claimed_set:
+            logger.info(f"Skip tx {tx_id} already in claimed set")
+            continue
+        if any(k.get('transaction_id') == tx_id for k in existing_product_record['keys']):
+            logger.info(f"Skip tx {tx_id} already has key issued")
+            continue
+        tx_created_dt = parse_ts(tx_created_raw)
+        if not tx_created_dt:
+            logger.info(f"Skip tx {tx_id} invalid created format")
+            continue
+        if pending_started_dt and tx_created_dt < pending_started_dt:
+            delta_sec = (pending_started_dt - tx_created_dt).total_seconds()
+            if delta_sec <= PRE_START_GRACE_SECONDS:
+                logger.info(f"Accept tx {tx_id} within pre-start grace ({delta_sec:.1f}s before pending start)")
+            else:
+                logger.info(f"Skip tx {tx_id}: {delta_sec:.1f}s before pending start (exceeds grace {PRE_START_GRACE_SECONDS}s)")
+                continue
+        if last_issued_dt and tx_created_dt <= last_issued_dt:
+            allow_same_ts = False
+            if pending_started_dt and tx_created_dt >= last_issued_dt and tx_id not in claimed_set:
+                allow_same_ts = True
+            if not allow_same_ts:
+                logger.info(f"Skip tx {tx_id}: not newer than last issued {last_issued_dt} (same timestamp not allowed)")
+                continue
+        new_tx = tx
+        logger.info(f"Selected new transaction {tx_id} for key issuance")
+        break
+
+    if not new_tx and not existing_product_record['keys'] and fallback_old_tx:
+        allow_grace = SETTINGS.get('roblox', {}).get('allowGracePriorTx', False)
+        grace_tx_id = fallback_old_tx.get('transactionId')
+        already_issued = any(k.get('transaction_id') == grace_tx_id for k in existing_product_record['keys'])
+        if allow_grace and grace_tx_id and grace_tx_id not in claimed_set and not already_issued:
+            new_tx = fallback_old_tx
+            logger.info(f"Grace selection of prior transaction {new_tx.get('transactionId')} (created {new_tx.get('created')}) because user has no keys and no newer tx post pending start (grace enabled).")
+        else:
+            logger.info("Grace fallback suppressed (either disabled, missing id, or already claimed).")
+
+    if not new_tx:
+        debug_diag = _tx_fetch_debug.get(username.lower())
+        return {'hasGamepass': False,
+                'message': 'No new unclaimed purchase transaction detected.',
+                'priorKeyCount': prior_key_count,
+                'hadPreviousKeys': prior_key_count > 0,
+                'waitingNewTx': True,
+                'debug': debug_diag}, 200
+
+    claimed_ok, claim_err = _record_claim(new_tx['transactionId'], new_tx.get('created'))
+    if not claimed_ok:
+        logger.error(f"Could not record claim of {new_tx['transactionId']} for {username}: {claim_err}")
+        return {'error': 'Could not record your purchase, please check again.',
+                'hasGamepass': False,
+                'shouldRetry': True,
+                'reason': claim_err}, 503
+    if status_key:
+        purchase_status.publish(status_key, 'detected', transactionId=new_tx['transactionId'])
+    key, expiry = key_manager.generate_key_with_expiry(product_id, product.get('duration_days', 7))
+    key_entry = {
+        'key': key,
+        'issued_at': utc_now_iso(), 
+        'expiry_date': expiry.isoformat().replace('+00:00', 'Z'),
+        'transaction_id': new_tx['transactionId'],
+        'transaction_created': new_tx.get('created'),
+        'pending_started_at': pending_info.get('started_at') if pending_info else None,
+        'claim_method': 'grace' if (fallback_old_tx and new_tx is fallback_old_tx) else 'standard'
+    }
+    user_data_store.add_key(username, product_id, key_entry)
+
+    def update_github_async():
+        try:
+            stock_file = product.get('stock_file', f'Stock/{product_id.upper()}-Stock')
+            if '/' not in stock_file:
+                stock_file = f'Stock/{stock_file}'
+            bought_file = product.get('bought_file', 'Keys-Bought')
+            remaining = []
+            def mutate_stock(lines):
+                remaining[:] = [len(lines[1:])]
+                return lines[1:] if lines else lines
+            try:
+                dispensed = github_atomic_update(stock_file, mutate_stock, f"Dispense key for {product['name']}")
+            except Exception:
+                stock_counters.release(product_id)
+                raise
+            if dispensed and remaining:
+                stock_counters.commit(product_id, remaining[0])
+            else:
+                stock_counters.release(product_id)
+            def mutate_bought(lines):
+                lines.append(key)
+                return lines
+            github_atomic_update(bought_file, mutate_bought, f"Record key for {product['name']}")
+            user_data_store.persist(username, product_id)
+        except Exception as e:
+            logger.error(f"Async atomic GitHub update error: {e}")
+        finally:
+            global _last_forced_push_time
+            _last_forced_push_time = time.time()
+
+    if authenticated_user:
+        try:
+            purchase_data = {'product_name': product['name'], 'product_id': product_id, 'key': key, 'roblox_username': username, 'price': product.get('price', 1), 'gamepass_id': product['gamepass_id'], 'transaction_id': new_tx['transactionId'], 'transaction_created': new_tx.get('created')}
+            if authenticated_user.get('guest'):
+                _promote_guest(authenticated_user['user_id'])
+            account_manager.add_purchase_to_history(authenticated_user['user_id'], purchase_data)
+        except Exception as log_err:
+            logger.error(f"Purchase history logging error: {log_err}")
+    if authenticated_user:
+        try:
+            pending_purchases.pop(authenticated_user['user_id'], username, product_id)
+        except Exception:
+            pass
+    stock_counters.reserve(product_id)
+    threading.Thread(target=update_github_async).start()
+    result = {
+        'hasGamepass': True,
+        'keyIssued': True,
+        'key': key,
+        'expiryDate': expiry.isoformat(),
+        'isNewKey': True,
+        'transactionId': new_tx['transactionId'],
+        'priorKeyCount': prior_key_count,
+        'hadPreviousKeys': prior_key_count > 0
+    }
+    if status_key:
+        purchase_status.publish(status_key, 'key_issued', result=result)
+    return result, 200
+
 @app.route('/check-gamepass', methods=['POST'])
 def check_gamepass():
     """Transaction-based key issuance. Username + product id; issue one key per unclaimed recent transaction."""
@@ -1945,9 +3463,6 @@ def check_gamepass():
     if not username or not gamepass_id:
         return jsonify({'error': 'Username and gamepass_id are required'}), 400
     authenticated_user = get_authenticated_user()
-    user_lock = get_user_lock(username)
-    if not user_lock.acquire(blocking=False):
-        return jsonify({'status':'Rate Limited','message':'Please wait, processing your previous request...','shouldRetry':True}), 429
     try:
         product_id = None
         if gamepass_id in SUPPORTED_GAMEPASSES:
@@ -1961,356 +3476,206 @@ def check_gamepass():
             return jsonify({'error': f'Gamepass {gamepass_id} is not supported'}), 400
         _cool_key = (username.lower(), product_id)
         _now_ts = time.time()
-        if not hasattr(check_gamepass, '_recent_checks'):
-            check_gamepass._recent_checks = {}
-        last_ts = check_gamepass._recent_checks.get(_cool_key)
+        last_ts = _recent_gamepass_checks.get(_cool_key)
         if last_ts and (_now_ts - last_ts) < CHECK_GAMEPASS_COOLDOWN_SECONDS:
             retry_after = max(0, CHECK_GAMEPASS_COOLDOWN_SECONDS - (_now_ts - last_ts))
             return jsonify({'status':'Rate Limited','message':f'Please wait {retry_after:.1f}s before checking again.','shouldRetry':True,'retryAfter':round(retry_after,1)}), 429
-        check_gamepass._recent_checks[_cool_key] = _now_ts
-        product = PRODUCTS_CONFIG[product_id]
-        user_id, user_error = fetch_user_id(username)
-        if user_id is None or user_error:
-            return jsonify({'error':'Failed to verify user','detail':user_error}), 400
-        if authenticated_user:
-            pending_info = account_manager.get_pending_purchase(authenticated_user['user_id'], username, product_id)
-            logger.info(f"/check-gamepass pending lookup user={authenticated_user['user_id']} product={product_id} username={username} found={bool(pending_info)} info={pending_info}")
-        else:
-            pending_info = {'started_at': utc_now_iso(), 'guest': True}
-        pending_started_dt = None
-        if not pending_info:
-            if authenticated_user:
-                return jsonify({'hasGamepass': False, 'needStart': True, 'message': 'Start a purchase first.'})
-            else:
-                pending_info = {'started_at': utc_now_iso(), 'guest': True}
-        pending_started_dt = ensure_naive_utc(parse_ts(pending_info.get('started_at')))
-        now_naive = ensure_naive_utc(datetime.now(timezone.utc))
-        if authenticated_user and pending_started_dt and (now_naive - pending_started_dt).total_seconds() > PENDING_PURCHASE_EXPIRY_SECONDS:
-            try:
-                account_manager.pop_pending_purchase(authenticated_user['user_id'], username, product_id)
-            except Exception:
-                pass
-            return jsonify({'hasGamepass': False, 'needStart': True, 'purchaseExpired': True, 'message': 'Purchase session expired. Start a new one.'})
-        user_data = load_user_data()
-        prior_key_count = 0
-        if username in user_data:
-            prod_record = user_data[username].get(product_id)
-            if isinstance(prod_record, dict):
-                if 'keys' in prod_record and isinstance(prod_record['keys'], list):
-                    prior_key_count = len(prod_record['keys'])
-                elif prod_record.get('key_issued'):
-                    prior_key_count = 1
-
-        force_refresh = bool(data.get('force_refresh')) or bool(pending_info)
-
-        use_fast_path = SETTINGS.get('roblox', {}).get('useOwnershipFastPath', False)
-        ownership_fast_path_used = False
-        eligible_txs = []
-        if use_fast_path:
-            cycle_key = (username.lower(), product_id)
-            state = _ownership_cycles.get(cycle_key, {'cycle': 1, 'lastOwned': False})
-            roblox_cookie = SETTINGS.get('roblox', {}).get('securityCookie')
-            owned_now, owned_mode = _check_gamepass_ownership(user_id, product['gamepass_id'], roblox_cookie)
-            if state['lastOwned'] and not owned_now:
-                state['cycle'] += 1
-                logger.info(f"Ownership drop detected for {username} {product_id}; advancing to cycle {state['cycle']}")
-            if owned_now:
-                synthetic_tx_id = f"OWNC{state['cycle']}-{user_id}-{product_id}"
-                claimed_set_prefetch = _load_claimed_transactions()
-                already_claimed_cycle = synthetic_tx_id in claimed_set_prefetch
-                if not already_claimed_cycle:
-                    existing_product_record_tmp = None
-                    if username in user_data:
-                        existing_product_record_tmp = user_data[username].get(product_id)
-                    duplicate = False
-                    if existing_product_record_tmp and isinstance(existing_product_record_tmp, dict):
-                        for krec in existing_product_record_tmp.get('keys', []):
-                            if krec.get('transaction_id') == synthetic_tx_id:
-                                duplicate = True
-                                break
-                    if not duplicate:
-                        ownership_fast_path_used = True
-                        eligible_txs = [{
-                            'transactionId': synthetic_tx_id,
-                            'created': (pending_started_dt or datetime.now(timezone.utc).replace(tzinfo=None)).isoformat() + 'Z',
-                            'amount': product.get('price'),
-                            'details': f"Gamepass {product['gamepass_id']} ownership cycle {state['cycle']} ({owned_mode})",
-                            'buyerName': username
-                        }]
-                        logger.info(f"Ownership fast-path cycle {state['cycle']} success for {username} via {owned_mode}; synthetic {synthetic_tx_id}")
-            state['lastOwned'] = owned_now
-            _ownership_cycles[cycle_key] = state
-            if not ownership_fast_path_used:
-                eligible_txs = _eligible_unclaimed_transactions(username, gamepass_id=product['gamepass_id'], force_refresh=force_refresh)
-        else:
-            eligible_txs = _eligible_unclaimed_transactions(username, gamepass_id=product['gamepass_id'], force_refresh=force_refresh)
-        debug_diag = _tx_fetch_debug.get(username.lower())
-        rate_limited = False
-        if debug_diag and isinstance(debug_diag, dict) and str(debug_diag.get('reason','')).startswith('HTTP_429'):
-            rate_limited = True
-        logger.info(f"Eligible tx count for {username} force_refresh={force_refresh}: {len(eligible_txs)} diag={debug_diag} rate_limited={rate_limited}")
-        if not eligible_txs:
-            if use_fast_path and not ownership_fast_path_used:
-                roblox_cfg = SETTINGS.get('roblox', {}).get('securityCookie')
-                owned, mode = _check_gamepass_ownership(user_id, product['gamepass_id'], roblox_cfg)
-                if owned:
-                    cycle_key = (username.lower(), product_id)
-                    state = _ownership_cycles.get(cycle_key, {'cycle': 1, 'lastOwned': owned})
-                    synthetic_tx_id = f"OWNC{state['cycle']}-{user_id}-{product_id}"
-                    claimed_set_prefetch = _load_claimed_transactions()
-                    if synthetic_tx_id not in claimed_set_prefetch:
-                        eligible_txs = [{
-                            'transactionId': synthetic_tx_id,
-                            'created': (pending_started_dt or datetime.now(timezone.utc).replace(tzinfo=None)).isoformat() + 'Z',
-                            'amount': product.get('price'),
-                            'details': f"Gamepass {product['gamepass_id']} ownership fallback cycle {state['cycle']}",
-                            'buyerName': username
-                        }]
-                        debug_diag = debug_diag or {}
-                        debug_diag['ownershipFallback'] = mode
-                        debug_diag['syntheticTxId'] = synthetic_tx_id
-            if not eligible_txs:
-                poll_cfg = SETTINGS.get('roblox', {})
-                poll_attempts = int(poll_cfg.get('quickPollAttempts', 6))
-                poll_interval_ms = int(poll_cfg.get('quickPollIntervalMs', 450))
-                for _poll in range(poll_attempts):
-                    time.sleep(poll_interval_ms / 1000.0)
-                    eligible_txs = _eligible_unclaimed_transactions(username, gamepass_id=product['gamepass_id'], force_refresh=True)
-                    if eligible_txs:
-                        logger.info(f"Found transactions after quick re-poll {_poll+1}/{poll_attempts} interval={poll_interval_ms}ms")
-                        break
-            if not eligible_txs:
-                resp = {'hasGamepass': False,
-                        'message':'No recent purchase transactions detected for this user within claim window.' if not rate_limited else 'Rate limited by Roblox API. Please wait a moment then press the button again.',
-                        'priorKeyCount': prior_key_count,
-                        'hadPreviousKeys': prior_key_count > 0,
-                        'debug': debug_diag,
-                        'rate_limited': rate_limited,
-                        'shouldRetry': rate_limited}
-                if rate_limited:
-                    return jsonify(resp), 429
-                return jsonify(resp)
-        if username not in user_data:
-            user_data[username] = {}
-        existing_product_record = user_data[username].get(product_id)
-        if not existing_product_record or isinstance(existing_product_record, dict) and existing_product_record.get('key_issued'):
-            if isinstance(existing_product_record, dict) and existing_product_record.get('key_issued'):
-                existing_product_record = {
-                    'keys': [
-                        {
-                            'key': existing_product_record.get('key'),
-                            'issued_at': existing_product_record.get('issued_at'),
-                            'expiry_date': existing_product_record.get('expiry_date'),
-                            'transaction_id': existing_product_record.get('transaction_id')
-                        }
-                    ]
-                }
-            else:
-                existing_product_record = {'keys': []}
-            user_data[username][product_id] = existing_product_record
-
-        claimed_set = _load_claimed_transactions()
-        last_issued_dt = None
-        try:
-            for k in existing_product_record.get('keys', [])[-5:]: 
-                t_created = k.get('transaction_created') or k.get('issued_at') or k.get('expiry_date')
-                if not t_created: continue
-                try:
-                    dt = parse_ts(t_created)
-                    if (last_issued_dt is None) or dt > last_issued_dt:
-                        last_issued_dt = dt
-                except Exception:
-                    continue
-        except Exception as _e:
-            logger.warning(f"Failed computing last_issued_dt: {_e}")
-
-        new_tx = None
-        fallback_old_tx = None  
-        for tx in eligible_txs:
-            tx_id = tx.get('transactionId')
-            tx_created_raw = tx.get('created')
-            logger.info(f"Candidate tx id={tx_id} created={tx_created_raw} lastIssued={last_issued_dt}")
-            if not tx_id or not tx_created_raw:
-                logger.info("Skipping tx (missing id or created)")
-                continue
-            enforce_pending = SETTINGS.get('roblox', {}).get('enforcePendingStart', False)
-            if enforce_pending and pending_started_dt:
-                try:
-                    _tx_dt_pending = ensure_naive_utc(datetime.fromisoformat(tx_created_raw.replace('Z','')))
-                    if pending_started_dt and _tx_dt_pending <= pending_started_dt - timedelta(seconds=300):
-                        logger.info(f"Skip tx {tx_id} due to enforcePendingStart gating")
-                        continue
-                except Exception:
-                    logger.info(f"Skip tx {tx_id}: invalid date vs pending start (enforcePendingStart)")
-                    continue
-            if tx_id in claimed_set:
-                logger.info(f"Skip tx {tx_id} already in claimed set")
-                continue
-            if any(k.get('transaction_id') == tx_id for k in existing_product_record['keys']):
-                logger.info(f"Skip tx {tx_id} already has key issued")
-                continue
-            tx_created_dt = parse_ts(tx_created_raw)
-            if not tx_created_dt:
-                logger.info(f"Skip tx {tx_id} invalid created format")
-                continue
-            if pending_started_dt and tx_created_dt < pending_started_dt:
-                delta_sec = (pending_started_dt - tx_created_dt).total_seconds()
-                if delta_sec <= PRE_START_GRACE_SECONDS:
-                    logger.info(f"Accept tx {tx_id} within pre-start grace ({delta_sec:.1f}s before pending start)")
-                else:
-                    logger.info(f"Skip tx {tx_id}: {delta_sec:.1f}s before pending start (exceeds grace {PRE_START_GRACE_SECONDS}s)")
-                    continue
-            if last_issued_dt and tx_created_dt <= last_issued_dt:
-                allow_same_ts = False
-                if pending_started_dt and tx_created_dt >= last_issued_dt and tx_id not in claimed_set:
-                    allow_same_ts = True
-                if not allow_same_ts:
-                    logger.info(f"Skip tx {tx_id}: not newer than last issued {last_issued_dt} (same timestamp not allowed)")
-                    continue
-            new_tx = tx
-            logger.info(f"Selected new transaction {tx_id} for key issuance")
-            break
-
-        if not new_tx and not existing_product_record['keys'] and fallback_old_tx:
-            allow_grace = SETTINGS.get('roblox', {}).get('allowGracePriorTx', False)
-            grace_tx_id = fallback_old_tx.get('transactionId')
-            already_issued = any(k.get('transaction_id') == grace_tx_id for k in existing_product_record['keys'])
-            if allow_grace and grace_tx_id and grace_tx_id not in claimed_set and not already_issued:
-                new_tx = fallback_old_tx
-                logger.info(f"Grace selection of prior transaction {new_tx.get('transactionId')} (created {new_tx.get('created')}) because user has no keys and no newer tx post pending start (grace enabled).")
-            else:
-                logger.info("Grace fallback suppressed (either disabled, missing id, or already claimed).")
-
-        if not new_tx:
-            debug_diag = _tx_fetch_debug.get(username.lower())
-            return jsonify({'hasGamepass': False,
-                            'message': 'No new unclaimed purchase transaction detected.',
-                            'priorKeyCount': prior_key_count,
-                            'hadPreviousKeys': prior_key_count > 0,
-                            'waitingNewTx': True,
-                            'debug': debug_diag})
-
-        key, expiry = key_manager.generate_key_with_expiry(product_id, product.get('duration_days', 7))
-        key_entry = {
-            'key': key,
-            'issued_at': utc_now_iso(), 
-            'expiry_date': expiry.isoformat().replace('+00:00', 'Z'),
-            'transaction_id': new_tx['transactionId'],
-            'transaction_created': new_tx.get('created'),
-            'pending_started_at': pending_info.get('started_at') if pending_info else None,
-            'claim_method': 'grace' if (fallback_old_tx and new_tx is fallback_old_tx) else 'standard'
-        }
-        existing_product_record['keys'].append(key_entry)
-        with _claimed_transactions_lock:
-            claimed = _load_claimed_transactions()
-            claimed.add(new_tx['transactionId'])
-            _persist_claimed_transactions()
-
-        def update_github_async():
-            try:
-                stock_file = product.get('stock_file', f'Stock/{gamepass_id.upper()}-Stock')
-                if '/' not in stock_file:
-                    stock_file = f'Stock/{stock_file}'
-                bought_file = product.get('bought_file', 'Keys-Bought')
-                def mutate_stock(lines):
-                    return lines[1:] if lines else lines
-                github_atomic_update(stock_file, mutate_stock, f"Dispense key for {product['name']}")
-                def mutate_bought(lines):
-                    lines.append(key)
-                    return lines
-                github_atomic_update(bought_file, mutate_bought, f"Record key for {product['name']}")
-                save_user_data(user_data)
-            except Exception as e:
-                logger.error(f"Async atomic GitHub update error: {e}")
-            finally:
-                global _last_forced_push_time
-                _last_forced_push_time = time.time()
-
-        if authenticated_user:
-            try:
-                purchase_data = {'product_name': product['name'], 'product_id': product_id, 'key': key, 'roblox_username': username, 'price': product.get('price', 1), 'gamepass_id': product['gamepass_id'], 'transaction_id': new_tx['transactionId'], 'transaction_created': new_tx.get('created')}
-                account_manager.add_purchase_to_history(authenticated_user['user_id'], purchase_data)
-            except Exception as log_err:
-                logger.error(f"Purchase history logging error: {log_err}")
-        if authenticated_user:
-            try:
-                account_manager.pop_pending_purchase(authenticated_user['user_id'], username, product_id)
-            except Exception:
-                pass
-        threading.Thread(target=update_github_async).start()
-        return jsonify({
-            'hasGamepass': True,
-            'keyIssued': True,
-            'key': key,
-            'expiryDate': expiry.isoformat(),
-            'isNewKey': True,
-            'transactionId': new_tx['transactionId'],
-            'priorKeyCount': prior_key_count,
-            'hadPreviousKeys': prior_key_count > 0
-        })
+        _recent_gamepass_checks[_cool_key] = _now_ts
+        body, status = _check_gamepass_and_wait(username, product_id, authenticated_user, force_refresh=bool(data.get('force_refresh')))
+        return jsonify(body), status
     except Exception as e:
         logger.error(f"Error in gamepass check: {e}")
         return jsonify({'error':'Internal server error'}), 500
-    finally:
-        user_lock.release()
 
-def _build_initial_products_json():
-    """Generate lightweight products JSON without per-request GitHub fetch when possible.
-    Uses latest cached /products payload if fresh (<=5s) else regenerates by calling logic.
+def _check_gamepass_and_wait(username, product_id, authenticated_user, force_refresh=False):
+    """Run the issuance pipeline under the buyer's lock and, when no transaction is eligible
+    yet, wait up to quickWaitMs for one on the transaction waiter registry with the lock
+    released (the background matcher needs the same lock), then run it once more.
+    A check that waits out checkLockWaitSeconds behind the matcher picks up the key the
+    matcher issued meanwhile, if any, instead of reporting nothing new."""
+    cfg = SETTINGS.get('roblox', {})
+    wait_ms = cfg.get('quickWaitMs')
+    if wait_ms is None:
+        wait_ms = int(cfg.get('quickPollAttempts', 6)) * int(cfg.get('quickPollIntervalMs', 450))
+    gamepass_id = PRODUCTS_CONFIG[product_id]['gamepass_id']
+    status_key = _purchase_status_key(authenticated_user['user_id'], product_id, username) if authenticated_user else None
+    before = (purchase_status.get(status_key) or {}).get('version', 0) if status_key else 0
+    wait_started = time.time()
+    deadline = wait_started + int(wait_ms) / 1000.0
+    waiter = None
+    try:
+        while True:
+            user_lock = get_user_lock(username)
+            if not user_lock.acquire(timeout=float(cfg.get('checkLockWaitSeconds', 10))):
+                return {'error': 'Your purchase is being processed, please check again.', 'hasGamepass': False, 'shouldRetry': True}, 503
+            try:
+                body, status = _process_gamepass_check(username, product_id, authenticated_user, force_refresh=force_refresh)
+            finally:
+                user_lock.release()
+            if not body.get('keyIssued') and status_key:
+                current = purchase_status.get(status_key) or {}
+                if current.get('status') == 'key_issued' and current.get('version', 0) > before:
+                    return current['result'], 200
+            if not body.get('awaitingTransactions'):
+                if waiter is not None and body.get('keyIssued'):
+                    logger.info(f"Found transactions after waiting {(time.time() - wait_started) * 1000:.0f}ms (budget {wait_ms}ms)")
+                return body, status
+            if time.time() >= deadline:
+                return body, status
+            if waiter is None:
+                waiter = transaction_waiters.register(username, gamepass_id)
+            force_refresh = False
+            while not _eligible_unclaimed_transactions(username, gamepass_id=gamepass_id):
+                if not waiter.wait(deadline - time.time()):
+                    return body, status
+    finally:
+        if waiter is not None:
+            transaction_waiters.unregister(waiter)
+
+_purchase_matchers = {}
+_purchase_matchers_lock = threading.Lock()
+
+def _ensure_purchase_matcher(user, roblox_username, product_id):
+    """Start the background matcher for a pending purchase unless one is already running."""
+    key = _purchase_status_key(user['user_id'], product_id, roblox_username)
+    with _purchase_matchers_lock:
+        thread = _purchase_matchers.get(key)
+        if thread is not None and thread.is_alive():
+            return key
+        thread = threading.Thread(target=_purchase_matcher_loop, args=(key, user, roblox_username, product_id), name='purchase-matcher', daemon=True)
+        _purchase_matchers[key] = thread
+        thread.start()
+    return key
+
+def _purchase_matcher_loop(key, user, roblox_username, product_id):
+    """Drive one pending purchase to completion while a status stream is listening.
+
+    Blocks on the transaction waiter registry (fed by the ingest thread) and re-runs the
+    issuance pipeline when new transactions arrive or every matcherRecheckSeconds. The
+    pipeline publishes detected/key_issued itself. Exits on a terminal status or once no
+    stream has been subscribed for matcherIdleSeconds.
     """
-    cached = get_cached_response('products_endpoint', max_age_seconds=5)
-    if cached:
-        return cached
+    cfg = SETTINGS.get('roblox', {})
+    recheck = float(cfg.get('matcherRecheckSeconds', 15))
+    idle_limit = float(cfg.get('matcherIdleSeconds', 30))
+    product = PRODUCTS_CONFIG.get(product_id) or {}
+    waiter = transaction_waiters.register(roblox_username, product.get('gamepass_id'))
+    idle_since = None
     try:
-        import json as _json
-        with open('config/products.json','r') as f:
-            cfg = _json.load(f)
-        products = []
-        for pid, product_config in PRODUCTS_CONFIG.items():
-            stock_count = None
-            if github_manager:
+        while True:
+            user_lock = get_user_lock(roblox_username)
+            if user_lock.acquire(timeout=recheck):
                 try:
-                    stock_file = product_config.get('stock_file', f'{pid.upper()}-Stock')
-                    current_stock = github_manager.get_file_content(stock_file)
-                    stock_count = len(current_stock) if current_stock else 0
-                except Exception:
-                    stock_count = None
-            products.append({
-                'id': pid,
-                'name': product_config.get('name', pid.title()),
-                'price': product_config.get('price', 1),
-                'gamepass_id': product_config.get('gamepass_id') or product_config.get('gamepassId'),
-                'gamepassUrl': product_config.get('gamepass_url') or product_config.get('gamepassUrl'),
-                'duration': product_config.get('duration', '7 Days'),
-                'stock': stock_count,
-                'parentProduct': product_config.get('parentProduct')
-            })
-        main_products = []
-        if 'mainProducts' in cfg:
-            for main_product in cfg['mainProducts']:
-                variants = [p for p in products if p.get('parentProduct') == main_product['id']]
-                total_stock = sum(p['stock'] for p in variants if isinstance(p['stock'], int))
-                min_price = min((p['price'] for p in variants), default=0)
-                main_products.append({
-                    **main_product,
-                    'totalStock': total_stock,
-                    'minPrice': min_price,
-                    'variantProducts': variants
-                })
-        payload = {
-            'products': products,
-            'mainProducts': main_products,
-            'generatedAt': datetime.now(timezone.utc).isoformat() + 'Z'
-        }
-        cache_response('products_endpoint', payload)
-        return payload
-    except Exception:
-        return {'products': [], 'mainProducts': [], 'generatedAt': datetime.now(timezone.utc).isoformat() + 'Z'}
+                    body, _status = _process_gamepass_check(roblox_username, product_id, user)
+                except Exception as e:
+                    logger.error(f"Purchase matcher error for {key}: {e}")
+                    body = {}
+                finally:
+                    user_lock.release()
+                if body.get('keyIssued'):
+                    return
+                if body.get('needStart'):
+                    current = purchase_status.get(key) or {}
+                    if current.get('status') not in PurchaseStatusBoard.TERMINAL:
+                        purchase_status.publish(key, 'expired', message=body.get('message'))
+                    return
+            if purchase_status.subscriber_count(key) == 0:
+                idle_since = idle_since or time.time()
+                if time.time() - idle_since > idle_limit:
+                    logger.info(f"Purchase matcher {key} idle for {idle_limit:.0f}s; stopping")
+                    return
+            else:
+                idle_since = None
+            waiter.wait(recheck)
+    finally:
+        transaction_waiters.unregister(waiter)
+        with _purchase_matchers_lock:
+            if _purchase_matchers.get(key) is threading.current_thread():
+                del _purchase_matchers[key]
+
+def _match_pending_sales(records):
+    """Start a matcher for each pending purchase whose buyer shows up in freshly fetched sales
+    of the gamepass they are waiting on, whether or not a status stream is open."""
+    claimed = None
+    by_gamepass = {}
+    for rec in records:
+        if rec.get('detailsId') and rec.get('buyerName'):
+            by_gamepass.setdefault(str(rec['detailsId']), []).append(rec)
+    for gamepass_id, sales in by_gamepass.items():
+        waiting = pending_purchases.pending_for_gamepass(gamepass_id)
+        if not waiting:
+            continue
+        if claimed is None:
+            claimed = _load_claimed_transactions()
+        for entry in waiting:
+            started = _epoch_from_iso(entry['started_at']) or 0
+            if not any(rec['buyerName'].lower() == entry['roblox_username']
+                       and rec.get('transactionId') not in claimed
+                       and (_epoch_from_iso(rec.get('created')) or 0) >= started - PRE_START_GRACE_SECONDS
+                       for rec in sales):
+                continue
+            user = _session_user(entry['user_id'])
+            if user:
+                _ensure_purchase_matcher(user, entry['roblox_username'], entry['product_id'])
+
+def _on_pending_expired(entry):
+    """Tell any open status stream that its pending purchase timed out."""
+    key = _purchase_status_key(entry['user_id'], entry['product_id'], entry['roblox_username'])
+    current = purchase_status.get(key)
+    if current and current.get('status') not in PurchaseStatusBoard.TERMINAL:
+        purchase_status.publish(key, 'expired', message='Purchase session expired. Start a new one.')
+
+pending_purchases.on_expire = _on_pending_expired
+pending_purchases.load_snapshot()
+
+@app.route('/purchase-stream')
+def purchase_stream():
+    """Server-Sent Events stream for a pending purchase started via /start-purchase.
+    Query params: product_id=, roblox_username=. Pushes waiting -> detected -> key_issued
+    (or expired) as the background matcher makes progress.
+    """
+    user = get_authenticated_user()
+    if not user:
+        return jsonify({'error': 'Start a purchase first', 'needStart': True}), 401
+    roblox_username = request.args.get('roblox_username') or request.args.get('username')
+    product_id = request.args.get('product_id') or request.args.get('product')
+    if not roblox_username or not product_id:
+        return jsonify({'error': 'roblox_username and product_id required'}), 400
+    if product_id not in PRODUCTS_CONFIG:
+        return jsonify({'error': 'Unknown product'}), 400
+    key = _purchase_status_key(user['user_id'], product_id, roblox_username)
+    entry = purchase_status.get(key)
+    if pending_purchases.get(user['user_id'], roblox_username, product_id):
+        if not entry:
+            purchase_status.publish(key, 'waiting')
+        _ensure_purchase_matcher(user, roblox_username, product_id)
+    elif not entry or entry['status'] != 'key_issued':
+        return jsonify({'error': 'No pending purchase', 'needStart': True}), 404
+
+    def event_stream():
+        yield 'retry: 5000\n'
+        purchase_status.subscribe(key)
+        try:
+            version = 0
+            while True:
+                current = purchase_status.wait_for_change(key, version, timeout=15)
+                if current is None:
+                    yield ': keepalive\n\n'
+                    continue
+                version = current['version']
+                yield f'data: {json.dumps(current)}\n\n'
+                if current['status'] in PurchaseStatusBoard.TERMINAL:
+                    break
+        except GeneratorExit:
+            pass
+        finally:
+            purchase_status.unsubscribe(key)
+    return app.response_class(event_stream(), mimetype='text/event-stream')
 
 @app.route('/')
 def serve_index():
     try:
-        initial = _build_initial_products_json()
+        initial = stock_snapshots.get().payload
         with open('index.html','r', encoding='utf-8') as f:
             html = f.read()
         injection = f"<script>window.__INITIAL_PRODUCTS__ = {json.dumps(initial)};</script>"
@@ -2429,7 +3794,7 @@ def debug_whoami():
         return jsonify({'error':'NO_COOKIE_OR_PLACEHOLDER'})
     headers = {'Cookie': f'.ROBLOSECURITY={cookie}', 'Accept': 'application/json'}
     try:
-        r = requests.get('https://users.roblox.com/v1/users/authenticated', headers=headers, timeout=6)
+        r = roblox_client.get('https://users.roblox.com/v1/users/authenticated', endpoint='users', headers=headers)
         if r.status_code != 200:
             return jsonify({'error': f'AUTH_{r.status_code}', 'status': r.status_code, 'body': r.text[:800]})
         j = r.json()
@@ -2440,6 +3805,42 @@ def debug_whoami():
     except Exception as e:
         return jsonify({'error': f'EXC_{type(e).__name__}'})
 
+@app.route('/debug/roblox')
+def debug_roblox_client():
+    """Roblox API client counters: per-endpoint latency/errors, breaker states, cooldowns, rate limit buckets and username batching."""
+    stats = roblox_client.stats()
+    stats['rateLimits'] = roblox_rate_limiter.stats()
+    stats['usernameResolver'] = username_resolver.stats()
+    stats['txSingleFlight'] = _tx_flight.stats()
+    stats['ownership'] = ownership_service.stats()
+    return jsonify(stats)
+
+@app.route('/debug/auth')
+def debug_auth():
+    """Password hashing pool: cost factor, workers, queue depth, shed count and average hash time."""
+    return jsonify(password_hasher.stats())
+
+@app.route('/debug/stock')
+def debug_stock():
+    """Stock snapshot service (version, age, refreshes) and the in-memory stock counters with recorded drift."""
+    stats = stock_snapshots.stats()
+    stats['counters'] = stock_counters.stats()
+    return jsonify(stats)
+
+@app.route('/debug/pending')
+def debug_pending():
+    """Pending purchase store: live entries, index sizes, expired/completed counters."""
+    return jsonify(pending_purchases.stats())
+
+@app.route('/debug/caches')
+def debug_caches():
+    """Size, hit/miss and eviction counters for every bounded in-memory cache."""
+    caches = [_roblox_tx_cache, _seller_id_cache, _roblox_buyer_name_cache, _user_last_api_call, _tx_fetch_debug,
+              _ownership_cycles, _recent_gamepass_checks, user_locks, request_cache, _session_user_cache, _purchase_index_cache,
+              username_resolver.positive, username_resolver.negative, purchase_status._entries, guest_sessions._sessions,
+              transaction_waiters._known]
+    return jsonify({c.name: c.stats() for c in caches})
+
 
 def is_admin_authenticated():
     return session.get('is_admin') is True
@@ -2478,6 +3879,9 @@ def admin_list_accounts():
     if unauthorized:
         return unauthorized
     accounts = account_manager.load_accounts()
+    query = (request.args.get('q') or '').strip()
+    if query:
+        accounts = {uid: accounts[uid] for uid in account_manager.search(query) if uid in accounts}
     simplified = [
         {
             'user_id': uid,
@@ -2488,7 +3892,7 @@ def admin_list_accounts():
             'last_login': acc.get('last_login')
         } for uid, acc in accounts.items()
     ]
-    return jsonify({'success': True, 'accounts': simplified})
+    return jsonify({'success': True, 'accounts': simplified, 'query': query or None})
 
 @app.route('/admin/accounts/<user_id>', methods=['GET'])
 def admin_get_account(user_id):
@@ -2498,6 +3902,10 @@ def admin_get_account(user_id):
     user = account_manager.get_user_by_id(user_id)
     if not user:
         return jsonify({'success': False, 'error': 'Not found'}), 404
+    ordered, _version = _purchase_history_index(user_id)
+    from_log = {r.get('purchase_id'): r for r in purchase_history_manager.read_refs([e[3] for e in ordered if isinstance(e[3], tuple)])}
+    history = [from_log.get(e[1]) if isinstance(e[3], tuple) else e[3] for e in reversed(ordered)]
+    user['purchase_history'] = [p for p in history if p]
     return jsonify({'success': True, 'account': user})
 
 @app.route('/admin/accounts/<user_id>', methods=['DELETE'])
@@ -2509,6 +3917,42 @@ def admin_delete_account(user_id):
     code = 200 if success else 400
     return jsonify({'success': success, 'message': msg}), code
 
+@app.route('/admin/analytics', methods=['GET'])
+def admin_analytics():
+    """Sales rollups per product. Query params: granularity=day|hour (default day),
+    since= / until= (bucket prefixes such as 2024-05 or 2024-05-01T13), product=."""
+    unauthorized = require_admin()
+    if unauthorized:
+        return unauthorized
+    granularity = request.args.get('granularity', 'day')
+    since = request.args.get('since')
+    if not since:
+        window = timedelta(days=2) if granularity == 'hour' else timedelta(days=30)
+        since = (datetime.now(timezone.utc) - window).strftime('%Y-%m-%dT%H' if granularity == 'hour' else '%Y-%m-%d')
+    try:
+        result = sales_analytics.query(granularity, since=since, until=request.args.get('until'),
+                                       product_id=request.args.get('product'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    names = {pid: PRODUCTS_CONFIG[pid]['name'] for pid in result['products'] if pid in PRODUCTS_CONFIG}
+    return jsonify({'success': True, 'since': since, 'names': names, 'status': sales_analytics.stats(), **result})
+
+@app.route('/admin/analytics/backfill', methods=['POST'])
+def admin_analytics_backfill():
+    """Rebuild the rollups from the purchase log in the background."""
+    unauthorized = require_admin()
+    if unauthorized:
+        return unauthorized
+    if sales_analytics.stats()['backfillRunning']:
+        return jsonify({'success': False, 'error': 'Backfill already running'}), 409
+    def _run():
+        try:
+            sales_analytics.backfill(purchase_history_manager.iter_purchases())
+        except Exception as e:
+            logger.error(f"Analytics backfill failed: {e}")
+    threading.Thread(target=_run, name='analytics-backfill', daemon=True).start()
+    return jsonify({'success': True, 'message': 'Backfill started'}), 202
+
 _admin_panel_route = None
 def _get_admin_panel_route():
     global _admin_panel_route
@@ -2523,9 +3967,66 @@ def _get_admin_panel_route():
 def dynamic_admin_panel(maybe_admin):
     if maybe_admin == _get_admin_panel_route()+'' and os.path.exists(f'{maybe_admin}.html'):
         return send_file(f'{maybe_admin}.html')
-    if os.path.exists(maybe_admin):
-        return send_file(maybe_admin)
     return jsonify({'error':'Not found'}), 404
 
+@app.cli.command('migrate-purchase-history')
+@click.option('--dry-run', is_flag=True, help='Only report what would be moved.')
+def migrate_purchase_history_command(dry_run):
+    """Move purchase_history lists embedded in account records into the purchase log.
+
+    Accounts are processed one at a time: purchases not yet in the user's log index are
+    appended in one batch, then the account keeps only total_purchases. Safe to re-run."""
+    accounts = account_manager.load_accounts()
+    moved = migrated = bytes_before = bytes_after = 0
+    for user_id in sorted(accounts):
+        account = account_manager.accounts.get(user_id) or {}
+        embedded = account.get('purchase_history') or []
+        if 'purchase_history' not in account:
+            continue
+        before = len(json.dumps(account, separators=(',', ':')))
+        known = {entry[3] for entry in purchase_history_manager.user_index(user_id)[0]}
+        missing = [dict(p, user_id=user_id) for p in embedded if p.get('purchase_id') not in known]
+        total = max(account_manager.purchase_count(account), len(known | {p.get('purchase_id') for p in embedded}))
+        if dry_run:
+            click.echo(f"{user_id}: {len(missing)} to move, {len(embedded) - len(missing)} already logged")
+            moved += len(missing)
+            continue
+        if missing:
+            ok, _ids = purchase_history_manager.add_purchases(missing)
+            if not ok:
+                click.echo(f"{user_id}: log append failed; account left unchanged", err=True)
+                continue
+        buyers = sorted(AccountManager._roblox_names(account) - {(account.get('roblox_username') or '').lower()})
+        def _strip(acct):
+            acct.pop('purchase_history', None)
+            acct['total_purchases'] = total
+            if buyers:
+                acct['roblox_usernames'] = buyers
+            return len(json.dumps(acct, separators=(',', ':')))
+        saved, after = account_manager.update_account(user_id, _strip)
+        if not saved:
+            click.echo(f"{user_id}: moved {len(missing)} purchases but the account write failed; re-run to finish", err=True)
+            continue
+        moved += len(missing)
+        migrated += 1
+        bytes_before += before
+        bytes_after += after
+        click.echo(f"{user_id}: moved {len(missing)}, total_purchases={total}")
+    if dry_run:
+        click.echo(f"Dry run: {moved} purchases would move")
+    else:
+        click.echo(f"Migrated {migrated} accounts, moved {moved} purchases; account records {bytes_before} -> {bytes_after} bytes")
+
+@app.cli.command('rebuild-purchase-indexes')
+def rebuild_purchase_indexes_command():
+    """Re-derive every user's purchase index from the log segments, adding missing entries.
+
+    Entries already indexed are left alone, so this is safe to re-run at any time."""
+    purchase_history_manager.load()
+    result = purchase_history_manager.rebuild_indexes()
+    click.echo(f"Scanned {result['segments']} segments for {result['users']} users; {len(result['failed'])} index writes failed")
+    if result['failed']:
+        click.echo('Failed: ' + ', '.join(result['failed']), err=True)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,46 @@
+"""
+Single-Flight Request Coalescing
+Concurrent callers asking for the same key share one execution: the first caller runs
+the function, everyone else blocks on the same future and receives its result (or error).
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) unless a call for key is already in flight, in which case wait for it."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._calls.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._calls.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'executed': self.executed, 'shared': self.shared, 'inFlight': len(self._calls)}
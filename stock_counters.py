@@ -0,0 +1,163 @@
+"""
+Stock Counters
+In-memory per-product stock counts kept current by the code paths that change stock, so
+the storefront can report exact counts without reading stock files. A low-frequency
+background pass re-reads storage and records any drift it finds.
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StockCounters:
+    def __init__(self, load: Optional[Callable[[str], Optional[int]]] = None,
+                 product_ids: Optional[Callable[[], Iterable[str]]] = None,
+                 on_change: Optional[Callable[[str], None]] = None,
+                 reconcile_interval: float = 600.0, drift_history: int = 100):
+        """load(product_id) reads the stored count (None on failure); product_ids() lists the
+        products to reconcile; on_change(product_id) runs after every in-memory change.
+
+        A product's count is stored - pending: `stored` is the last count known to be in
+        storage, `pending` the dispenses already handed out whose stock write has not landed."""
+        self.load = load
+        self.product_ids = product_ids
+        self.on_change = on_change
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._stored: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}
+        self._generation: Dict[str, int] = {}
+        self._reconciler = None
+        self.drift = deque(maxlen=drift_history)
+        self.reconciles = 0
+        self.loads = 0
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.stockCounters overrides (reconcileSeconds)."""
+        if not cfg:
+            return
+        self.reconcile_interval = float(cfg.get('reconcileSeconds', self.reconcile_interval))
+
+    def _changed(self, product_id: str):
+        # caller holds self._lock
+        self._generation[product_id] = self._generation.get(product_id, 0) + 1
+
+    def _notify(self, product_id: str):
+        if self.on_change:
+            try:
+                self.on_change(product_id)
+            except Exception as e:
+                logger.error(f"Stock change callback failed for {product_id}: {e}")
+
+    def count(self, product_id: str) -> Optional[int]:
+        """Current count, loading it from storage the first time a product is asked for."""
+        self._ensure_reconciler()
+        with self._lock:
+            if product_id in self._stored:
+                return max(0, self._stored[product_id] - self._pending.get(product_id, 0))
+        self._load(product_id, record_drift=False)
+        with self._lock:
+            if product_id not in self._stored:
+                return None
+            return max(0, self._stored[product_id] - self._pending.get(product_id, 0))
+
+    def _load(self, product_id: str, record_drift: bool):
+        """Read the stored count and adopt it, unless the product changed in memory (or had a
+        write in flight) while the read was running."""
+        with self._lock:
+            generation = self._generation.get(product_id, 0)
+            busy = self._pending.get(product_id, 0) > 0
+        if record_drift and busy:
+            return
+        actual = self.load(product_id) if self.load else None
+        self.loads += 1
+        if actual is None:
+            return
+        with self._lock:
+            if self._generation.get(product_id, 0) != generation:
+                return
+            if record_drift and self._pending.get(product_id, 0):
+                return
+            expected = self._stored.get(product_id)
+            if expected == actual:
+                return
+            self._stored[product_id] = actual
+            self._changed(product_id)
+        if record_drift and expected is not None:
+            self.drift.append({'product': product_id, 'expected': expected, 'actual': actual,
+                               'at': time.time()})
+            logger.warning(f"Stock drift for {product_id}: counter {expected}, storage {actual}")
+        self._notify(product_id)
+
+    def reserve(self, product_id: str):
+        """A key was handed out; its stock write has not happened yet."""
+        with self._lock:
+            self._pending[product_id] = self._pending.get(product_id, 0) + 1
+            self._changed(product_id)
+        self._notify(product_id)
+
+    def commit(self, product_id: str, stored_count: int):
+        """The stock write for one reserved dispense landed, leaving stored_count keys."""
+        with self._lock:
+            self._pending[product_id] = max(0, self._pending.get(product_id, 0) - 1)
+            self._stored[product_id] = stored_count
+            self._changed(product_id)
+        self._notify(product_id)
+
+    def release(self, product_id: str):
+        """The stock write for a reserved dispense failed; storage still has the key."""
+        with self._lock:
+            self._pending[product_id] = max(0, self._pending.get(product_id, 0) - 1)
+            self._changed(product_id)
+        self._notify(product_id)
+
+    def set_stored(self, product_id: str, stored_count: int):
+        """Storage was rewritten outside the dispense path (e.g. a restock) with stored_count keys."""
+        with self._lock:
+            self._stored[product_id] = stored_count
+            self._changed(product_id)
+        self._notify(product_id)
+
+    def reconcile(self) -> int:
+        """Compare every product's counter with storage, adopting the stored count on drift.
+        Products with a dispense in flight are skipped until the next pass. Returns drift found."""
+        before = len(self.drift)
+        for product_id in list(self.product_ids() if self.product_ids else ()):
+            try:
+                self._load(product_id, record_drift=True)
+            except Exception as e:
+                logger.error(f"Stock reconcile failed for {product_id}: {e}")
+        self.reconciles += 1
+        return len(self.drift) - before
+
+    def _ensure_reconciler(self):
+        if self._reconciler is None and self.load is not None:
+            with self._lock:
+                if self._reconciler is None:
+                    self._reconciler = threading.Thread(target=self._reconcile_loop, name='stock-reconcile', daemon=True)
+                    self._reconciler.start()
+
+    def _reconcile_loop(self):
+        while True:
+            time.sleep(self.reconcile_interval)
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Stock reconcile pass failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {pid: {'stored': stored, 'pending': self._pending.get(pid, 0)}
+                      for pid, stored in self._stored.items()}
+        return {
+            'products': counts,
+            'reconcileSeconds': self.reconcile_interval,
+            'reconciles': self.reconciles,
+            'loads': self.loads,
+            'drift': list(self.drift),
+        }
@@ -0,0 +1,154 @@
+"""
+Stock Snapshot Service
+Builds one versioned snapshot of every product's stock (fetched concurrently) and serves it
+to /products, /stock-stream and the index page. A stale snapshot is refreshed by a single
+caller; everyone else waits for that refresh instead of starting their own.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+StockCount = Union[int, str, None]
+
+
+class StockSnapshot:
+    """Immutable stock view. `version` only moves when the stock or catalog changes."""
+
+    def __init__(self, version: int, products: List[dict], main_products: List[dict], generated_at: str):
+        self.version = version
+        self.generated_at = generated_at
+        self.products = products
+        self.main_products = main_products
+        self.etag = hashlib.sha256(f"{version}:{generated_at}".encode('utf-8')).hexdigest()
+        self.payload = {'products': products, 'mainProducts': main_products, 'generatedAt': generated_at}
+        self.stream_payload = {
+            'products': {p['id']: {'stock': p['stock'] if isinstance(p['stock'], int) else None,
+                                   'price': p['price'], 'parentProduct': p['parentProduct']} for p in products},
+            'mainProducts': [{'id': mp['id'], 'name': mp.get('name'), 'totalStock': mp['totalStock'],
+                              'minPrice': mp['minPrice'], 'variantIds': [v['id'] for v in mp['variantProducts']]}
+                             for mp in main_products],
+            'generatedAt': generated_at,
+            'version': version,
+        }
+        self.stream_json = json.dumps(self.stream_payload)
+
+
+class StockSnapshotService:
+    def __init__(self, catalog: Optional[Callable[[], Tuple[Dict[str, dict], List[dict]]]] = None,
+                 count_stock: Optional[Callable[[str, dict], StockCount]] = None, max_age: float = 5.0, workers: int = 8):
+        """catalog() -> (products_config, main_products_config); count_stock(product_id, product)
+        -> int, a status string such as 'not_configured', or None when the fetch failed."""
+        self.catalog = catalog
+        self.count_stock = count_stock
+        self.max_age = max_age
+        self.workers = workers
+        self._pool = None
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._snapshot: Optional[StockSnapshot] = None
+        self._fetched_at = 0.0
+        self._fingerprint = None
+        self.refreshes = 0
+        self.last_refresh_ms = None
+
+    def configure(self, cfg: Optional[dict]):
+        """Apply settings.stockSnapshot overrides (maxAgeSeconds, workers)."""
+        if not cfg:
+            return
+        self.max_age = float(cfg.get('maxAgeSeconds', self.max_age))
+        workers = int(cfg.get('workers', self.workers))
+        if workers != self.workers:
+            with self._lock:
+                old, self._pool, self.workers = self._pool, None, workers
+            if old is not None:
+                old.shutdown(wait=False)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stock-snapshot')
+            return self._pool
+
+    def _safe_count(self, product_id: str, product: dict) -> StockCount:
+        try:
+            return self.count_stock(product_id, product)
+        except Exception as e:
+            logger.error(f"Error getting stock for {product_id}: {e}")
+            return None
+
+    def get(self, max_age: Optional[float] = None) -> StockSnapshot:
+        """Current snapshot, refreshed first if older than max_age (default self.max_age)."""
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            snapshot, fetched_at = self._snapshot, self._fetched_at
+        if snapshot is not None and time.time() - fetched_at <= max_age:
+            return snapshot
+        return self._flight.do('refresh', self.refresh)
+
+    def invalidate(self):
+        """Force the next get() to refresh."""
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def refresh(self) -> StockSnapshot:
+        started = time.perf_counter()
+        products_cfg, main_cfg = self.catalog()
+        ids = list(products_cfg)
+        counts = list(self._get_pool().map(lambda pid: self._safe_count(pid, products_cfg[pid]), ids))
+        products = []
+        for pid, stock in zip(ids, counts):
+            pc = products_cfg[pid]
+            products.append({
+                'id': pid,
+                'name': pc.get('name', pid.title()),
+                'price': pc.get('price', 1),
+                'gamepass_id': pc.get('gamepass_id'),
+                'gamepassUrl': pc.get('gamepass_url'),
+                'duration': pc.get('duration', '7 Days'),
+                'stock': 'unavailable' if stock is None else stock,
+                'parentProduct': pc.get('parentProduct'),
+            })
+        main_products = []
+        for mp in main_cfg or []:
+            variants = [p for p in products if p.get('parentProduct') == mp['id']]
+            main_products.append({
+                **mp,
+                'totalStock': sum(p['stock'] for p in variants if isinstance(p['stock'], int)),
+                'minPrice': min((p['price'] for p in variants), default=0),
+                'variantProducts': variants,
+            })
+        fingerprint = json.dumps([products, main_products], sort_keys=True, default=str)
+        with self._lock:
+            current = self._snapshot
+            if current is None or fingerprint != self._fingerprint:
+                version = (current.version if current else 0) + 1
+                generated_at = datetime.now(timezone.utc).isoformat() + 'Z'
+                self._snapshot = StockSnapshot(version, products, main_products, generated_at)
+                self._fingerprint = fingerprint
+            self._fetched_at = time.time()
+            self.refreshes += 1
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 1)
+            return self._snapshot
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                'version': snapshot.version if snapshot else None,
+                'ageSeconds': round(time.time() - self._fetched_at, 1) if snapshot else None,
+                'maxAge': self.max_age,
+                'workers': self.workers,
+                'refreshes': self.refreshes,
+                'lastRefreshMs': self.last_refresh_ms,
+                'flight': self._flight.stats(),
+            }
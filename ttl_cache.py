@@ -0,0 +1,159 @@
+"""
+Bounded TTL/LRU Cache
+Thread-safe mapping with a maximum size, per-entry time-to-live, O(1) LRU eviction and
+hit/miss/eviction counters. Used for every server-side memo dict so they stop growing
+with each distinct username seen.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, sliding: bool = False, name: Optional[str] = None):
+        """maxsize: entries kept before LRU eviction; ttl: default seconds an entry lives;
+        sliding: if True a successful lookup pushes the entry's expiry out by its ttl again."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self.name = name
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [value, set_at, expires_at, ttl]
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key, max_age: Optional[float] = None):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry[2] <= now:
+            del self._data[key]
+            self.expirations += 1
+            return None
+        if max_age is not None and now - entry[1] > max_age:
+            return None
+        self._data.move_to_end(key)
+        if self.sliding:
+            entry[2] = now + entry[3]
+        return entry
+
+    def _trim(self):
+        now = time.monotonic()
+        while self._data:
+            first_key = next(iter(self._data))
+            if self._data[first_key][2] > now:
+                break
+            del self._data[first_key]
+            self.expirations += 1
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default: Any = None, max_age: Optional[float] = None) -> Any:
+        """Return the cached value, or default if missing, expired, or older than max_age seconds."""
+        with self._lock:
+            entry = self._lookup(key, max_age)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = [value, now, now + ttl, ttl]
+            self._trim()
+
+    def age(self, key) -> Optional[float]:
+        """Seconds since key was last set, or None if absent/expired."""
+        with self._lock:
+            entry = self._lookup(key)
+            return None if entry is None else time.monotonic() - entry[1]
+
+    def get_or_create(self, key, factory: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Atomically return the live value for key, creating it with factory() if needed."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            value = factory()
+            self.set(key, value, ttl)
+            return value
+
+    def setdefault(self, key, default=None):
+        return self.get_or_create(key, lambda: default)
+
+    def pop(self, key, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                return default
+            del self._data[key]
+            return entry[0]
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def keys(self):
+        now = time.monotonic()
+        with self._lock:
+            return [k for k, e in self._data.items() if e[2] > now]
+
+    def values(self):
+        now = time.monotonic()
+        with self._lock:
+            return [e[0] for e in self._data.values() if e[2] > now]
+
+    def items(self):
+        now = time.monotonic()
+        with self._lock:
+            return [(k, e[0]) for k, e in self._data.items() if e[2] > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }